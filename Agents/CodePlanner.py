@@ -14,4 +14,4 @@ class CodePlanner(Agent):
         messages: List[ChatMessageType] = list[ChatMessageType]()
         messages.append({"role": "system", "content": self.system_msg})
         messages.append({'role': 'user', 'content': self.prompt_templates.get(template_key).format(kwargs)})
-        api.chat_completion(messages)
+        api.chat_completion(messages, template_key=template_key, template_vars=kwargs)
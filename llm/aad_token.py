@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from llm.config import LLMModuleConfig
+
+logger = logging.getLogger(__name__)
+
+
+class AADTokenProvider:
+    """
+    In-memory AAD token holder.
+    The token is kept together with its expiry and refreshed by a background timer shortly before it expires,
+    so msal and the token cache file are only touched on refresh instead of on every request.
+    """
+    # tokens this close to expiry are never handed out, even if the background refresh has not landed yet
+    MIN_VALIDITY_SECONDS = 30
+    MIN_REFRESH_DELAY_SECONDS = 5
+
+    def __init__(self, config: LLMModuleConfig):
+        self.config = config
+        self.refresh_margin = config.aad_token_refresh_margin
+        self._token: Optional[str] = None
+        self._expires_at: float = 0
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+
+    def is_valid(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - AADTokenProvider.MIN_VALIDITY_SECONDS
+
+    def get_token(self) -> str:
+        if self.is_valid():
+            return self._token
+        with self._lock:
+            if not self.is_valid():
+                self._refresh(interactive=True)
+            return self._token
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _refresh(self, interactive: bool):
+        result = self._acquire_token(interactive)
+        self._token = result["access_token"]
+        expires_in = int(result.get("expires_in", 3600))
+        self._expires_at = time.time() + expires_in
+        self._schedule_refresh(expires_in)
+
+    def _schedule_refresh(self, expires_in: float):
+        """
+        :param expires_in: lifetime of the current token, a token living shorter than twice refresh_margin is
+        refreshed halfway through instead of right away
+        """
+        if self._closed:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        margin = min(self.refresh_margin, expires_in / 2)
+        delay = max(self._expires_at - margin - time.time(), AADTokenProvider.MIN_REFRESH_DELAY_SECONDS)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                self._refresh(interactive=False)
+            except Exception as e:
+                # leave the current token in place, the next request past its expiry re-acquires in the foreground
+                logger.warning(f"background AAD token refresh failed: {e}")
+
+    def _acquire_token(self, interactive: bool) -> Dict[str, Any]:
+        # TODO: migrate to azure-idnetity module
+        try:
+            import msal
+        except ImportError:
+            raise Exception("AAD authentication requires msal module to be installed, please run `pip install msal`")
+
+        config = self.config
+
+        cache = msal.SerializableTokenCache()
+
+        token_cache_file: Optional[str] = None
+        if config.aad_use_token_cache:
+            token_cache_file = config.aad_token_cache_full_path
+            if not os.path.exists(token_cache_file):
+                os.makedirs(os.path.dirname(token_cache_file), exist_ok=True)
+            if os.path.exists(token_cache_file):
+                with open(token_cache_file, "r") as cache_file:
+                    cache.deserialize(cache_file.read())
+
+        def save_cache():
+            if token_cache_file is not None and config.aad_use_token_cache and cache.has_state_changed:
+                with open(token_cache_file, "w") as cache_file:
+                    cache_file.write(cache.serialize())
+
+        authority = "https://login.microsoftonline.com/" + config.aad_tenant_id
+        api_resource = config.aad_api_resource
+        api_scope = config.aad_api_scope
+        auth_mode = config.aad_auth_mode
+
+        if auth_mode == "aad_app":
+            app = msal.ConfidentialClientApplication(
+                client_id=config.aad_client_id,
+                client_credential=config.aad_client_secret,
+                authority=authority,
+                token_cache=cache,
+            )
+            result = app.acquire_token_for_client(
+                scopes=[
+                    api_resource + "/" + api_scope,
+                ],
+            )
+            if "access_token" in result:
+                return result
+            else:
+                raise Exception(
+                    "Authentication failed for acquiring AAD token for application login: " + str(result),
+                )
+
+        scopes = [
+            api_resource + "/" + api_scope,
+        ]
+        app = msal.PublicClientApplication(
+            "feb7b661-cac7-44a8-8dc1-163b63c23df2",  # default id in Azure Identity module
+            authority=authority,
+            token_cache=cache,
+        )
+        result = None
+        try:
+            account = app.get_accounts()[0]
+            result = app.acquire_token_silent(scopes, account=account)
+            if result is not None and "access_token" in result:
+                save_cache()
+                return result
+            result = None
+        except Exception:
+            pass
+
+        try:
+            account = cache.find(cache.CredentialType.ACCOUNT)[0]
+            refresh_token = cache.find(
+                cache.CredentialType.REFRESH_TOKEN,
+                query={
+                    "home_account_id": account["home_account_id"],
+                },
+            )[0]
+            result = app.acquire_token_by_refresh_token(
+                refresh_token["secret"],
+                scopes=scopes,
+            )
+            if result is not None and "access_token" in result:
+                save_cache()
+                return result
+            result = None
+        except Exception:
+            pass
+
+        if not interactive:
+            raise Exception("no AAD token available from cache, device login is required")
+
+        print("no token available from cache, acquiring token from AAD")
+        # The pattern to acquire a token looks like this.
+        flow = app.initiate_device_flow(scopes=scopes)
+        print(flow["message"])
+        result = app.acquire_token_by_device_flow(flow=flow)
+        if result is not None and "access_token" in result:
+            save_cache()
+            return result
+        else:
+            print(result.get("error"))
+            print(result.get("error_description"))
+            raise Exception(
+                "Authentication failed for acquiring AAD token for AAD auth",
+            )
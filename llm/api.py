@@ -1,14 +1,33 @@
+import asyncio
+import logging
 import os
-from typing import Any, Callable, Generator, Iterator, List, Literal, Optional, TypeVar, Union, overload, Dict
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Callable, Generator, Iterator, List, Literal, Optional, Tuple, TypeVar, Union, \
+    overload, Dict, NamedTuple, TYPE_CHECKING
 
-import openai
 from injector import inject
-from openai import AzureOpenAI, OpenAI
-from langchain.embeddings import OpenAIEmbeddings, AzureOpenAIEmbeddings
-from llm.config import LLMModuleConfig, ModuleConfig, ConfigSource
+from llm.aad_token import AADTokenProvider
+from llm.client_pool import AsyncClientPool, ClientPool
+from llm.config import ConfigSnapshot, EndpointConfig, LLMModuleConfig, ModuleConfig, ConfigSource
+from llm.config_watcher import ConfigWatcher
+from llm.hedging import HedgingPolicy
+from llm.metrics import LLMMetrics
+from llm.response_cache import ResponseCache, is_deterministic, make_request_key
+from llm.retry import RetryPolicy
+from llm.router import EndpointRouter
+from llm.single_flight import AsyncSingleFlight, SingleFlight
+from llm.token_counter import get_token_counter, preload_encoding
 from llm import PROJECT_DIR
 from abc import abstractmethod, ABCMeta
 
+if TYPE_CHECKING:
+    import numpy as np
+    from llm.embedding import EmbeddingService
+    from llm.semantic_cache import SemanticCache
+
 ChatMessageRoleType = Literal["system", "user", "assistant"]
 ChatMessageType = Dict[Literal["role", "name", "content"], str]
 
@@ -29,11 +48,409 @@ def format_chat_message(
 
 DEFAULT_STOP_TOKEN: List[str] = ["<EOS>"]
 
-# TODO: retry logic
+logger = logging.getLogger(__name__)
+
+
+def _build_chat_request(
+        config: LLMModuleConfig,
+        messages: List[ChatMessageType],
+        engine: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        top_p: float,
+        frequency_penalty: float,
+        presence_penalty: float,
+        stop: Union[str, List[str]],
+        stream: bool,
+        backup_engine: Optional[str],
+        use_backup_engine: bool,
+        response_format: Optional[str],
+        timeout: Optional[float],
+) -> Dict[str, Any]:
+    engine = config.model if engine is None else engine
+    backup_engine = config.backup_model if backup_engine is None else backup_engine
+    if use_backup_engine:
+        engine = backup_engine
+    response_format = response_format if response_format else config.response_format
+    return _fit_to_context(config, dict(
+        model=engine,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        top_p=top_p,
+        frequency_penalty=frequency_penalty,
+        presence_penalty=presence_penalty,
+        stop=stop,
+        stream=stream,
+        seed=123456,
+        response_format={"type": response_format},
+        timeout=timeout if timeout is not None else config.request_timeout,
+    ))
+
+
+def _fit_to_context(config: LLMModuleConfig, request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Count the prompt locally and clamp max_tokens to the remaining context window, oversize prompts are trimmed or
+    rejected according to config prompt_overflow before any network call. Only done for models of a known context
+    window once their encoding is loaded, see TokenCounter.fit
+    """
+    if not config.token_budget_enabled:
+        return request
+    counter = get_token_counter(request["model"], config.context_window)
+    messages, max_tokens = counter.fit(request["messages"], request["max_tokens"], config.min_completion_tokens,
+                                       config.prompt_overflow)
+    request["messages"] = messages
+    request["max_tokens"] = max_tokens
+    return request
+
+
+def _build_backup_request(config: LLMModuleConfig, request: Dict[str, Any], backup_engine: Optional[str],
+                          use_backup_engine: bool) -> Optional[Dict[str, Any]]:
+    """
+    The request to fail over to once retries on the primary model are exhausted, None if there is nothing to fail
+    over to
+    """
+    backup_engine = config.backup_model if backup_engine is None else backup_engine
+    if use_backup_engine or not config.failover_to_backup_model or backup_engine == request["model"]:
+        return None
+    return _fit_to_context(config, dict(request, model=backup_engine))
+
+
+def _preload_encodings(config: LLMModuleConfig):
+    if config.token_budget_enabled:
+        for model in {config.model, config.backup_model}:
+            preload_encoding(model)
+
+
+def _create_aad_token_provider(config: LLMModuleConfig) -> Optional[AADTokenProvider]:
+    if any(endpoint.api_type == "azure_ad" for endpoint in config.endpoints):
+        return AADTokenProvider(config)
+    return None
+
+
+def _create_response_cache(config: LLMModuleConfig) -> Optional[ResponseCache]:
+    if not config.response_cache_enabled:
+        return None
+    return ResponseCache(config.response_cache_full_path, max_entries=config.response_cache_max_entries,
+                         max_bytes=config.response_cache_max_bytes, max_age=config.response_cache_max_age)
+
+
+# options bound to long lived resources (connection pools, cache files, ...), changes only apply after a restart
+_RESTART_REQUIRED_OPTIONS = (
+    "max_connections", "max_keepalive_connections", "keepalive_expiry", "connect_timeout",
+    "max_concurrent_requests", "coalesce_requests", "metrics_enabled", "metrics_path",
+    "response_cache_enabled", "response_cache_path", "response_cache_max_entries", "response_cache_max_bytes",
+    "response_cache_max_age", "semantic_cache_enabled", "semantic_cache_path", "semantic_cache_threshold",
+    "semantic_cache_max_entries", "semantic_cache_max_age", "embedding_store_path",
+)
+
+
+class _ApiState(NamedTuple):
+    """
+    Everything an api derives from its config. A reload replaces it with one assignment and every request reads it
+    once, so all attempts of a request use the endpoints, credentials and policies its body was built with
+    """
+    config: LLMModuleConfig
+    router: EndpointRouter
+    retry_policy: RetryPolicy
+    hedging_policy: HedgingPolicy
+    aad_token_provider: Optional[AADTokenProvider]
+
+    @staticmethod
+    def from_config(config: LLMModuleConfig) -> "_ApiState":
+        return _ApiState(config, EndpointRouter.from_config(config), RetryPolicy.from_config(config),
+                         HedgingPolicy.from_config(config), _create_aad_token_provider(config))
+
+
+def _reload_state(state: _ApiState, config: ConfigSnapshot) -> _ApiState:
+    """
+    Build the state of a new config. Endpoint health and the hedging latency history carry over, an unchanged
+    AAD token provider is kept
+    """
+    old_config = state.config
+    restart_required = [k for k in _RESTART_REQUIRED_OPTIONS if getattr(old_config, k) != getattr(config, k)]
+    if restart_required:
+        logger.warning(f"config changes of {', '.join(restart_required)} only take effect after a restart")
+    router = EndpointRouter.from_config(config)
+    router.inherit_stats(state.router)
+    hedging_policy = state.hedging_policy
+    if (config.hedge_percentile, config.hedge_min_samples, config.hedge_window_size) != \
+            (old_config.hedge_percentile, old_config.hedge_min_samples, old_config.hedge_window_size):
+        hedging_policy = HedgingPolicy.from_config(config)
+    aad_token_provider = state.aad_token_provider
+    aad_options = [k for k in config.to_dict() if k.startswith("aad_")]
+    if aad_token_provider is None or any(getattr(old_config, k) != getattr(config, k) for k in aad_options):
+        aad_token_provider = _create_aad_token_provider(config)
+    return _ApiState(config, router, RetryPolicy.from_config(config), hedging_policy, aad_token_provider)
+
+
+class _ConfigurableApi:
+    """
+    Config state and hot reload shared by LLMApi and AsyncLLMApi
+    """
+    state: _ApiState
+    config_watcher: Optional[ConfigWatcher]
+
+    @property
+    def config(self) -> LLMModuleConfig:
+        return self.state.config
+
+    @property
+    def router(self) -> EndpointRouter:
+        return self.state.router
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        return self.state.retry_policy
+
+    @property
+    def hedging_policy(self) -> HedgingPolicy:
+        return self.state.hedging_policy
+
+    @property
+    def aad_token_provider(self) -> Optional[AADTokenProvider]:
+        return self.state.aad_token_provider
+
+    @classmethod
+    def create_api(cls, config_file: str = None):
+        """
+        Factory method to create api from config file
+        :param config_file: config_file path
+        :return api of this class specified by config file
+        """
+        if config_file is None:
+            config_file = os.path.join(PROJECT_DIR, 'llm', 'chat_config.json')
+        if not os.path.exists(config_file):
+            raise Exception(f"{config_file} does not exists")
+        src = ConfigSource(config_file)
+        config = src.get_snapshot(LLMModuleConfig)
+        api = cls(config)
+        if config.config_reload_interval > 0:
+            api.watch_config(config_file, base_path=src.base_path)
+        return api
+
+    def reload_config(self, config: Union[LLMModuleConfig, ConfigSnapshot]):
+        """
+        Switch to a new config without dropping connections, caches or endpoint health. Requests in flight finish
+        with the state they started with
+        """
+        config = config.compile() if isinstance(config, ModuleConfig) else config
+        old_state = self.state
+        self.state = _reload_state(old_state, config)
+        _preload_encodings(config)
+        if old_state.aad_token_provider is not None and \
+                old_state.aad_token_provider is not self.state.aad_token_provider:
+            # a closed provider still hands out its current token to requests which hold it, it only stops refreshing
+            old_state.aad_token_provider.close()
+        logger.info(f"llm config reloaded, model {config.model}, endpoints {[e.name for e in config.endpoints]}")
+
+    def watch_config(self, config_file: str, interval: Optional[float] = None,
+                     base_path: Optional[str] = None) -> ConfigWatcher:
+        """
+        Reload the config whenever config_file changes
+        :param interval: seconds between checks, defaults to config config_reload_interval
+        :param base_path: base path of relative paths in the config
+        """
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        interval = self.config.config_reload_interval if interval is None else interval
+        self.config_watcher = ConfigWatcher(config_file, self.reload_config, interval=interval or 2.0,
+                                            base_path=base_path)
+        self.config_watcher.start()
+        return self.config_watcher
+
+
+def _record_request(metrics: Optional[LLMMetrics], request: Dict[str, Any], template_key: Optional[str],
+                    attempted: List[str], latency: float, content: Optional[str] = None, usage: Any = None,
+                    error: Optional[Exception] = None):
+    """
+    Record one chat request which went to the network, token counts fall back to local counting when the response
+    carries no usage (e.g. streams)
+    """
+    if metrics is None:
+        return
+    labels = dict(model=request["model"], endpoint=attempted[-1] if attempted else None, template=template_key)
+    metrics.inc("llm_requests_total", **labels)
+    if len(attempted) > 1:
+        metrics.inc("llm_retries_total", len(attempted) - 1, **labels)
+    metrics.observe("llm_request_latency_seconds", latency, **labels)
+    if error is not None:
+        metrics.inc("llm_errors_total", error=type(error).__name__, **labels)
+        return
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        counter = get_token_counter(request["model"])
+        prompt_tokens, completion_tokens = counter.count_messages(request["messages"]), counter.count_text(content)
+    metrics.observe("llm_prompt_tokens", prompt_tokens, **labels)
+    metrics.observe("llm_completion_tokens", completion_tokens, **labels)
+
+
+def _start_thread(fn: Callable[..., Any], *args) -> Future:
+    """
+    Run fn in a new daemon thread
+    :return future of its result
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="llm-primary", daemon=True).start()
+    return future
+
+
+def _record_primary_latency(policy: HedgingPolicy, request: Dict[str, Any], sent_request: Dict[str, Any],
+                            endpoints: List[str], latency: float):
+    """
+    Feed the hedging history only with requests the primary model answered at the first attempt, time spent in
+    backoff or on the backup model says nothing about how fast the model usually is
+    :param endpoints: names of the endpoints the request was sent to
+    """
+    if sent_request is request and len(endpoints) == 1:
+        policy.record(request["model"], latency)
+
+
+def _replay_stream(response: ChatMessageType) -> Generator[str, None, None]:
+    yield response["content"]
+
+
+def _to_chat_message(res: Any) -> ChatMessageType:
+    oai_response = res.choices[0].message
+    if oai_response is None:
+        raise Exception("OpenAI API returned an empty response")
+    return format_chat_message(
+        role=oai_response.role if oai_response.role is not None else "assistant",
+        message=oai_response.content if oai_response.content is not None else "",
+    )
+
+
+def _wrap_openai_error(e: Exception) -> Exception:
+    import openai
+    if isinstance(e, openai.APITimeoutError):
+        # Handle timeout error, e.g. retry or log
+        return Exception(f"OpenAI API request timed out: {e}")
+    elif isinstance(e, openai.APIConnectionError):
+        # Handle connection error, e.g. check network or log
+        return Exception(f"OpenAI API request failed to connect: {e}")
+    elif isinstance(e, openai.BadRequestError):
+        # Handle invalid request error, e.g. validate parameters or log
+        return Exception(f"OpenAI API request was invalid: {e}")
+    elif isinstance(e, openai.AuthenticationError):
+        # Handle authentication error, e.g. check credentials or log
+        return Exception(f"OpenAI API request was not authorized: {e}")
+    elif isinstance(e, openai.PermissionDeniedError):
+        # Handle permission error, e.g. check scope or log
+        return Exception(f"OpenAI API request was not permitted: {e}")
+    elif isinstance(e, openai.RateLimitError):
+        # Handle rate limit error, e.g. wait or log
+        return Exception(f"OpenAI API request exceeded rate limit: {e}")
+    # Handle API error, e.g. retry or log
+    return Exception(f"OpenAI API returned an API Error: {e}")
+
+
+class _ChatRequestHandling:
+    """
+    What LLMApi and AsyncLLMApi do around sending a chat request: response cache lookups, single flight keys,
+    metrics and turning the outcome into a response or an error
+    """
+    response_cache: Optional[ResponseCache]
+    metrics: Optional[LLMMetrics]
+
+    def _get_cached_response(self, request: Dict[str, Any], use_cache: bool, template_key: Optional[str]
+                             ) -> Tuple[Optional[str], Optional[ChatMessageType]]:
+        """
+        :return the response cache key of request, None if it is not cached, and the cached response if there is one
+        """
+        if not use_cache or self.response_cache is None:
+            return None, None
+        cache_key = make_request_key(request)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self._record_cache_hit("exact", request, template_key)
+        return cache_key, cached
+
+    def _record_cache_hit(self, cache: str, request: Dict[str, Any], template_key: Optional[str]):
+        if self.metrics is not None:
+            self.metrics.inc("llm_cache_hits_total", cache=cache, model=request["model"], template=template_key)
+
+    @staticmethod
+    def _get_flight_key(request: Dict[str, Any], cache_key: Optional[str]) -> str:
+        return cache_key if cache_key is not None else make_request_key(request)
+
+    def _store_response(self, cache_key: Optional[str], semantic_entry: Optional[Tuple[str, str, "np.ndarray"]],
+                        response: ChatMessageType):
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        if semantic_entry is not None:
+            namespace, text, vector = semantic_entry
+            self.semantic_cache.put(namespace, text, vector, response)
+
+    def _record_first_token(self, sent_request: Dict[str, Any], template_key: Optional[str], attempted: List[str],
+                            start: float):
+        if self.metrics is not None:
+            self.metrics.observe("llm_time_to_first_token_seconds", time.monotonic() - start,
+                                 model=sent_request["model"], endpoint=attempted[-1] if attempted else None,
+                                 template=template_key)
+
+    def _finish_request(self, request: Dict[str, Any], sent_request: Dict[str, Any], res: Any,
+                        response: ChatMessageType, template_key: Optional[str], attempted: List[str], start: float,
+                        cache_key: Optional[str], semantic_entry: Optional[Tuple[str, str, "np.ndarray"]] = None
+                        ) -> ChatMessageType:
+        """
+        Record a request which was answered and cache its response
+        """
+        _record_request(self.metrics, sent_request, template_key, attempted, time.monotonic() - start,
+                        content=response["content"], usage=getattr(res, "usage", None))
+        # do not pin a failover answer under the key of the primary model
+        if sent_request is request:
+            self._store_response(cache_key, semantic_entry, response)
+        return response
+
+    def _fail_request(self, request: Dict[str, Any], template_key: Optional[str], attempted: List[str], start: float,
+                      error: Exception) -> Exception:
+        """
+        Record a request which failed
+        :return the exception to raise for error
+        """
+        import openai
+        _record_request(self.metrics, request, template_key, attempted, time.monotonic() - start, error=error)
+        return _wrap_openai_error(error) if isinstance(error, openai.APIError) else error
+
 
 _FuncType = TypeVar("_FuncType", bound=Callable[..., Any])
 
 
+class ChatCompletionResult:
+    """
+    Outcome of one request of a chat_completion_many batch, either a response or the error it failed with
+    """
+
+    def __init__(self, index: int, response: Optional[ChatMessageType] = None, error: Optional[Exception] = None):
+        self.index = index
+        self.response = response
+        self.error = error
+
+    def is_success(self) -> bool:
+        return self.error is None
+
+    def get_response(self) -> Optional[ChatMessageType]:
+        return self.response
+
+    def get_error(self) -> Optional[Exception]:
+        return self.error
+
+    def __repr__(self):
+        if self.is_success():
+            return f"ChatCompletionResult(index={self.index}, response={self.response})"
+        return f"ChatCompletionResult(index={self.index}, error={self.error!r})"
+
+
 class Api(metaclass=ABCMeta):
     """
     All LLM、different chat ways must implemented this class like Llama,ChatGLM
@@ -47,29 +464,249 @@ class Api(metaclass=ABCMeta):
         ...
 
 
-class LLMApi(Api):
-    import torch
-    EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+class _EmbeddingDevice:
+    """
+    Resolves the torch device on first access so that importing this module does not import torch
+    """
+
+    def __init__(self):
+        self.device: Optional[str] = None
+
+    def __get__(self, instance, owner) -> str:
+        if self.device is None:
+            import torch
+            self.device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() \
+                else "cpu"
+        return self.device
+
+
+class LLMApi(_ConfigurableApi, _ChatRequestHandling, Api):
+    EMBEDDING_DEVICE = _EmbeddingDevice()
 
     @inject
     def __init__(self, config: LLMModuleConfig):
-        self.config = config
+        # hot paths only read the frozen snapshot, never the config source
+        config = config.compile() if isinstance(config, ModuleConfig) else config
+        self.state = _ApiState.from_config(config)
+        self.client_pool = ClientPool(config)
+        self.response_cache: Optional[ResponseCache] = _create_response_cache(config)
+        _preload_encodings(config)
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        self._hedge_executor_lock = threading.Lock()
+        self.embedding_service: Optional["EmbeddingService"] = None
+        self.semantic_cache: Optional["SemanticCache"] = self._create_semantic_cache()
+        self.single_flight: Optional[SingleFlight] = SingleFlight() if config.coalesce_requests else None
+        self.metrics: Optional[LLMMetrics] = LLMMetrics() if config.metrics_enabled else None
+        self._metrics_timer: Optional[threading.Timer] = None
+        self._closed = False
+        self.config_watcher: Optional[ConfigWatcher] = None
+        self._schedule_metrics_export()
 
-    @staticmethod
-    def create_api(config_file: str = None):
+    def close(self):
+        self._closed = True
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        if self._metrics_timer is not None:
+            self._metrics_timer.cancel()
+            self.export_metrics()
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.client_pool.close()
+        if self.aad_token_provider is not None:
+            self.aad_token_provider.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+        if self.semantic_cache is not None:
+            self.semantic_cache.close()
+        if self.embedding_service is not None:
+            self.embedding_service.close()
+
+    def export_metrics(self, path: Optional[str] = None):
         """
-        Factory method to create api from config file
-        :param config_file: config_file path
-        :return LLMApi specified by config file
+        Write the request metrics in the Prometheus text format
+        :param path: defaults to config metrics_full_path
         """
-        if config_file is None:
-            config_file = os.path.join(PROJECT_DIR, 'llm', 'chat_config.json')
-        if not os.path.exists(config_file):
-            raise Exception(f"{config_file} does not exists")
-        config = LLMModuleConfig(ConfigSource(config_file))
-        return LLMApi(config)
+        if self.metrics is not None:
+            self.metrics.write_prometheus(self.config.metrics_full_path if path is None else path)
+
+    def _schedule_metrics_export(self):
+        if self.metrics is None or self.config.metrics_export_interval <= 0 or self._closed:
+            return
+        self._metrics_timer = threading.Timer(self.config.metrics_export_interval, self._background_export)
+        self._metrics_timer.daemon = True
+        self._metrics_timer.start()
+
+    def _background_export(self):
+        try:
+            self.export_metrics()
+        except Exception as e:
+            logger.warning(f"exporting llm metrics failed: {e}")
+        self._schedule_metrics_export()
+
+    def _create_semantic_cache(self) -> Optional["SemanticCache"]:
+        if not self.config.semantic_cache_enabled:
+            return None
+        # llm.embedding builds on LLMApi and pulls in numpy, so both are only imported when the cache is enabled
+        from llm.embedding import EmbeddingService
+        from llm.semantic_cache import SemanticCache
+        self.embedding_service = EmbeddingService(self)
+        return SemanticCache(self.config.semantic_cache_full_path, self.embedding_service.embed,
+                             threshold=self.config.semantic_cache_threshold,
+                             max_entries=self.config.semantic_cache_max_entries,
+                             max_age=self.config.semantic_cache_max_age)
+
+    def _get_semantic_entry(self, request: Dict[str, Any], template_key: Optional[str],
+                            template_vars: Optional[Dict[str, Any]] = None
+                            ) -> Optional[Tuple[str, str, "np.ndarray"]]:
+        """
+        :return namespace, prompt text and prompt embedding of a request for the semantic cache, None if the request
+        cannot be looked up
+        """
+        from llm.semantic_cache import split_request
+        split = split_request(request, template_key, template_vars)
+        if split is None:
+            return None
+        namespace, text = split
+        try:
+            return namespace, text, self.semantic_cache.embed_one(text)
+        except Exception as e:
+            # the cache is an optimization, a failing embedding request must not fail the chat request
+            logger.warning(f"semantic cache lookup skipped, embedding the prompt failed: {e}")
+            return None
+
+    def _get_client(self, state: _ApiState, endpoint: EndpointConfig):
+        if endpoint.api_type == "azure_ad":
+            credential = state.aad_token_provider.get_token()
+        else:
+            credential = endpoint.api_key
+        return self.client_pool.get_client(endpoint.api_type, endpoint.api_base, endpoint.api_version, credential)
+
+    def _call_endpoint(self, state: _ApiState, call: Callable[[Any], Any], failed: List[str],
+                       attempted: Optional[List[str]] = None):
+        """
+        One attempt of a request: pick an endpoint, run call with its client and report the outcome to the router
+        :param state: state the request started with
+        :param call: sends the request with the given client
+        :param failed: names of endpoints to avoid for this request, extended on failure
+        :param attempted: if given, collects the names of the endpoints tried
+        """
+        endpoint = state.router.select(exclude=failed)
+        if attempted is not None:
+            attempted.append(endpoint.name)
+        start = time.monotonic()
+        try:
+            res = call(self._get_client(state, endpoint))
+        except Exception as e:
+            # only failures an endpoint can be blamed for count against its health
+            success = not RetryPolicy.is_retryable(e)
+            state.router.report(endpoint, time.monotonic() - start, success)
+            if not success:
+                failed.append(endpoint.name)
+            raise
+        state.router.report(endpoint, time.monotonic() - start, True)
+        return res
+
+    def _create_completion(self, state: _ApiState, request: Dict[str, Any], backup_request: Optional[Dict[str, Any]],
+                           avoid: Optional[List[str]] = None, attempted: Optional[List[str]] = None,
+                           stop: Optional[threading.Event] = None):
+        """
+        Send a chat request under the retry policy and fail over to the backup model once retries are exhausted
+        :param avoid: names of endpoints not to use unless there is no other
+        :param attempted: if given, collects the names of the endpoints tried
+        :param stop: once set, a failed attempt is neither retried nor failed over
+        :return the sdk response and the request which produced it
+        """
+        import openai
+        failed: List[str] = list(avoid) if avoid else []
+        try:
+            return state.retry_policy.call(lambda: self._call_endpoint(
+                state, lambda client: client.chat.completions.create(**request), failed, attempted), stop), request
+        except openai.APIError as e:
+            if backup_request is None or not RetryPolicy.is_retryable(e) or (stop is not None and stop.is_set()):
+                raise
+            logger.warning(f"{request['model']} keeps failing, failing over to {backup_request['model']}: {e}")
+        return state.retry_policy.call(lambda: self._call_endpoint(
+            state, lambda client: client.chat.completions.create(**backup_request), failed, attempted),
+            stop), backup_request
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._hedge_executor_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self.config.hedge_max_workers,
+                                                              thread_name_prefix="llm-hedge")
+        return self._hedge_executor
+
+    def _create_timed_completion(self, state: _ApiState, request: Dict[str, Any],
+                                 backup_request: Optional[Dict[str, Any]], hedge: bool,
+                                 attempted: Optional[List[str]] = None):
+        """
+        _create_completion which feeds the hedging latency history and, if hedge is set, races a duplicate request
+        against a primary that is slower than usual.
+        A hedged primary runs in a thread of its own so that a backlog of slow primaries never holds up duplicates
+        in the hedge executor, the first answer is returned without waiting for the other request.
+        :param attempted: if given, collects the names of the endpoints tried, the one which answered last
+        """
+        start = time.monotonic()
+        delay = state.hedging_policy.get_hedge_delay(request["model"]) if hedge else None
+        primary_endpoints: List[str] = []
+        if delay is None:
+            try:
+                res, sent_request = self._create_completion(state, request, backup_request, None,
+                                                            primary_endpoints)
+            finally:
+                if attempted is not None:
+                    attempted.extend(primary_endpoints)
+            _record_primary_latency(state.hedging_policy, request, sent_request, primary_endpoints,
+                                    time.monotonic() - start)
+            return res, sent_request
+
+        # once the duplicate answered, the primary gives up instead of retrying
+        hedge_answered = threading.Event()
+        primary = _start_thread(self._create_completion, state, request, backup_request, None, primary_endpoints,
+                                hedge_answered)
+
+        def record_primary(future: Future):
+            # a primary which lost the race still tells how slow the model is
+            if not future.cancelled() and future.exception() is None:
+                _record_primary_latency(state.hedging_policy, request, future.result()[1], primary_endpoints,
+                                        time.monotonic() - start)
+
+        primary.add_done_callback(record_primary)
+        done, _ = wait([primary], timeout=delay)
+        winner, winner_endpoints, loser_endpoints = primary, primary_endpoints, []
+        if not done:
+            hedge_request = backup_request if state.config.hedge_to_backup_model and backup_request else request
+            logger.info(f"{request['model']} request slower than {delay:.2f}s, hedging on {hedge_request['model']}")
+            hedge_endpoints: List[str] = []
+
+            def send_hedge():
+                result = self._create_completion(state, hedge_request, None, list(primary_endpoints),
+                                                 hedge_endpoints)
+                hedge_answered.set()
+                return result
+
+            hedged = self._get_hedge_executor().submit(send_hedge)
+            done, _ = wait([primary, hedged], return_when=FIRST_COMPLETED)
+            winner = primary if primary in done else hedged
+            loser = hedged if winner is primary else primary
+            if winner.exception() is not None and (not loser.done() or loser.exception() is None):
+                # the first one to finish failed, the other one may still succeed
+                winner, loser = loser, winner
+                wait([winner])
+            # a request in flight cannot be interrupted, the loser's answer is simply dropped
+            loser.cancel()
+            if winner is hedged:
+                winner_endpoints, loser_endpoints = hedge_endpoints, list(primary_endpoints)
+            else:
+                loser_endpoints = list(hedge_endpoints)
+        if attempted is not None:
+            # the endpoint which answered goes last
+            attempted.extend(loser_endpoints + winner_endpoints)
+        return winner.result()
 
     def create_openai_embeddings(self):
+        from langchain.embeddings import OpenAIEmbeddings, AzureOpenAIEmbeddings
         api_type = self.config.api_type
         if api_type == "azure":
             return AzureOpenAIEmbeddings(azure_endpoint=self.config.api_base, openai_api_type=api_type,
@@ -87,118 +724,64 @@ class LLMApi(Api):
         else:
             raise Exception(f"do not support llm api type:{api_type}")
 
-    def _get_aad_token(self) -> str:
-        # TODO: migrate to azure-idnetity module
-        try:
-            import msal
-        except ImportError:
-            raise Exception("AAD authentication requires msal module to be installed, please run `pip install msal`")
-
-        config = self.config
-
-        cache = msal.SerializableTokenCache()
-
-        token_cache_file: Optional[str] = None
-        if config.aad_use_token_cache:
-            token_cache_file = config.aad_token_cache_full_path
-            if not os.path.exists(token_cache_file):
-                os.makedirs(os.path.dirname(token_cache_file), exist_ok=True)
-            if os.path.exists(token_cache_file):
-                with open(token_cache_file, "r") as cache_file:
-                    cache.deserialize(cache_file.read())
-
-        def save_cache():
-            if token_cache_file is not None and config.aad_use_token_cache:
-                with open(token_cache_file, "w") as cache_file:
-                    cache_file.write(cache.serialize())
-
-        authority = "https://login.microsoftonline.com/" + config.aad_tenant_id
-        api_resource = config.aad_api_resource
-        api_scope = config.aad_api_scope
-        auth_mode = config.aad_auth_mode
-
-        if auth_mode == "aad_app":
-            app = msal.ConfidentialClientApplication(
-                client_id=config.aad_client_id,
-                client_credential=config.aad_client_secret,
-                authority=authority,
-                token_cache=cache,
-            )
-            result = app.acquire_token_for_client(
-                scopes=[
-                    api_resource + "/" + api_scope,
-                ],
-            )
-            if "access_token" in result:
-                return result["access_token"]
-            else:
-                raise Exception(
-                    "Authentication failed for acquiring AAD token for application login: " + str(result),
-                )
-
-        scopes = [
-            api_resource + "/" + api_scope,
-        ]
-        app = msal.PublicClientApplication(
-            "feb7b661-cac7-44a8-8dc1-163b63c23df2",  # default id in Azure Identity module
-            authority=authority,
-            token_cache=cache,
-        )
-        result = None
+    def create_embeddings(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """
+        Embed a batch of texts in one request through the pooled client and retry policy
+        :param texts: texts to embed, at most the provider's batch limit
+        :param model: embedding model (deployment name for azure), defaults to config embedding_model
+        :return one vector per text, in the order of texts
+        """
+        import openai
+        state = self.state
+        model = state.config.embedding_model if model is None else model
         try:
-            account = app.get_accounts()[0]
-            result = app.acquire_token_silent(scopes, account=account)
-            if result is not None and "access_token" in result:
-                save_cache()
-                return result["access_token"]
-            result = None
-        except Exception:
-            pass
+            res: Any = state.retry_policy.call(lambda: self._call_endpoint(
+                state, lambda client: client.embeddings.create(model=model, input=texts), []))
+        except openai.APIError as e:
+            raise _wrap_openai_error(e)
+        return [item.embedding for item in sorted(res.data, key=lambda item: item.index)]
 
-        try:
-            account = cache.find(cache.CredentialType.ACCOUNT)[0]
-            refresh_token = cache.find(
-                cache.CredentialType.REFRESH_TOKEN,
-                query={
-                    "home_account_id": account["home_account_id"],
-                },
-            )[0]
-            result = app.acquire_token_by_refresh_token(
-                refresh_token["secret"],
-                scopes=scopes,
-            )
-            if result is not None and "access_token" in result:
-                save_cache()
-                return result["access_token"]
-            result = None
-        except Exception:
-            pass
-
-        if result is None:
-            print("no token available from cache, acquiring token from AAD")
-            # The pattern to acquire a token looks like this.
-            flow = app.initiate_device_flow(scopes=scopes)
-            print(flow["message"])
-            result = app.acquire_token_by_device_flow(flow=flow)
-            if result is not None and "access_token" in result:
-                save_cache()
-                return result["access_token"]
-            else:
-                print(result.get("error"))
-                print(result.get("error_description"))
-                raise Exception(
-                    "Authentication failed for acquiring AAD token for AAD auth",
-                )
-
-    def chat_completion_stream(self, prompt: List[ChatMessageType]) -> Iterator[str]:
-        message = ""
-        try:
-            response = self.chat_completion(prompt, stream=True)
-            for chunk in response:
-                message += chunk["content"]
-                yield chunk["content"]
-        except Exception as e:
-            raise e
+    def _get_aad_token(self) -> str:
+        return self.aad_token_provider.get_token()
+
+    def chat_completion_many(
+            self,
+            messages_list: List[List[ChatMessageType]],
+            max_workers: Optional[int] = None,
+            **kwargs
+    ) -> List[ChatCompletionResult]:
+        """
+        Send several independent chat requests concurrently over a thread pool
+        :param messages_list: one message list per request
+        :param max_workers: pool size, defaults to config batch_max_workers
+        :param kwargs: forwarded to chat_completion for every request, streaming is not supported
+        :return results in the order of messages_list, a failed request is reported in its result instead of
+        aborting the batch
+        """
+        assert not kwargs.get("stream", False), "chat_completion_many does not support stream"
+        if not messages_list:
+            return []
+        max_workers = self.config.batch_max_workers if max_workers is None else max_workers
+
+        def run(index: int, messages: List[ChatMessageType]) -> ChatCompletionResult:
+            try:
+                return ChatCompletionResult(index, response=self.chat_completion(messages, **kwargs))
+            except Exception as e:
+                return ChatCompletionResult(index, error=e)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(messages_list))) as executor:
+            futures = [executor.submit(run, i, messages) for i, messages in enumerate(messages_list)]
+            return [future.result() for future in futures]
+
+    def chat_completion_stream(self, prompt: List[ChatMessageType], **kwargs) -> Iterator[str]:
+        """
+        Stream the content tokens of a chat completion, empty deltas are skipped
+        :param prompt: chat messages
+        :param kwargs: forwarded to chat_completion
+        """
+        for chunk in self.chat_completion(prompt, stream=True, **kwargs):
+            if chunk:
+                yield chunk
 
     @overload
     def chat_completion(
@@ -214,7 +797,12 @@ class LLMApi(Api):
             stream: Literal[False] = ...,
             backup_engine: str = ...,
             use_backup_engine: bool = ...,
-            response_format: str = ...
+            response_format: str = ...,
+            timeout: Optional[float] = ...,
+            use_cache: bool = ...,
+            hedge: Optional[bool] = ...,
+            template_key: Optional[str] = ...,
+            template_vars: Optional[Dict[str, Any]] = ...
     ) -> ChatMessageType:
         ...
 
@@ -232,7 +820,12 @@ class LLMApi(Api):
             stream: Literal[True] = ...,
             backup_engine: str = ...,
             use_backup_engine: bool = ...,
-            response_format: str = ...
+            response_format: str = ...,
+            timeout: Optional[float] = ...,
+            use_cache: bool = ...,
+            hedge: Optional[bool] = ...,
+            template_key: Optional[str] = ...,
+            template_vars: Optional[Dict[str, Any]] = ...
     ) -> Generator[ChatMessageType, None, None]:
         ...
 
@@ -249,84 +842,357 @@ class LLMApi(Api):
             stream: bool = False,
             backup_engine: Optional[str] = None,
             use_backup_engine: bool = False,
-            response_format: str = None
+            response_format: str = None,
+            timeout: Optional[float] = None,
+            use_cache: bool = True,
+            hedge: Optional[bool] = None,
+            template_key: Optional[str] = None,
+            template_vars: Optional[Dict[str, Any]] = None
     ) -> Union[ChatMessageType, Generator[ChatMessageType, None, None]]:
-        api_type = self.config.api_type
-        if api_type == "azure":
-            client = AzureOpenAI(
-                api_version=self.config.api_version,
-                azure_endpoint=self.config.api_base,
-                api_key=self.config.api_key,
-            )
-        elif api_type == "azure_ad":
-            client = AzureOpenAI(
-                api_version=self.config.api_version,
-                azure_endpoint=self.config.api_base,
-                api_key=self._get_aad_token(),
-            )
-        elif api_type == "openai":
-            client = OpenAI(
-                base_url=self.config.api_base,
-                api_key=self.config.api_key,
-            )
+        """
+        :param use_cache: look the request up in the response cache and, if enabled, the semantic cache. Requests
+        which sample, with both temperature and top_p above 0, never use the caches
+        :param hedge: race a duplicate against a slow request, defaults to config hedging_enabled
+        :param template_key: prompt template the messages were rendered from, requests of different templates never
+        share semantic cache entries
+        :param template_vars: variables the last message was rendered with from template_key, the semantic cache
+        compares only them
+        """
+        state = self.state
+        request = _build_chat_request(state.config, messages, engine, temperature, max_tokens, top_p,
+                                      frequency_penalty, presence_penalty, stop, stream, backup_engine,
+                                      use_backup_engine, response_format, timeout)
+        use_cache = use_cache and is_deterministic(request)
+        cache_key, cached = self._get_cached_response(request, use_cache, template_key)
+        if cached is not None:
+            return _replay_stream(cached) if stream else cached
+        semantic_entry: Optional[Tuple[str, str, "np.ndarray"]] = None
+        if use_cache and self.semantic_cache is not None:
+            semantic_entry = self._get_semantic_entry(request, template_key, template_vars)
+            if semantic_entry is not None:
+                cached = self.semantic_cache.get(semantic_entry[0], semantic_entry[2])
+                if cached is not None:
+                    self._record_cache_hit("semantic", request, template_key)
+                    return _replay_stream(cached) if stream else cached
+        backup_request = _build_backup_request(state.config, request, backup_engine, use_backup_engine)
+        hedge = state.config.hedging_enabled if hedge is None else hedge
 
-        engine = self.config.model if engine is None else engine
-        backup_engine = self.config.backup_model if backup_engine is None else backup_engine
+        def send():
+            return self._send_chat_request(state, request, backup_request, hedge, cache_key, semantic_entry,
+                                           template_key)
 
-        def handle_stream_result(res):
-            for stream_res in res:
-                if not stream_res.choices:
-                    continue
-                delta = stream_res.choices[0].delta
-                yield delta.content
+        if self.single_flight is None:
+            return send()
+        flight_key = self._get_flight_key(request, cache_key)
+        if stream:
+            return self.single_flight.stream(flight_key, send)
+        # every caller gets its own copy of the shared response
+        return dict(self.single_flight.call(flight_key, send))
+
+    def _send_chat_request(self, state: _ApiState, request: Dict[str, Any], backup_request: Optional[Dict[str, Any]],
+                           hedge: bool, cache_key: Optional[str],
+                           semantic_entry: Optional[Tuple[str, str, "np.ndarray"]], template_key: Optional[str] = None):
+        """
+        The network part of chat_completion, the response is stored in the caches under the given keys
+        :return the response, or a generator over its content deltas for a stream request
+        """
+        start = time.monotonic()
+        attempted: List[str] = []
+
+        def handle_stream_result(res, sent_request: Dict[str, Any]):
+            contents: List[str] = []
+            try:
+                for stream_res in res:
+                    if not stream_res.choices:
+                        continue
+                    delta = stream_res.choices[0].delta
+                    if delta.content:
+                        if not contents:
+                            self._record_first_token(sent_request, template_key, attempted, start)
+                        contents.append(delta.content)
+                    yield delta.content
+            except Exception as e:
+                _record_request(self.metrics, sent_request, template_key, attempted, time.monotonic() - start,
+                                error=e)
+                raise
+            content = "".join(contents)
+            _record_request(self.metrics, sent_request, template_key, attempted, time.monotonic() - start,
+                            content=content)
+            # only a fully consumed stream is cached
+            self._store_response(cache_key, semantic_entry, format_chat_message("assistant", content))
 
         try:
-            if use_backup_engine:
-                engine = backup_engine
-            response_format = response_format if response_format else self.config.response_format
-            res: Any = client.chat.completions.create(
-                model=engine,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stop=stop,
-                stream=stream,
-                seed=123456,
-                response_format={"type": response_format},
-            )
-            if stream:
-                return handle_stream_result(res)
-            else:
-                oai_response = res.choices[0].message
-                if oai_response is None:
-                    raise Exception("OpenAI API returned an empty response")
-                response: ChatMessageType = format_chat_message(
-                    role=oai_response.role if oai_response.role is not None else "assistant",
-                    message=oai_response.content if oai_response.content is not None else "",
-                )
-                return response
-
-        except openai.APITimeoutError as e:
-            # Handle timeout error, e.g. retry or log
-            raise Exception(f"OpenAI API request timed out: {e}")
-        except openai.APIConnectionError as e:
-            # Handle connection error, e.g. check network or log
-            raise Exception(f"OpenAI API request failed to connect: {e}")
-        except openai.BadRequestError as e:
-            # Handle invalid request error, e.g. validate parameters or log
-            raise Exception(f"OpenAI API request was invalid: {e}")
-        except openai.AuthenticationError as e:
-            # Handle authentication error, e.g. check credentials or log
-            raise Exception(f"OpenAI API request was not authorized: {e}")
-        except openai.PermissionDeniedError as e:
-            # Handle permission error, e.g. check scope or log
-            raise Exception(f"OpenAI API request was not permitted: {e}")
-        except openai.RateLimitError as e:
-            # Handle rate limit error, e.g. wait or log
-            raise Exception(f"OpenAI API request exceeded rate limit: {e}")
+            if request["stream"]:
+                res, sent_request = self._create_completion(state, request, backup_request, None, attempted)
+                if sent_request is not request:
+                    # do not pin a failover answer under the key of the primary model
+                    cache_key = None
+                    semantic_entry = None
+                return handle_stream_result(res, sent_request)
+            res, sent_request = self._create_timed_completion(state, request, backup_request, hedge, attempted)
+            response = _to_chat_message(res)
+        except Exception as e:
+            raise self._fail_request(request, template_key, attempted, start, e)
+        return self._finish_request(request, sent_request, res, response, template_key, attempted, start, cache_key,
+                                    semantic_entry)
+
+
+class AsyncLLMApi(_ConfigurableApi, _ChatRequestHandling, Api):
+    """
+    asyncio counterpart of LLMApi built on the async OpenAI clients.
+    At most `max_concurrent_requests` requests (streams included, until fully consumed) are in flight at once on
+    every event loop the api is used from.
+    """
+
+    @inject
+    def __init__(self, config: LLMModuleConfig):
+        # hot paths only read the frozen snapshot, never the config source
+        config = config.compile() if isinstance(config, ModuleConfig) else config
+        self.state = _ApiState.from_config(config)
+        self.client_pool = AsyncClientPool(config)
+        self.response_cache: Optional[ResponseCache] = _create_response_cache(config)
+        _preload_encodings(config)
+        self.single_flight: Optional[AsyncSingleFlight] = AsyncSingleFlight() if config.coalesce_requests else None
+        self.metrics: Optional[LLMMetrics] = LLMMetrics() if config.metrics_enabled else None
+        self.config_watcher: Optional[ConfigWatcher] = None
+        self.max_concurrent_requests = config.max_concurrent_requests
+        # an asyncio.Semaphore can only be used from one event loop, so every loop gets its own
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    async def aclose(self):
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        await self.client_pool.aclose()
+        if self.aad_token_provider is not None:
+            self.aad_token_provider.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """
+        :return the semaphore of the running event loop, max_concurrent_requests holds per loop
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent_requests)
+        return semaphore
+
+    @staticmethod
+    async def _get_aad_token(aad_token_provider: AADTokenProvider) -> str:
+        if aad_token_provider.is_valid():
+            return aad_token_provider.get_token()
+        # acquiring may hit msal and the network, keep it off the event loop
+        return await asyncio.to_thread(aad_token_provider.get_token)
+
+    async def _call_endpoint(self, state: _ApiState, request: Dict[str, Any], failed: List[str],
+                             attempted: Optional[List[str]] = None):
+        endpoint = state.router.select(exclude=failed)
+        if attempted is not None:
+            attempted.append(endpoint.name)
+        start = time.monotonic()
+        try:
+            client = await self._get_client(state, endpoint)
+            res = await client.chat.completions.create(**request)
+        except asyncio.CancelledError:
+            state.router.release(endpoint)
+            raise
+        except Exception as e:
+            success = not RetryPolicy.is_retryable(e)
+            state.router.report(endpoint, time.monotonic() - start, success)
+            if not success:
+                failed.append(endpoint.name)
+            raise
+        state.router.report(endpoint, time.monotonic() - start, True)
+        return res
+
+    async def _create_completion(self, state: _ApiState, request: Dict[str, Any],
+                                 backup_request: Optional[Dict[str, Any]], avoid: Optional[List[str]] = None,
+                                 attempted: Optional[List[str]] = None):
+        import openai
+        failed: List[str] = list(avoid) if avoid else []
+
+        def create(req: Dict[str, Any]):
+            return self._call_endpoint(state, req, failed, attempted)
+
+        try:
+            return await state.retry_policy.acall(lambda: create(request)), request
         except openai.APIError as e:
-            # Handle API error, e.g. retry or log
-            raise Exception(f"OpenAI API returned an API Error: {e}")
+            if backup_request is None or not RetryPolicy.is_retryable(e):
+                raise
+            logger.warning(f"{request['model']} keeps failing, failing over to {backup_request['model']}: {e}")
+        return await state.retry_policy.acall(lambda: create(backup_request)), backup_request
+
+    async def _create_timed_completion(self, state: _ApiState, request: Dict[str, Any],
+                                       backup_request: Optional[Dict[str, Any]], hedge: bool,
+                                       attempted: Optional[List[str]] = None):
+        start = time.monotonic()
+        delay = state.hedging_policy.get_hedge_delay(request["model"]) if hedge else None
+        primary_endpoints: List[str] = []
+        if delay is None:
+            try:
+                res, sent_request = await self._create_completion(state, request, backup_request, None,
+                                                                  primary_endpoints)
+            finally:
+                if attempted is not None:
+                    attempted.extend(primary_endpoints)
+            _record_primary_latency(state.hedging_policy, request, sent_request, primary_endpoints,
+                                    time.monotonic() - start)
+            return res, sent_request
+
+        primary = asyncio.ensure_future(self._create_completion(state, request, backup_request, None,
+                                                                primary_endpoints))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        winner_endpoints, loser_endpoints = primary_endpoints, []
+        if not done:
+            hedge_request = backup_request if state.config.hedge_to_backup_model and backup_request else request
+            logger.info(f"{request['model']} request slower than {delay:.2f}s, hedging on {hedge_request['model']}")
+            hedge_endpoints: List[str] = []
+            hedged = asyncio.ensure_future(self._create_completion(state, hedge_request, None,
+                                                                   list(primary_endpoints), hedge_endpoints))
+            done, _ = await asyncio.wait({primary, hedged}, return_when=asyncio.FIRST_COMPLETED)
+            winner = primary if primary in done else hedged
+            loser = hedged if winner is primary else primary
+            if winner.exception() is not None and (not loser.done() or loser.exception() is None):
+                # the first one to finish failed, the other one may still succeed
+                winner, loser = loser, winner
+                await asyncio.wait({winner})
+            # cancelling the task aborts its http request
+            loser.cancel()
+            primary = winner
+            if winner is hedged:
+                winner_endpoints, loser_endpoints = hedge_endpoints, primary_endpoints
+            else:
+                loser_endpoints = hedge_endpoints
+        if attempted is not None:
+            attempted.extend(loser_endpoints + winner_endpoints)
+        res, sent_request = primary.result()
+        if winner_endpoints is primary_endpoints:
+            _record_primary_latency(state.hedging_policy, request, sent_request, primary_endpoints,
+                                    time.monotonic() - start)
+        return res, sent_request
+
+    async def _get_client(self, state: _ApiState, endpoint: EndpointConfig):
+        if endpoint.api_type == "azure_ad":
+            credential = await self._get_aad_token(state.aad_token_provider)
+        else:
+            credential = endpoint.api_key
+        return self.client_pool.get_client(endpoint.api_type, endpoint.api_base, endpoint.api_version, credential)
+
+    async def chat_completion(
+            self,
+            messages: List[ChatMessageType],
+            engine: Optional[str] = None,
+            temperature: float = 0,
+            max_tokens: int = 2048,
+            top_p: float = 0,
+            frequency_penalty: float = 0,
+            presence_penalty: float = 0,
+            stop: Union[str, List[str]] = DEFAULT_STOP_TOKEN,
+            backup_engine: Optional[str] = None,
+            use_backup_engine: bool = False,
+            response_format: str = None,
+            timeout: Optional[float] = None,
+            use_cache: bool = True,
+            hedge: Optional[bool] = None,
+            template_key: Optional[str] = None
+    ) -> ChatMessageType:
+        state = self.state
+        request = _build_chat_request(state.config, messages, engine, temperature, max_tokens, top_p,
+                                      frequency_penalty, presence_penalty, stop, False, backup_engine,
+                                      use_backup_engine, response_format, timeout)
+        use_cache = use_cache and is_deterministic(request)
+        cache_key, cached = self._get_cached_response(request, use_cache, template_key)
+        if cached is not None:
+            return cached
+        backup_request = _build_backup_request(state.config, request, backup_engine, use_backup_engine)
+        hedge = state.config.hedging_enabled if hedge is None else hedge
+
+        def send():
+            return self._send_chat_request(state, request, backup_request, hedge, cache_key, template_key)
+
+        if self.single_flight is None:
+            return await send()
+        flight_key = self._get_flight_key(request, cache_key)
+        return dict(await self.single_flight.call(flight_key, send))
+
+    async def _send_chat_request(self, state: _ApiState, request: Dict[str, Any],
+                                 backup_request: Optional[Dict[str, Any]], hedge: bool, cache_key: Optional[str],
+                                 template_key: Optional[str] = None) -> ChatMessageType:
+        async with self._get_semaphore():
+            start = time.monotonic()
+            attempted: List[str] = []
+            try:
+                res, sent_request = await self._create_timed_completion(state, request, backup_request, hedge,
+                                                                        attempted)
+                response = _to_chat_message(res)
+            except Exception as e:
+                raise self._fail_request(request, template_key, attempted, start, e)
+            return self._finish_request(request, sent_request, res, response, template_key, attempted, start,
+                                        cache_key)
+
+    async def chat_completion_many(
+            self,
+            messages_list: List[List[ChatMessageType]],
+            **kwargs
+    ) -> List[ChatCompletionResult]:
+        """
+        Send several independent chat requests concurrently, bounded by max_concurrent_requests
+        :param messages_list: one message list per request
+        :param kwargs: forwarded to chat_completion for every request
+        :return results in the order of messages_list with per-request errors
+        """
+        responses = await asyncio.gather(*[self.chat_completion(messages, **kwargs) for messages in messages_list],
+                                         return_exceptions=True)
+        results: List[ChatCompletionResult] = []
+        for i, response in enumerate(responses):
+            if isinstance(response, BaseException):
+                if not isinstance(response, Exception):
+                    raise response
+                results.append(ChatCompletionResult(i, error=response))
+            else:
+                results.append(ChatCompletionResult(i, response=response))
+        return results
+
+    async def chat_completion_stream(
+            self,
+            messages: List[ChatMessageType],
+            engine: Optional[str] = None,
+            temperature: float = 0,
+            max_tokens: int = 2048,
+            top_p: float = 0,
+            frequency_penalty: float = 0,
+            presence_penalty: float = 0,
+            stop: Union[str, List[str]] = DEFAULT_STOP_TOKEN,
+            backup_engine: Optional[str] = None,
+            use_backup_engine: bool = False,
+            response_format: str = None,
+            timeout: Optional[float] = None,
+            template_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        state = self.state
+        request = _build_chat_request(state.config, messages, engine, temperature, max_tokens, top_p,
+                                      frequency_penalty, presence_penalty, stop, True, backup_engine,
+                                      use_backup_engine, response_format, timeout)
+        backup_request = _build_backup_request(state.config, request, backup_engine, use_backup_engine)
+        async with self._get_semaphore():
+            start = time.monotonic()
+            attempted: List[str] = []
+            sent_request = request
+            contents: List[str] = []
+            try:
+                res, sent_request = await self._create_completion(state, request, backup_request, None, attempted)
+                async for stream_res in res:
+                    if not stream_res.choices:
+                        continue
+                    content = stream_res.choices[0].delta.content
+                    if content:
+                        if not contents:
+                            self._record_first_token(sent_request, template_key, attempted, start)
+                        contents.append(content)
+                        yield content
+            except Exception as e:
+                raise self._fail_request(sent_request, template_key, attempted, start, e)
+            _record_request(self.metrics, sent_request, template_key, attempted, time.monotonic() - start,
+                            content="".join(contents))
@@ -0,0 +1,116 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from llm.config import LLMModuleConfig
+
+ClientKey = Tuple[str, str, Optional[str], Optional[str]]
+
+
+class ClientPool:
+    """
+    Keep-alive OpenAI/AzureOpenAI clients owned by one LLMApi.
+    Every (api_type, api_base) pair gets one httpx connection pool which is shared by all sdk clients created for it,
+    so a rotated credential (e.g. a refreshed AAD token) only rebuilds the cheap sdk wrapper, not the connections.
+    """
+
+    def __init__(self, config: LLMModuleConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._http_clients: Dict[Tuple[str, str], Any] = {}
+        self._clients: Dict[Tuple[str, str], Tuple[ClientKey, Any]] = {}
+
+    def _http_client_options(self) -> Dict[str, Any]:
+        import httpx
+        config = self.config
+        return dict(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(config.request_timeout, connect=config.connect_timeout),
+        )
+
+    def _create_http_client(self):
+        import httpx
+        return httpx.Client(**self._http_client_options())
+
+    def _create_client(self, key: ClientKey, http_client):
+        from openai import AzureOpenAI, OpenAI
+        return self._create_sdk_client(key, http_client, AzureOpenAI, OpenAI)
+
+    @staticmethod
+    def _create_sdk_client(key: ClientKey, http_client: Any, azure_client_type: type, openai_client_type: type):
+        api_type, api_base, api_version, credential = key
+        if api_type in ("azure", "azure_ad"):
+            return azure_client_type(
+                api_version=api_version,
+                azure_endpoint=api_base,
+                api_key=credential,
+                http_client=http_client,
+                max_retries=0,
+            )
+        elif api_type == "openai":
+            return openai_client_type(
+                base_url=api_base,
+                api_key=credential,
+                http_client=http_client,
+                max_retries=0,
+            )
+        raise Exception(f"do not support llm api type:{api_type}")
+
+    def get_client(self, api_type: str, api_base: str, api_version: Optional[str] = None,
+                   credential: Optional[str] = None):
+        """
+        Get a pooled client, creating it on first use
+        :param api_type: one of openai, azure, azure_ad
+        :param api_base: endpoint url
+        :param api_version: azure api version, ignored for openai
+        :param credential: api key or AAD token
+        :return OpenAI or AzureOpenAI client sharing the keep-alive connections of its endpoint
+        """
+        endpoint = (api_type, api_base)
+        key: ClientKey = (api_type, api_base, api_version, credential)
+        with self._lock:
+            cached = self._clients.get(endpoint)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            http_client = self._http_clients.get(endpoint)
+            if http_client is None:
+                http_client = self._create_http_client()
+                self._http_clients[endpoint] = http_client
+            client = self._create_client(key, http_client)
+            self._clients[endpoint] = (key, client)
+            return client
+
+    def close(self):
+        with self._lock:
+            for http_client in self._http_clients.values():
+                http_client.close()
+            self._http_clients.clear()
+            self._clients.clear()
+
+
+class AsyncClientPool(ClientPool):
+    """
+    Same pooling as ClientPool but hands out AsyncOpenAI/AsyncAzureOpenAI clients for AsyncLLMApi.
+    """
+
+    def _create_http_client(self):
+        import httpx
+        return httpx.AsyncClient(**self._http_client_options())
+
+    def _create_client(self, key: ClientKey, http_client):
+        from openai import AsyncAzureOpenAI, AsyncOpenAI
+        return self._create_sdk_client(key, http_client, AsyncAzureOpenAI, AsyncOpenAI)
+
+    def close(self):
+        raise Exception("AsyncClientPool must be closed with `await aclose()`")
+
+    async def aclose(self):
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._http_clients.clear()
+            self._clients.clear()
+        for http_client in http_clients:
+            await http_client.aclose()
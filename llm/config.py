@@ -1,12 +1,13 @@
 from dataclasses import dataclass
 
 from injector import inject
-from typing import Optional, List, Dict, Any, Literal, NamedTuple
+from types import MappingProxyType
+from typing import Optional, List, Dict, Any, Literal, NamedTuple, Tuple, Type
 import os
 import json, re
 
 ConfigSourceType = Literal["env", "json", "app", "default"]
-ConfigValueType = Literal["str", "int", "float", "bool", "list", "enum", "path"]
+ConfigValueType = Literal["str", "int", "float", "bool", "list", "enum", "path", "json"]
 
 
 class ConfigSourceValue(NamedTuple):
@@ -22,6 +23,16 @@ class ConfigItem:
     sources: List[ConfigSourceValue]
 
 
+@dataclass(frozen=True)
+class EndpointConfig:
+    name: str
+    api_type: str
+    api_base: str
+    api_key: Optional[str]
+    api_version: str
+    weight: float = 1.0
+
+
 class ConfigSource:
     _bool_str_map: Dict[str, bool] = {
         "true": True,
@@ -46,8 +57,11 @@ class ConfigSource:
             os.path.join(os.path.dirname(__file__), ".."),
         )
         self.base_path = os.path.realpath(".") if base_path is None else os.path.realpath(base_path)
+        # ${AppBaseDir} in path values refers to the base path
+        self.app_base_path = self.base_path
 
         self.config: Dict[str, ConfigItem] = {}
+        self._snapshots: Dict[type, "ConfigSnapshot"] = {}
         self.config_file_path = config_file_path
         self.in_memory_store = config
         if self.config_file_path is not None:
@@ -73,28 +87,27 @@ class ConfigSource:
             var_type: ConfigValueType,
             default_value: Optional[Any] = None,
     ) -> Optional[Any]:
-        self.set_config_value(var_name, var_type, default_value, "default")
-
-        if self.in_memory_store is not None:
-            val = self.in_memory_store.get(var_name, None)
-            if val is not None:
-                return val
+        # every source which has the key is kept for provenance, the last one wins:
+        # in memory config > env var > json file > default
+        sources: List[ConfigSourceValue] = [ConfigSourceValue(source="default", value=default_value)]
+        if var_name in self.json_file_store:
+            sources.append(ConfigSourceValue(source="json", value=self.json_file_store[var_name]))
         # env var has the format of upper case with dot replaced by underscore
         # e.g., llm.api_base -> LLM_API_BASE
         val = os.environ.get(var_name.upper().replace(".", "_"), None)
         if val is not None:
-            if val.lower() in ConfigSource._null_str_set:
-                return None
-            else:
-                return val
-
-        if var_name in self.json_file_store.keys():
-            return self.json_file_store.get(var_name, default_value)
-
-        if default_value is not None:
-            return default_value
-
-        raise ValueError(f"Config value {var_name} is not found")
+            sources.append(ConfigSourceValue(
+                source="env",
+                value=None if val.lower() in ConfigSource._null_str_set else val,
+            ))
+        if self.in_memory_store is not None and self.in_memory_store.get(var_name, None) is not None:
+            sources.append(ConfigSourceValue(source="app", value=self.in_memory_store[var_name]))
+
+        if len(sources) == 1 and default_value is None:
+            raise ValueError(f"Config value {var_name} is not found")
+        value = sources[-1].value
+        self.config[var_name] = ConfigItem(name=var_name, value=value, type=var_type, sources=sources)
+        return value
 
     def set_config_value(
             self,
@@ -116,6 +129,16 @@ class ConfigSource:
             new_sources.append(ConfigSourceValue(source=source, value=value))
             self.config[var_name].sources = new_sources
 
+    def get_snapshot(self, module_config_type: Type["ModuleConfig"]) -> "ConfigSnapshot":
+        """
+        Resolve a module config from this source once, later calls return the same snapshot
+        :param module_config_type: ModuleConfig subclass, e.g. LLMModuleConfig
+        """
+        snapshot = self._snapshots.get(module_config_type)
+        if snapshot is None:
+            snapshot = self._snapshots[module_config_type] = module_config_type(self).compile()
+        return snapshot
+
     def get_bool(
             self,
             var_name: str,
@@ -167,7 +190,7 @@ class ConfigSource:
             var_name: str,
             default_value: Optional[float] = None,
     ) -> float:
-        val = self._get_config_value(var_name, "int", default_value)
+        val = self._get_config_value(var_name, "float", default_value)
         if isinstance(val, float):
             return val
         if isinstance(val, int):
@@ -202,6 +225,16 @@ class ConfigSource:
                     f"Invalid digit config value {val}, " f"only support transforming to int or float",
                 )
 
+    def get_json(self, var_name: str, default_value: Optional[Any] = None) -> Any:
+        val = self._get_config_value(var_name, "json", default_value)
+        if isinstance(val, str):
+            # values from env vars arrive as json text
+            try:
+                return json.loads(val)
+            except ValueError:
+                raise ValueError(f"Invalid json config value {val}")
+        return val
+
     def get_path(
             self,
             var_name: str,
@@ -256,6 +289,62 @@ class ConfigSource:
         return path_config
 
 
+def _freeze_value(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze_value(v) for k, v in value.items()})
+    return value
+
+
+class ConfigSnapshot(object):
+    """
+    Read only copy of the values a ModuleConfig resolved, created by ModuleConfig.compile.
+    Every subclass stores its values in __slots__, so reading a value is a plain attribute access.
+    """
+    __slots__ = ("_provenance",)
+    _fields: Tuple[str, ...] = ()
+    _classes: Dict[Tuple[type, Tuple[str, ...]], type] = {}
+
+    def __init__(self, values: Dict[str, Any], provenance: Dict[str, Optional[ConfigItem]]) -> None:
+        for key in self._fields:
+            object.__setattr__(self, key, _freeze_value(values[key]))
+        object.__setattr__(self, "_provenance", provenance)
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is read only, cannot set {key}")
+
+    def __delattr__(self, key: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is read only, cannot delete {key}")
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self._fields)})"
+
+    @staticmethod
+    def create_class(config_type: type, fields: Tuple[str, ...]) -> type:
+        key = (config_type, fields)
+        snapshot_class = ConfigSnapshot._classes.get(key)
+        if snapshot_class is None:
+            snapshot_class = ConfigSnapshot._classes[key] = type(
+                f"{config_type.__name__}Snapshot",
+                (ConfigSnapshot,),
+                {"__slots__": fields, "_fields": fields},
+            )
+        return snapshot_class
+
+    def get_provenance(self, key: str) -> Optional[ConfigItem]:
+        """
+        :param key: attribute name, e.g. model
+        :return the resolved value with every source that provided one, None for values which were derived
+        instead of read from the config (e.g. full paths)
+        """
+        assert key in self._fields, f"{key} is not a config value of {type(self).__name__}"
+        return self._provenance.get(key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self._fields}
+
+
 class ModuleConfig(object):
     @inject
     def __init__(self, src: ConfigSource) -> None:
@@ -263,6 +352,15 @@ class ModuleConfig(object):
         self.name: str = ""
         self._configure()
 
+    def compile(self) -> ConfigSnapshot:
+        """
+        Freeze the resolved values into an immutable snapshot which keeps where every value came from
+        """
+        fields = tuple(k for k in vars(self) if k not in ("src", "name") and not k.startswith("_"))
+        snapshot_class = ConfigSnapshot.create_class(type(self), fields)
+        provenance = {k: self.src.config.get(self._config_key(k)) for k in fields}
+        return snapshot_class(vars(self), provenance)
+
     def _set_name(self, name: str) -> None:
         self.name = name
 
@@ -293,6 +391,9 @@ class ModuleConfig(object):
     def _get_path(self, key: str, default: Optional[str]) -> str:
         return self.src.get_path(self._config_key(key), default)
 
+    def _get_json(self, key: str, default: Optional[Any]) -> Any:
+        return self.src.get_json(self._config_key(key), default)
+
 
 class LLMModuleConfig(ModuleConfig):
     def _configure(self) -> None:
@@ -350,8 +451,118 @@ class LLMModuleConfig(ModuleConfig):
             self.src.base_path,
             self.aad_token_cache_path,
         )
+        self.aad_token_refresh_margin = self._get_float("aad_token_refresh_margin", 300.0)
         self.response_format = self._get_enum(
             "response_format",
             options=["json_object", "text", None],
             default="text",
         )
+        self.max_connections = self._get_int("max_connections", 100)
+        self.max_keepalive_connections = self._get_int("max_keepalive_connections", 20)
+        self.keepalive_expiry = self._get_float("keepalive_expiry", 60.0)
+        self.request_timeout = self._get_float("request_timeout", 600.0)
+        self.connect_timeout = self._get_float("connect_timeout", 5.0)
+        self.max_concurrent_requests = self._get_int("max_concurrent_requests", 64)
+        self.batch_max_workers = self._get_int("batch_max_workers", 8)
+        # identical requests in flight at the same time share one network call
+        self.coalesce_requests = self._get_bool("coalesce_requests", True)
+        # seconds between checks of the config file for changes, 0 disables reloading
+        self.config_reload_interval = self._get_float("config_reload_interval", 0.0)
+        self.metrics_enabled = self._get_bool("metrics_enabled", True)
+        self.metrics_path = self._get_str("metrics_path", "cache/llm_metrics.prom")
+        self.metrics_full_path = os.path.join(
+            self.src.base_path,
+            self.metrics_path,
+        )
+        # seconds between prometheus exports to metrics_path, 0 leaves exporting to LLMApi.export_metrics
+        self.metrics_export_interval = self._get_float("metrics_export_interval", 0.0)
+        # opt-in, it writes response_cache_path and replays earlier answers to repeated requests
+        self.response_cache_enabled = self._get_bool("response_cache_enabled", False)
+        self.response_cache_path = self._get_str(
+            "response_cache_path",
+            "cache/llm_response_cache.sqlite",
+        )
+        self.response_cache_full_path = os.path.join(
+            self.src.base_path,
+            self.response_cache_path,
+        )
+        self.response_cache_max_entries = self._get_int("response_cache_max_entries", 10000)
+        self.response_cache_max_bytes = self._get_int("response_cache_max_bytes", 256 * 1024 * 1024)
+        # seconds, 0 keeps entries until they are evicted by size
+        self.response_cache_max_age = self._get_float("response_cache_max_age", 7 * 24 * 3600.0)
+        self.max_retries = self._get_int("max_retries", 3)
+        self.retry_base_delay = self._get_float("retry_base_delay", 1.0)
+        self.retry_max_delay = self._get_float("retry_max_delay", 60.0)
+        self.retry_budget_ratio = self._get_float("retry_budget_ratio", 0.2)
+        self.retry_budget_min = self._get_float("retry_budget_min", 10.0)
+        self.failover_to_backup_model = self._get_bool("failover_to_backup_model", True)
+        self.token_budget_enabled = self._get_bool("token_budget_enabled", False)
+        # 0 looks the window up from the model name
+        self.context_window = self._get_int("context_window", 0)
+        self.min_completion_tokens = self._get_int("min_completion_tokens", 256)
+        self.prompt_overflow = self._get_enum("prompt_overflow", ["reject", "trim"], "reject")
+        self.endpoints = self._configure_endpoints()
+        self.endpoint_latency_alpha = self._get_float("endpoint_latency_alpha", 0.2)
+        self.endpoint_eject_failures = self._get_int("endpoint_eject_failures", 3)
+        self.endpoint_eject_seconds = self._get_float("endpoint_eject_seconds", 30.0)
+        self.endpoint_max_eject_seconds = self._get_float("endpoint_max_eject_seconds", 300.0)
+        self.hedging_enabled = self._get_bool("hedging_enabled", False)
+        self.hedge_percentile = self._get_float("hedge_percentile", 95.0)
+        self.hedge_min_samples = self._get_int("hedge_min_samples", 20)
+        self.hedge_window_size = self._get_int("hedge_window_size", 200)
+        self.hedge_to_backup_model = self._get_bool("hedge_to_backup_model", False)
+        self.hedge_max_workers = self._get_int("hedge_max_workers", 32)
+        self.embedding_model = self._get_str("embedding_model", "text-embedding-ada-002")
+        self.embedding_batch_size = self._get_int("embedding_batch_size", 256)
+        self.embedding_store_path = self._get_str("embedding_store_path", "cache/embeddings")
+        self.embedding_store_full_path = os.path.join(
+            self.src.base_path,
+            self.embedding_store_path,
+        )
+        self.semantic_cache_enabled = self._get_bool("semantic_cache_enabled", False)
+        self.semantic_cache_path = self._get_str(
+            "semantic_cache_path",
+            "cache/llm_semantic_cache.sqlite",
+        )
+        self.semantic_cache_full_path = os.path.join(
+            self.src.base_path,
+            self.semantic_cache_path,
+        )
+        # minimum cosine similarity between the last user messages of two requests to share an answer
+        self.semantic_cache_threshold = self._get_float("semantic_cache_threshold", 0.95)
+        # per namespace, i.e. per template, model and preceding messages
+        self.semantic_cache_max_entries = self._get_int("semantic_cache_max_entries", 1000)
+        self.semantic_cache_max_age = self._get_float("semantic_cache_max_age", 7 * 24 * 3600.0)
+
+    def _configure_endpoints(self) -> List[EndpointConfig]:
+        """
+        Endpoints listed under llm.endpoints, fields missing from an entry fall back to the top level llm settings.
+        Without such a list the top level settings form the only endpoint.
+        """
+        raw_endpoints: List[Dict[str, Any]] = self._get_json("endpoints", [])
+        if not raw_endpoints:
+            return [EndpointConfig(
+                name=self.api_base,
+                api_type=self.api_type,
+                api_base=self.api_base,
+                api_key=self.api_key,
+                api_version=self.api_version,
+            )]
+        endpoints: List[EndpointConfig] = []
+        for raw_endpoint in raw_endpoints:
+            api_type = raw_endpoint.get("api_type", self.api_type)
+            if api_type not in ["openai", "azure", "azure_ad"]:
+                raise ValueError(f"Invalid endpoint api_type {api_type}")
+            api_base = raw_endpoint.get("api_base", self.api_base)
+            endpoints.append(EndpointConfig(
+                name=raw_endpoint.get("name", api_base),
+                api_type=api_type,
+                api_base=api_base,
+                api_key=raw_endpoint.get("api_key", self.api_key),
+                api_version=raw_endpoint.get("api_version", self.api_version),
+                weight=float(raw_endpoint.get("weight", 1.0)),
+            ))
+        names = [endpoint.name for endpoint in endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Endpoint names must be unique, got {names}")
+        return endpoints
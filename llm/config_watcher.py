@@ -0,0 +1,69 @@
+import logging
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+from llm.config import ConfigSnapshot, ConfigSource, LLMModuleConfig
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher:
+    """
+    Polls a json config file for changes (mtime and size, one stat call per poll) and hands every new, valid
+    LLMModuleConfig snapshot to `on_change`.
+    A file which fails to load or validate, e.g. because it is only half written, is logged and skipped; the
+    previous config stays in effect until the file changes again.
+    """
+
+    def __init__(self, config_file: str, on_change: Callable[[ConfigSnapshot], None], interval: float = 2.0,
+                 base_path: Optional[str] = None):
+        self.config_file = config_file
+        self.on_change = on_change
+        self.interval = interval
+        self.base_path = base_path
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="llm-config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> bool:
+        """
+        Reload the config if the file changed since the last check
+        :return True if a new config was handed to on_change
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            config = ConfigSource(self.config_file, base_path=self.base_path).get_snapshot(LLMModuleConfig)
+        except Exception as e:
+            logger.warning(f"ignoring invalid config {self.config_file}, keeping the current one: {e}")
+            return False
+        logger.info(f"config {self.config_file} changed, reloading")
+        try:
+            self.on_change(config)
+        except Exception as e:
+            logger.warning(f"applying the changed config {self.config_file} failed: {e}")
+            return False
+        return True
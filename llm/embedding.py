@@ -0,0 +1,190 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from llm.api import LLMApi
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VectorStore:
+    """
+    Persistent embedding vectors keyed by (model, text hash).
+    Vectors of one model live in an append-only float32 matrix file which is memory-mapped and grown by doubling,
+    a SQLite index maps every key to its row.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._matrices: Dict[str, np.memmap] = {}
+        self._conn = sqlite3.connect(os.path.join(store_dir, "index.sqlite"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, dim INTEGER NOT NULL, rows INTEGER NOT NULL, "
+            "capacity INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (model TEXT NOT NULL, text_hash TEXT NOT NULL, row INTEGER NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+
+    def _matrix_path(self, model: str) -> str:
+        return os.path.join(self.store_dir, re.sub(r"[^0-9A-Za-z_.-]", "_", model) + ".f32")
+
+    def _open_matrix(self, model: str, dim: int, capacity: int) -> np.memmap:
+        path = self._matrix_path(model)
+        mode = "r+" if os.path.exists(path) else "w+"
+        matrix = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self._matrices[model] = matrix
+        return matrix
+
+    def _get_matrix(self, model: str) -> Optional[np.memmap]:
+        row = self._conn.execute("SELECT dim, capacity FROM models WHERE model = ?", (model,)).fetchone()
+        if row is None:
+            return None
+        dim, capacity = row
+        matrix = self._matrices.get(model)
+        if matrix is not None and matrix.shape[0] == capacity:
+            return matrix
+        # first use, or another process grew the matrix since it was mapped
+        return self._open_matrix(model, dim, capacity)
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """
+        :return vectors of the hashes which are stored, missing hashes are left out
+        """
+        found: Dict[str, np.ndarray] = {}
+        if not hashes:
+            return found
+        with self._lock:
+            # one read transaction, so that no row read is beyond the capacity the matrix was mapped with
+            self._conn.execute("BEGIN")
+            try:
+                matrix = self._get_matrix(model)
+                if matrix is None:
+                    return found
+                # stay well below sqlite's bound parameter limit
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, row FROM vectors WHERE model = ? AND text_hash IN ({placeholders})",
+                        (model, *chunk),
+                    ).fetchall()
+                    for h, row in rows:
+                        found[h] = np.array(matrix[row])
+            finally:
+                self._conn.execute("COMMIT")
+        return found
+
+    def put_many(self, model: str, hashes: Sequence[str], vectors: np.ndarray):
+        if not hashes:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            # the write lock of BEGIN IMMEDIATE keeps other processes sharing the store from reserving the same rows
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._put_many(model, hashes, vectors)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _put_many(self, model: str, hashes: Sequence[str], vectors: np.ndarray):
+        """
+        Called inside the write transaction, vectors are on disk before the index points at them
+        """
+        meta = self._conn.execute("SELECT dim, rows, capacity FROM models WHERE model = ?", (model,)).fetchone()
+        if meta is None:
+            # a matrix file without a model row is left over from a failed write and gets resized
+            dim, rows, stored_capacity = vectors.shape[1], 0, 0
+            capacity = VectorStore.INITIAL_CAPACITY
+        else:
+            dim, rows, stored_capacity = meta
+            capacity = stored_capacity
+        assert vectors.shape[1] == dim, f"{model} vectors have dimension {dim}, got {vectors.shape[1]}"
+        while rows + len(hashes) > capacity:
+            capacity *= 2
+        matrix = self._matrices.get(model)
+        if matrix is None or matrix.shape[0] != capacity:
+            if matrix is not None:
+                matrix.flush()
+                del self._matrices[model]
+            path = self._matrix_path(model)
+            if capacity != stored_capacity and os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(capacity * dim * 4)
+            matrix = self._open_matrix(model, dim, capacity)
+        matrix[rows:rows + len(hashes)] = vectors
+        matrix.flush()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO vectors(model, text_hash, row) VALUES (?, ?, ?)",
+            [(model, h, rows + i) for i, h in enumerate(hashes)],
+        )
+        if meta is None:
+            self._conn.execute("INSERT INTO models(model, dim, rows, capacity) VALUES (?, ?, ?, ?)",
+                               (model, dim, rows + len(hashes), capacity))
+        else:
+            self._conn.execute("UPDATE models SET rows = ?, capacity = ? WHERE model = ?",
+                               (rows + len(hashes), capacity, model))
+
+    def close(self):
+        with self._lock:
+            for matrix in self._matrices.values():
+                matrix.flush()
+            self._matrices.clear()
+            self._conn.close()
+
+
+class EmbeddingService:
+    """
+    Embeds texts through LLMApi with deduplication, batching and a persistent VectorStore,
+    so that repeated texts are served from disk without a network call.
+    """
+
+    def __init__(self, api: LLMApi, model: Optional[str] = None, batch_size: Optional[int] = None,
+                 store: Optional[VectorStore] = None):
+        self.api = api
+        self.model = api.config.embedding_model if model is None else model
+        self.batch_size = api.config.embedding_batch_size if batch_size is None else batch_size
+        self.store = VectorStore(api.config.embedding_store_full_path) if store is None else store
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        :param texts: texts to embed, duplicates are only embedded once
+        :return float32 matrix with one row per text, in the order of texts
+        """
+        hashes = [text_hash(text) for text in texts]
+        unique: Dict[str, str] = {}
+        for h, text in zip(hashes, texts):
+            unique.setdefault(h, text)
+        vectors = self.store.get_many(self.model, list(unique.keys()))
+        missing = [h for h in unique.keys() if h not in vectors]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embedded = np.asarray(self.api.create_embeddings([unique[h] for h in batch], self.model),
+                                  dtype=np.float32)
+            self.store.put_many(self.model, batch, embedded)
+            for h, vector in zip(batch, embedded):
+                vectors[h] = vector
+        if not hashes:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in hashes])
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,69 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from llm.config import LLMModuleConfig
+
+
+class LatencyWindow:
+    """
+    Rolling window of the most recent request latencies
+    """
+
+    def __init__(self, size: int = 200):
+        self.latencies: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def record(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+        index = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+
+class HedgingPolicy:
+    """
+    Decides when a duplicate of a slow request is fired: once the primary has been running longer than the
+    `percentile`-th percentile of recently observed latencies of the same model.
+    No hedge is sent until `min_samples` latencies have been observed for that model.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, window_size: int = 200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window_size = window_size
+        self.windows: Dict[str, LatencyWindow] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: LLMModuleConfig):
+        return HedgingPolicy(percentile=config.hedge_percentile, min_samples=config.hedge_min_samples,
+                             window_size=config.hedge_window_size)
+
+    def _get_window(self, model: str) -> LatencyWindow:
+        window = self.windows.get(model)
+        if window is None:
+            with self._lock:
+                window = self.windows.setdefault(model, LatencyWindow(self.window_size))
+        return window
+
+    def record(self, model: str, latency: float):
+        self._get_window(model).record(latency)
+
+    def get_hedge_delay(self, model: str) -> Optional[float]:
+        """
+        :return seconds to wait for the primary before hedging, None if there is not enough history yet
+        """
+        window = self._get_window(model)
+        if len(window) < self.min_samples:
+            return None
+        return window.percentile(self.percentile)
@@ -0,0 +1,171 @@
+import os
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_BUCKETS: Tuple[float, ...] = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+# name -> (help, buckets)
+HISTOGRAMS: Dict[str, Tuple[str, Tuple[float, ...]]] = {
+    "llm_request_latency_seconds": ("Wall time of chat requests sent to the network, retries included",
+                                    LATENCY_BUCKETS),
+    "llm_time_to_first_token_seconds": ("Time until the first content token of streamed chat requests",
+                                        LATENCY_BUCKETS),
+    "llm_prompt_tokens": ("Prompt tokens per chat request", TOKEN_BUCKETS),
+    "llm_completion_tokens": ("Completion tokens per chat request", TOKEN_BUCKETS),
+}
+# name -> help
+COUNTERS: Dict[str, str] = {
+    "llm_requests_total": "Chat requests sent to the network",
+    "llm_retries_total": "Extra attempts made for chat requests, hedges included",
+    "llm_errors_total": "Chat requests which failed after all attempts",
+    "llm_cache_hits_total": "Chat requests answered from a response cache",
+}
+
+LabelsType = Tuple[Tuple[str, str], ...]
+
+
+def _make_labels(labels: Dict[str, Optional[str]]) -> LabelsType:
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelsType, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, `counts[i]` holds the observations in (buckets[i - 1], buckets[i]] and the last count
+    the ones above the largest bucket
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        :return upper bound of the bucket holding the p-th percentile, inf if it is above the largest bucket
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class LLMMetrics:
+    """
+    In-process registry of the LLM request metrics listed in HISTOGRAMS and COUNTERS, labeled by model, endpoint
+    and prompt template.
+    Series can be queried directly or exported in the Prometheus text format, e.g. for the node_exporter textfile
+    collector.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, LabelsType], Histogram] = {}
+        self._counters: Dict[Tuple[str, LabelsType], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: Optional[str]):
+        assert name in HISTOGRAMS, f"{name} is not a known histogram"
+        key = (name, _make_labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: Optional[str]):
+        assert name in COUNTERS, f"{name} is not a known counter"
+        key = (name, _make_labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def get_histogram(self, name: str, **labels: Optional[str]) -> Optional[Histogram]:
+        return self._histograms.get((name, _make_labels(labels)))
+
+    def get_counter(self, name: str, **labels: Optional[str]) -> float:
+        return self._counters.get((name, _make_labels(labels)), 0)
+
+    def summary(self) -> Dict[str, List[Dict[str, object]]]:
+        """
+        :return per metric name, one entry per label set with count, mean, p50 and p95 for histograms and the value
+        for counters
+        """
+        result: Dict[str, List[Dict[str, object]]] = {}
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                result.setdefault(name, []).append(dict(labels, count=histogram.count, mean=histogram.mean(),
+                                                        p50=histogram.percentile(50), p95=histogram.percentile(95)))
+            for (name, labels), value in sorted(self._counters.items()):
+                result.setdefault(name, []).append(dict(labels, value=value))
+        return result
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, (help_text, _) in HISTOGRAMS.items():
+                series = sorted((labels, h) for (n, labels), h in self._histograms.items() if n == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} "
+                                     f"{cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for name, help_text in COUNTERS.items():
+                series = sorted((labels, v) for (n, labels), v in self._counters.items() if n == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """
+        Write the Prometheus text export to path, replacing the file atomically so a scraper never reads half of it
+        """
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
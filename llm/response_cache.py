@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# request fields which do not change the generated answer
+_NON_KEY_FIELDS = ("stream", "timeout")
+
+
+def make_request_key(request: Dict[str, Any]) -> str:
+    """
+    Content address of a chat request: sha256 over the canonical json of model, messages, sampling params,
+    seed and response_format
+    """
+    payload = {k: v for k, v in request.items() if k not in _NON_KEY_FIELDS}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(request: Dict[str, Any]) -> bool:
+    """
+    Only a request with greedy decoding, temperature or top_p 0, is answered from the caches, a sampled request is
+    meant to get a different response on every call
+    """
+    return request.get("temperature", 1) == 0 or request.get("top_p", 1) == 0
+
+
+class ResponseCache:
+    """
+    On-disk (SQLite) cache of chat responses keyed by make_request_key.
+    Entries older than max_age seconds are dropped on lookup and on insert, and once the cache holds more than
+    max_entries entries or max_bytes bytes of responses the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024,
+                 max_age: float = 0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.max_age > 0 and now - created_at > self.max_age
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._is_expired(row[1], now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, response: Dict[str, Any]):
+        now = time.time()
+        data = json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses(key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.max_age > 0:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            entries -= 1
+            total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,152 @@
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from llm.config import LLMModuleConfig
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of the request volume.
+    Every request deposits `ratio` tokens and every retry withdraws one, so under a sustained outage at most
+    about ratio retries per request are sent instead of max_retries per request.
+    """
+
+    def __init__(self, ratio: float, min_tokens: float):
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+        self.max_tokens = max(min_tokens, 10 * min_tokens)
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def try_acquire_retry(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Classified retries with jittered exponential backoff.
+    Rate limits, timeouts, connection errors and 408/409/5xx responses are retried; `Retry-After` headers sent by
+    the server take precedence over the computed backoff.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 60.0,
+                 budget: Optional[RetryBudget] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    @staticmethod
+    def from_config(config: LLMModuleConfig):
+        return RetryPolicy(
+            max_retries=config.max_retries,
+            base_delay=config.retry_base_delay,
+            max_delay=config.retry_max_delay,
+            budget=RetryBudget(config.retry_budget_ratio, config.retry_budget_min),
+        )
+
+    @staticmethod
+    def is_retryable(e: Exception) -> bool:
+        import openai
+        if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        if isinstance(e, openai.APIStatusError):
+            return e.status_code in RETRYABLE_STATUS_CODES or e.status_code >= 500
+        return False
+
+    @staticmethod
+    def get_retry_after(e: Exception) -> Optional[float]:
+        response = getattr(e, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if retry_after is None:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return max(retry_date.timestamp() - time.time(), 0)
+
+    def get_delay(self, attempt: int, e: Exception) -> float:
+        retry_after = RetryPolicy.get_retry_after(e)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay) + random.uniform(0, self.base_delay / 4)
+        # full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _should_retry(self, attempt: int, e: Exception) -> bool:
+        if attempt >= self.max_retries or not RetryPolicy.is_retryable(e):
+            return False
+        if self.budget is not None and not self.budget.try_acquire_retry():
+            logger.warning(f"retry budget exhausted, giving up after {attempt + 1} attempts: {e}")
+            return False
+        return True
+
+    def call(self, fn: Callable[[], _T], stop: Optional[threading.Event] = None) -> _T:
+        """
+        :param stop: once set, the backoff is cut short and the last error raised instead of retrying
+        """
+        import openai
+        if self.budget is not None:
+            self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except openai.APIError as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self.get_delay(attempt, e)
+                logger.warning(f"LLM request failed ({type(e).__name__}), retrying in {delay:.2f}s: {e}")
+                if stop is None:
+                    time.sleep(delay)
+                elif stop.wait(delay):
+                    raise
+                attempt += 1
+
+    async def acall(self, fn: Callable[[], Awaitable[_T]]) -> _T:
+        import openai
+        if self.budget is not None:
+            self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except openai.APIError as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self.get_delay(attempt, e)
+                logger.warning(f"LLM request failed ({type(e).__name__}), retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
@@ -0,0 +1,145 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from llm.config import EndpointConfig, LLMModuleConfig
+
+logger = logging.getLogger(__name__)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate: float = 0.0
+        self.consecutive_failures: int = 0
+        self.ejected_until: float = 0.0
+        self.eject_seconds: float = 0.0
+        self.probing: bool = False
+        # time.time() the current probe was let through
+        self.probe_started: float = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def __repr__(self):
+        return f"EndpointStats(latency={self.latency}, error_rate={self.error_rate:.3f}, " \
+               f"consecutive_failures={self.consecutive_failures}, ejected_until={self.ejected_until})"
+
+
+class EndpointRouter:
+    """
+    Spreads requests over several endpoints.
+    An endpoint is picked at random with probability proportional to weight / latency * (1 - error_rate)^2, where
+    latency and error rate are exponentially weighted moving averages of observed requests.
+    After `eject_failures` consecutive failures an endpoint is ejected for `eject_seconds`; once that passes a single
+    probe request is let through and a success brings the endpoint back, while a failed probe ejects it again for
+    twice as long, up to `max_eject_seconds`. Failures of requests which were already in flight do not extend an
+    ejection.
+    """
+
+    def __init__(self, endpoints: List[EndpointConfig], latency_alpha: float = 0.2, eject_failures: int = 3,
+                 eject_seconds: float = 30.0, max_eject_seconds: float = 300.0):
+        assert endpoints, "EndpointRouter needs at least one endpoint"
+        self.endpoints = endpoints
+        self.latency_alpha = latency_alpha
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.stats: Dict[str, EndpointStats] = {endpoint.name: EndpointStats() for endpoint in endpoints}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_config(config: LLMModuleConfig):
+        return EndpointRouter(config.endpoints, latency_alpha=config.endpoint_latency_alpha,
+                              eject_failures=config.endpoint_eject_failures,
+                              eject_seconds=config.endpoint_eject_seconds,
+                              max_eject_seconds=config.endpoint_max_eject_seconds)
+
+    def inherit_stats(self, other: "EndpointRouter"):
+        """
+        Take over the observed latency, error rate and ejection state of endpoints which other routes to under the
+        same name, e.g. when the endpoint list is reloaded
+        """
+        with other._lock:
+            for name, stats in other.stats.items():
+                if name in self.stats:
+                    self.stats[name] = stats
+
+    def _score(self, endpoint: EndpointConfig, default_latency: float) -> float:
+        stats = self.stats[endpoint.name]
+        latency = stats.latency if stats.latency is not None else default_latency
+        return endpoint.weight / max(latency, 1e-3) * (1 - stats.error_rate) ** 2
+
+    def select(self, exclude: Iterable[str] = ()) -> EndpointConfig:
+        """
+        :param exclude: names of endpoints to avoid (e.g. ones that already failed for this request), ignored when
+        nothing else is available
+        """
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        exclude = set(exclude)
+        now = time.time()
+        with self._lock:
+            healthy = [e for e in self.endpoints if not self.stats[e.name].is_ejected(now)]
+            candidates = [e for e in healthy if e.name not in exclude] or healthy
+            probe = [e for e in candidates if self.stats[e.name].ejected_until > 0 and not self.stats[e.name].probing]
+            if probe:
+                # ejection is over, let exactly one request through to find out whether the endpoint recovered
+                endpoint = probe[0]
+                self.stats[endpoint.name].probing = True
+                self.stats[endpoint.name].probe_started = time.time()
+                return endpoint
+            candidates = [e for e in candidates if not self.stats[e.name].probing] or candidates
+            if not candidates:
+                # everything is ejected, fail open on the endpoint which comes back first
+                return min(self.endpoints, key=lambda e: self.stats[e.name].ejected_until)
+            latencies = [self.stats[e.name].latency for e in candidates if self.stats[e.name].latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            scores = [self._score(e, default_latency) for e in candidates]
+            if sum(scores) <= 0:
+                return random.choice(candidates)
+            return random.choices(candidates, weights=scores)[0]
+
+    def release(self, endpoint: EndpointConfig):
+        """
+        Forget a request which was abandoned before it finished (e.g. a cancelled hedge), so that a probe slot it
+        held is given back
+        """
+        with self._lock:
+            stats = self.stats.get(endpoint.name)
+            if stats is not None:
+                stats.probing = False
+
+    def report(self, endpoint: EndpointConfig, latency: float, success: bool):
+        """
+        :param latency: seconds the request took, also tells a failed probe from a request which was sent before it
+        """
+        alpha = self.latency_alpha
+        now = time.time()
+        with self._lock:
+            stats = self.stats.get(endpoint.name)
+            if stats is None:
+                return
+            stats.error_rate = (1 - alpha) * stats.error_rate + alpha * (0.0 if success else 1.0)
+            if success:
+                stats.latency = latency if stats.latency is None else (1 - alpha) * stats.latency + alpha * latency
+                stats.consecutive_failures = 0
+                stats.ejected_until = 0.0
+                stats.eject_seconds = 0.0
+                stats.probing = False
+                return
+            stats.consecutive_failures += 1
+            # allow for the clocks of latency and probe_started to differ slightly
+            if stats.probing and now - latency >= stats.probe_started - 1e-3:
+                stats.eject_seconds = min(stats.eject_seconds * 2, self.max_eject_seconds)
+            elif stats.ejected_until == 0 and stats.consecutive_failures >= self.eject_failures:
+                stats.eject_seconds = self.eject_seconds
+            else:
+                # healthy so far, or ejected already and failing requests sent before the ejection
+                return
+            stats.ejected_until = now + stats.eject_seconds
+            stats.probing = False
+            logger.warning(f"endpoint {endpoint.name} ejected for {stats.eject_seconds:.0f}s after "
+                           f"{stats.consecutive_failures} consecutive failures")
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+# request fields which are neither part of the namespace nor of the compared text
+_NON_NAMESPACE_FIELDS = ("messages", "stream", "timeout")
+
+
+def split_request(request: Dict[str, Any], template_key: Optional[str] = None,
+                  template_vars: Optional[Dict[str, Any]] = None) -> Optional[Tuple[str, str]]:
+    """
+    Split a chat request into the namespace its answers may be shared in and the text which is compared by meaning.
+    The namespace covers the template key, model, sampling params and every message but the last one, so only the
+    final user message may differ between requests that share an answer.
+    :param request: chat request as built by llm.api
+    :param template_key: prompt template the request was rendered from
+    :param template_vars: variables the final user message was rendered with from template_key, if given only they
+    are compared. The template text all these requests share would otherwise dominate their similarity
+    :return (namespace, text), None if the request does not end with a user message
+    """
+    messages = request["messages"]
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    payload = {k: v for k, v in request.items() if k not in _NON_NAMESPACE_FIELDS}
+    payload["template_key"] = template_key
+    payload["context"] = messages[:-1]
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    namespace = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    if template_key is not None and template_vars is not None:
+        return namespace, "\n".join(f"{name}: {value}" for name, value in sorted(template_vars.items()))
+    return namespace, messages[-1].get("content") or ""
+
+
+def _normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class _NamespaceIndex:
+    """
+    In-memory copy of the normalized prompt vectors of one namespace, searched by brute force cosine similarity
+    """
+
+    def __init__(self, ids: np.ndarray, created_at: np.ndarray, vectors: Optional[np.ndarray]):
+        self.ids = ids
+        self.created_at = created_at
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, entry_id: int, created_at: float, vector: np.ndarray):
+        self.ids = np.append(self.ids, entry_id)
+        self.created_at = np.append(self.created_at, created_at)
+        self.vectors = vector[None, :] if self.vectors is None else np.vstack([self.vectors, vector])
+
+    def keep(self, mask: np.ndarray):
+        self.ids = self.ids[mask]
+        self.created_at = self.created_at[mask]
+        self.vectors = self.vectors[mask] if self.vectors is not None and mask.any() else None
+
+
+class SemanticCache:
+    """
+    On-disk (SQLite) cache of chat responses looked up by meaning: a request is answered from the cache when the
+    embedding of its last user message has cosine similarity of at least `threshold` with a prompt answered before
+    in the same namespace (see split_request).
+    Every namespace keeps at most `max_entries` entries, the oldest are evicted first, and entries older than
+    `max_age` seconds are never served.
+    """
+
+    def __init__(self, path: str, embed: Callable[[Sequence[str]], np.ndarray], threshold: float = 0.95,
+                 max_entries: int = 1000, max_age: float = 0):
+        """
+        :param path: SQLite database file
+        :param embed: embeds a batch of texts into a matrix with one row per text
+        """
+        self.path = path
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _NamespaceIndex] = {}
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, namespace TEXT NOT NULL, prompt TEXT NOT NULL, "
+            "vector BLOB NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_namespace ON entries(namespace, created_at)")
+
+    def _get_index(self, namespace: str, now: float) -> _NamespaceIndex:
+        index = self._indexes.get(namespace)
+        if index is None:
+            min_created_at = now - self.max_age if self.max_age > 0 else 0.0
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND created_at < ?",
+                               (namespace, min_created_at))
+            rows = self._conn.execute(
+                "SELECT id, created_at, vector FROM entries WHERE namespace = ? ORDER BY id", (namespace,)
+            ).fetchall()
+            vectors = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows]) if rows else None
+            index = _NamespaceIndex(np.array([row[0] for row in rows], dtype=np.int64),
+                                    np.array([row[1] for row in rows], dtype=np.float64), vectors)
+            self._indexes[namespace] = index
+        return index
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return _normalize(self.embed([text])[0])
+
+    def get(self, namespace: str, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        :param namespace: namespace from split_request
+        :param vector: normalized embedding of the prompt, see embed_one
+        :return the response of the most similar prompt if it is similar enough
+        """
+        now = time.time()
+        with self._lock:
+            index = self._get_index(namespace, now)
+            if self.max_age > 0 and len(index):
+                index.keep(index.created_at >= now - self.max_age)
+            if not len(index):
+                self.misses += 1
+                return None
+            scores = index.vectors @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            row = self._conn.execute("SELECT response FROM entries WHERE id = ?", (int(index.ids[best]),)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, namespace: str, text: str, vector: np.ndarray, response: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            index = self._get_index(namespace, now)
+            cursor = self._conn.execute(
+                "INSERT INTO entries(namespace, prompt, vector, response, created_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, text, np.asarray(vector, dtype=np.float32).tobytes(),
+                 json.dumps(response, ensure_ascii=False), now),
+            )
+            index.append(cursor.lastrowid, now, vector)
+            if len(index) > self.max_entries:
+                evicted = index.ids[:len(index) - self.max_entries]
+                self._conn.executemany("DELETE FROM entries WHERE id = ?", [(int(i),) for i in evicted])
+                mask = np.zeros(len(index), dtype=bool)
+                mask[len(evicted):] = True
+                index.keep(mask)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, namespaces = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT namespace) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "namespaces": namespaces,
+        }
+
+    def close(self):
+        with self._lock:
+            self._indexes.clear()
+            self._conn.close()
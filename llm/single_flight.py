@@ -0,0 +1,211 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _SharedStream:
+    """
+    A stream read by several subscribers. Chunks are buffered so that a late subscriber replays what it missed;
+    whichever subscriber runs out of buffered chunks pulls the next one from the source, so no subscriber depends
+    on another one to keep reading.
+    Subscribers are counted under the lock of the owning SingleFlight, the same lock new callers look the stream up
+    under, so a stream is never joined once it was given up or has ended.
+    """
+
+    def __init__(self, registry_lock: threading.Lock, forget: Callable[[], None]):
+        self.registry_lock = registry_lock
+        # removes the stream from the registry, called with registry_lock held
+        self.forget = forget
+        self.subscribers = 0
+        self._source: Optional[Iterator[Any]] = None
+        self._chunks: List[Any] = []
+        self._finished = False
+        self._error: Optional[BaseException] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def can_join(self) -> bool:
+        return not (self._finished and self._error is not None)
+
+    def start(self, source: Iterator[Any]):
+        self._source = source
+        self._ready.set()
+
+    def fail(self, error: BaseException):
+        self._error = error
+        self._finished = True
+        self._ready.set()
+
+    def _finish(self, error: Optional[BaseException] = None):
+        # leave the registry before the end becomes visible, nobody may join a stream which has ended
+        with self.registry_lock:
+            self.forget()
+        self._error = error
+        self._finished = True
+
+    def _pull(self, index: int) -> bool:
+        """
+        Make chunk `index` available
+        :return False once the stream has ended before that chunk
+        """
+        with self._lock:
+            if index < len(self._chunks):
+                return True
+            if self._error is not None:
+                raise self._error
+            if self._finished:
+                return False
+            try:
+                self._chunks.append(next(self._source))
+            except StopIteration:
+                self._finish()
+                return False
+            except Exception as e:
+                self._finish(e)
+                raise
+            return True
+
+    def _unsubscribe(self):
+        with self.registry_lock:
+            self.subscribers -= 1
+            if self.subscribers > 0 or self._finished:
+                return
+            # everyone stopped reading, give up the request instead of leaving it half read for later callers
+            self.forget()
+        with self._lock:
+            if self._finished:
+                return
+            self._error = Exception("stream was abandoned by all of its readers")
+            self._finished = True
+            close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+
+    def subscribe(self) -> Iterator[Any]:
+        self._ready.wait()
+        try:
+            index = 0
+            while self._pull(index):
+                yield self._chunks[index]
+                index += 1
+        finally:
+            self._unsubscribe()
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls which are in flight at the same time: the first caller of a key runs the call, callers
+    arriving before it finishes wait for and share its outcome (result or exception).
+    Nothing is remembered once a call has finished, that is the job of the response caches.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _SharedStream] = {}
+        self._lock = threading.Lock()
+
+    def call(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stream(self, key: str, fn: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """
+        :param fn: opens the stream, only called by the first caller of a key. Errors it raises reach that caller
+        directly and the callers which joined meanwhile on their first read
+        :return iterator over all chunks of the shared stream, from the first one on
+        """
+        with self._lock:
+            self.calls += 1
+            shared = self._streams.get(key)
+            if shared is not None and shared.can_join():
+                self.coalesced += 1
+                shared.subscribers += 1
+                return shared.subscribe()
+            shared = self._streams[key] = _SharedStream(self._lock, lambda: self._forget_stream(key, shared))
+            shared.subscribers += 1
+        try:
+            source = fn()
+        except BaseException as e:
+            with self._lock:
+                self._forget_stream(key, shared)
+            shared.fail(e)
+            raise
+        shared.start(iter(source))
+        return shared.subscribe()
+
+    def _forget_stream(self, key: str, shared: _SharedStream):
+        """
+        Called with _lock held
+        """
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight.call.
+    The call runs in its own task, so a caller which is cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def call(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._tasks.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._forget_task(key, done))
+        return await asyncio.shield(task)
+
+    def _forget_task(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._tasks),
+        }
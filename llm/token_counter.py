@@ -0,0 +1,159 @@
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# context windows of exact model names, the budget is not enforced for other models (e.g. azure deployment names)
+# unless config context_window is set
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-4o": 128000,
+    "gpt-4o-2024-05-13": 128000,
+    "gpt-4o-2024-08-06": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-turbo-2024-04-09": 128000,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4-0125-preview": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4-32k-0613": 32768,
+    "gpt-4": 8192,
+    "gpt-4-0613": 8192,
+    "gpt-3.5-turbo-0125": 16385,
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+}
+
+logger = logging.getLogger(__name__)
+
+# chat format overhead, see openai-cookbook "How to count tokens with tiktoken"
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+# model -> tiktoken encoding, None once loading it failed
+_encodings: Dict[str, Any] = {}
+_encodings_lock = threading.Lock()
+
+
+def _load_encoding(model: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # tiktoken downloads its bpe files on first use, fall back to estimates when that is not possible
+        logger.warning(f"tiktoken encoding for {model} is not available, estimating token counts: {e}")
+        return None
+
+
+def _get_encoding(model: str):
+    if model in _encodings:
+        return _encodings[model]
+    with _encodings_lock:
+        if model not in _encodings:
+            _encodings[model] = _load_encoding(model)
+        return _encodings[model]
+
+
+def preload_encoding(model: str):
+    """
+    Load the encoding of model in a background thread, so that the download of its bpe file by tiktoken does not
+    hold up a request
+    """
+    if model not in _encodings:
+        threading.Thread(target=_get_encoding, args=(model,), name="tiktoken-preload", daemon=True).start()
+
+
+@lru_cache(maxsize=8192)
+def _count_text(model: str, text: str) -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # rough estimate when tiktoken or its encoding files are not available
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=8192)
+def _count_message(model: str, role: str, content: str, name: Optional[str]) -> int:
+    tokens = TOKENS_PER_MESSAGE + _count_text(model, role) + _count_text(model, content)
+    if name is not None:
+        tokens += TOKENS_PER_NAME + _count_text(model, name)
+    return tokens
+
+
+def get_context_window(model: str) -> Optional[int]:
+    """
+    :return context window of model, None if the model is unknown
+    """
+    return CONTEXT_WINDOWS.get(model)
+
+
+class TokenCounter:
+    """
+    Local prompt size computation for chat messages, token counts are cached per message
+    """
+
+    def __init__(self, model: str, context_window: int = 0):
+        """
+        :param context_window: 0 looks the window up from the model name
+        """
+        self.model = model
+        self.context_window = context_window if context_window > 0 else get_context_window(model)
+
+    def is_exact(self) -> bool:
+        """
+        :return whether counts come from tiktoken rather than an estimate, never waits for the encoding to load
+        """
+        return _encodings.get(self.model) is not None
+
+    def count_text(self, text: str) -> int:
+        return _count_text(self.model, text)
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        return _count_message(self.model, message["role"], message.get("content") or "", message.get("name"))
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(self.count_message(message) for message in messages) + TOKENS_PER_REPLY
+
+    def fit(self, messages: List[Dict[str, Any]], max_tokens: int, min_completion_tokens: int,
+            overflow: str = "reject") -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Make a prompt fit the context window. Nothing is enforced unless the window is known and the encoding of
+        the model is loaded, an estimated count is no reason to reject or trim a prompt
+        :param messages: chat messages
+        :param max_tokens: requested completion tokens
+        :param min_completion_tokens: completion tokens that must remain available
+        :param overflow: "reject" raises on oversize prompts, "trim" drops the oldest messages which are neither
+        system messages nor the last message
+        :return messages to send and max_tokens clamped to the remaining window
+        """
+        if self.context_window is None or not self.is_exact():
+            return messages, max_tokens
+        budget = self.context_window - min(min_completion_tokens, max_tokens)
+        prompt_tokens = self.count_messages(messages)
+        if prompt_tokens > budget and overflow == "trim":
+            messages = list(messages)
+            i = 0
+            while prompt_tokens > budget and i < len(messages) - 1:
+                if messages[i]["role"] == "system":
+                    i += 1
+                    continue
+                prompt_tokens -= self.count_message(messages[i])
+                del messages[i]
+        if prompt_tokens > budget:
+            raise Exception(
+                f"prompt has {prompt_tokens} tokens, {self.model} context window of {self.context_window} tokens "
+                f"leaves no room for {min(min_completion_tokens, max_tokens)} completion tokens",
+            )
+        return messages, min(max_tokens, self.context_window - prompt_tokens)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str, context_window: int = 0) -> TokenCounter:
+    return TokenCounter(model, context_window)
@@ -0,0 +1,24 @@
+from llm.aad_token import AADTokenProvider
+from llm.config import ConfigSource, LLMModuleConfig
+
+
+def _provider(tmp_path, expires_in):
+    config = LLMModuleConfig(ConfigSource(config={'llm.api_key': 'k', 'llm.aad_token_refresh_margin': 300},
+                                          base_path=str(tmp_path)))
+    provider = AADTokenProvider(config)
+    provider._acquire_token = lambda interactive: {'access_token': 'token', 'expires_in': expires_in}
+    return provider
+
+
+def test_short_lived_token_is_refreshed_halfway(tmp_path):
+    provider = _provider(tmp_path, 120)
+    assert provider.get_token() == 'token'
+    assert 55 < provider._timer.interval <= 60
+    provider.close()
+
+
+def test_long_lived_token_is_refreshed_before_the_margin(tmp_path):
+    provider = _provider(tmp_path, 3600)
+    provider.get_token()
+    assert 3295 < provider._timer.interval <= 3300
+    provider.close()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from llm.api import AsyncLLMApi, LLMApi
+from llm.config import ConfigSource, LLMModuleConfig
+
+
+def _config(tmp_path, **kwargs):
+    config = {'llm.api_key': 'k', 'llm.model': 'gpt', 'llm.response_cache_enabled': True}
+    config.update({'llm.' + key: value for key, value in kwargs.items()})
+    return LLMModuleConfig(ConfigSource(config=config, base_path=str(tmp_path)))
+
+
+def _response(text):
+    message = SimpleNamespace(role='assistant', content=text)
+    usage = SimpleNamespace(prompt_tokens=5, completion_tokens=3, total_tokens=8)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def _client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def _bad_request():
+    response = httpx.Response(400, request=httpx.Request('POST', 'http://endpoint'))
+    return openai.BadRequestError('bad request', response=response, body=None)
+
+
+def _messages(text):
+    return [{'role': 'user', 'content': text}]
+
+
+def _async_api(tmp_path, create, **kwargs):
+    api = AsyncLLMApi(_config(tmp_path, **kwargs))
+
+    async def get_client(state, endpoint):
+        return _client(create)
+
+    api._get_client = get_client
+    return api
+
+
+def test_async_chat_completion_uses_response_cache(tmp_path):
+    calls = []
+
+    async def create(**request):
+        calls.append(request)
+        return _response(f'answer {len(calls)}')
+
+    api = _async_api(tmp_path, create)
+
+    async def run():
+        first = await api.chat_completion(_messages('hi'))
+        second = await api.chat_completion(_messages('hi'))
+        await api.aclose()
+        return first, second
+
+    assert asyncio.run(run()) == ({'role': 'assistant', 'content': 'answer 1'},
+                                  {'role': 'assistant', 'content': 'answer 1'})
+    assert len(calls) == 1
+    assert api.metrics.get_counter('llm_cache_hits_total', cache='exact', model='gpt', template=None) == 1
+    assert api.metrics.get_counter('llm_requests_total', model='gpt', endpoint=api.config.endpoints[0].name,
+                                   template=None) == 1
+
+
+def test_async_chat_completion_wraps_openai_errors(tmp_path):
+    async def create(**request):
+        raise _bad_request()
+
+    api = _async_api(tmp_path, create)
+    with pytest.raises(Exception, match='OpenAI API request was invalid'):
+        asyncio.run(api.chat_completion(_messages('hi')))
+    assert api.metrics.get_counter('llm_errors_total', error='BadRequestError', model='gpt',
+                                   endpoint=api.config.endpoints[0].name, template=None) == 1
+
+
+def test_async_chat_completion_many_bounds_concurrency(tmp_path):
+    running = []
+    peak = []
+
+    async def create(**request):
+        content = request['messages'][-1]['content']
+        running.append(content)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(content)
+        if content == 'fail':
+            raise _bad_request()
+        return _response(content.upper())
+
+    api = _async_api(tmp_path, create, max_concurrent_requests=2)
+    messages_list = [_messages(text) for text in ['a', 'b', 'fail', 'c', 'd']]
+
+    # the api is used from two event loops in turn, each gets its own limit
+    for _ in range(2):
+        results = asyncio.run(api.chat_completion_many(messages_list, use_cache=False))
+        assert [result.index for result in results] == [0, 1, 2, 3, 4]
+        contents = [result.get_response()['content'] for result in results if result.is_success()]
+        assert contents == ['A', 'B', 'C', 'D']
+        assert not results[2].is_success()
+        assert 'was invalid' in str(results[2].get_error())
+        assert max(peak) == 2
+
+
+def test_chat_completion_many_keeps_order_and_errors(tmp_path):
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def create(**request):
+        content = request['messages'][-1]['content']
+        with lock:
+            running.append(content)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(content)
+        if content == 'fail':
+            raise _bad_request()
+        return _response(content.upper())
+
+    api = LLMApi(_config(tmp_path))
+    api._get_client = lambda state, endpoint: _client(create)
+
+    results = api.chat_completion_many([_messages(text) for text in ['a', 'fail', 'b', 'c']], max_workers=2)
+    assert [result.index for result in results] == [0, 1, 2, 3]
+    assert [result.get_response() for result in results] == [{'role': 'assistant', 'content': 'A'}, None,
+                                                             {'role': 'assistant', 'content': 'B'},
+                                                             {'role': 'assistant', 'content': 'C'}]
+    assert 'was invalid' in str(results[1].get_error())
+    assert max(peak) == 2
+    assert api.chat_completion_many([]) == []
+    api.close()
@@ -0,0 +1,84 @@
+import pytest
+
+from utils.DependencyGraph import CodeEntity, CodeEntityType, DependencyGraph
+
+
+def test_compact_graph_rejects_structure_changes(tmp_path):
+    a, b = CodeEntity('A'), CodeEntity('B')
+    graph = DependencyGraph([a, b])
+    graph.add_edge(a, b)
+    compact = graph.compact()
+    view_a, view_b = compact.get_code_entities()
+
+    for change in (lambda: compact.append_entity(CodeEntity('C')),
+                   lambda: compact.add_edge(view_b, view_a),
+                   lambda: compact.extend_graph_from_files(str(tmp_path / 'steps.yaml'), str(tmp_path / 'deps.json'))):
+        with pytest.raises(Exception, match='to_dependency_graph'):
+            change()
+    assert compact.top_sort_entities() == [view_a, view_b]
+
+
+def _describe(graph):
+    entities = graph.get_code_entities()
+    return [(entity.get_entity_name(), entity.get_qualifier_name(), entity.get_entity_type(),
+             entity.get_code_desc(), entity.get_code_definition(), entity.get_code_body(),
+             None if entity.get_parent_code_entity() is None else entity.get_parent_code_entity().get_qualifier_name(),
+             sorted(edge.get_from_entity().get_qualifier_name() for edge in entity.in_edges or []))
+            for entity in entities]
+
+
+def test_snapshot_round_trip(tmp_path):
+    game = CodeEntity('Spiel', CodeEntityType.Package)
+    board = CodeEntity('Brett', CodeEntityType.Class, code_desc='Das Spielfeld ♟', parent_code_entity=game)
+    player = CodeEntity('Spieler', CodeEntityType.Class, code_definition='class Spieler: ...',
+                        code_body='name = "Zoë 🎲"', parent_code_entity=game)
+    move = CodeEntity('zug', CodeEntityType.Function, code_desc='Das Spielfeld ♟', parent_code_entity=board)
+    board.add_sub_entity(move)
+    # game itself is not part of the graph, it stays an external parent
+    graph = DependencyGraph([board, player, move])
+    graph.add_edge(player, board, 'benutzt')
+    graph.add_edge(player, move)
+    path = str(tmp_path / 'snapshots' / 'graph.snap')
+
+    graph.save_snapshot(path)
+    with DependencyGraph.load_snapshot(path) as loaded:
+        assert _describe(loaded) == _describe(graph)
+        assert loaded.external_parents[0].get_qualifier_name() == 'Spiel'
+        order = [entity.get_qualifier_name() for entity in loaded.top_sort_entities()]
+        assert order == ['Spiel.Spieler', 'Spiel.Brett', 'Spiel.Brett.zug']
+        assert _describe(loaded.to_dependency_graph()) == _describe(graph)
+
+
+def test_snapshot_of_empty_graph(tmp_path):
+    path = str(tmp_path / 'empty.snap')
+    DependencyGraph([]).save_snapshot(path)
+
+    with DependencyGraph.load_snapshot(path) as loaded:
+        assert list(loaded.get_code_entities()) == []
+        assert loaded.top_sort_entities() == []
+
+
+def test_close_unmaps_snapshot(tmp_path):
+    a, b = CodeEntity('A'), CodeEntity('B')
+    graph = DependencyGraph([a, b])
+    graph.add_edge(a, b)
+    path = str(tmp_path / 'graph.snap')
+    graph.save_snapshot(path)
+
+    loaded = DependencyGraph.load_snapshot(path)
+    assert loaded.get_code_entities()[1].get_entity_name() == 'B'
+    loaded.close()
+    assert loaded._mapping is None
+    with pytest.raises(ValueError):
+        loaded.get_code_entities()[1].get_entity_name()
+    loaded.close()
+    # graphs which were never mapped have nothing to close
+    graph.compact().close()
+
+
+def test_load_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.snap'
+    path.write_bytes(b'\0' * 64)
+
+    with pytest.raises(Exception, match='not a dependency graph snapshot'):
+        DependencyGraph.load_snapshot(str(path))
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from llm.config import ConfigSource, LLMModuleConfig
+
+KEYS = ['LLM_API_KEY', 'LLM_API_BASE', 'LLM_API_VERSION', 'LLM_MODEL', 'LLM_BACKUP_MODEL', 'LLM_REQUEST_TIMEOUT']
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for key in KEYS:
+        monkeypatch.delenv(key, raising=False)
+    return monkeypatch
+
+
+def test_config_precedence(tmp_path, env):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps({'llm.api_key': 'json key', 'llm.api_base': 'http://json',
+                                       'llm.model': 'json-model', 'llm.backup_model': 'json-backup'}))
+    # llm.api_base -> LLM_API_BASE
+    env.setenv('LLM_API_BASE', 'http://env')
+    env.setenv('LLM_MODEL', 'env-model')
+    env.setenv('LLM_REQUEST_TIMEOUT', '30')
+    source = ConfigSource(str(config_file), config={'llm.model': 'app-model'}, base_path=str(tmp_path))
+
+    config = LLMModuleConfig(source).compile()
+    # in memory config > env var > json file > default
+    assert config.model == 'app-model'
+    assert config.api_base == 'http://env'
+    assert config.request_timeout == 30.0
+    assert config.backup_model == 'json-backup'
+    assert config.api_key == 'json key'
+    assert config.api_version == '2023-07-01-preview'
+
+    assert [(s.source, s.value) for s in config.get_provenance('model').sources] == [
+        ('default', 'gpt-4'), ('json', 'json-model'), ('env', 'env-model'), ('app', 'app-model')]
+    assert [s.source for s in config.get_provenance('api_base').sources] == ['default', 'json', 'env']
+    assert [s.source for s in config.get_provenance('api_version').sources] == ['default']
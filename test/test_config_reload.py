@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from llm.api import AsyncLLMApi, LLMApi
+from llm.config import ConfigSource, LLMModuleConfig
+
+
+def _config(tmp_path, endpoint, model):
+    return LLMModuleConfig(ConfigSource(config={
+        'llm.api_key': 'k', 'llm.model': model, 'llm.response_cache_enabled': False, 'llm.coalesce_requests': False,
+        'llm.retry_base_delay': 0, 'llm.endpoints': [{'name': endpoint, 'api_base': f'http://{endpoint}'}],
+    }, base_path=str(tmp_path)))
+
+
+def _response(text):
+    message = SimpleNamespace(role='assistant', content=text)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+def test_request_in_flight_keeps_its_state(tmp_path):
+    api = LLMApi(_config(tmp_path, 'old', 'old-model'))
+    sent = []
+
+    def get_client(state, endpoint):
+        def create(**request):
+            sent.append((endpoint.name, request['model']))
+            if len(sent) == 1:
+                # the config changes while the first attempt is in flight
+                api.reload_config(_config(tmp_path, 'new', 'new-model'))
+                raise openai.APITimeoutError(httpx.Request('POST', 'http://old'))
+            return _response('answer')
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    api._get_client = get_client
+    api.chat_completion([{'role': 'user', 'content': 'hi'}])
+    api.chat_completion([{'role': 'user', 'content': 'hi'}])
+
+    assert sent == [('old', 'old-model'), ('old', 'old-model'), ('new', 'new-model')]
+    assert api.config.model == 'new-model'
+    assert [endpoint.name for endpoint in api.router.endpoints] == ['new']
+
+
+def test_api_classes_share_create_api(tmp_path):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text('{"llm.api_key": "k", "llm.response_cache_enabled": false}')
+    assert isinstance(LLMApi.create_api(str(config_file)), LLMApi)
+    assert isinstance(AsyncLLMApi.create_api(str(config_file)), AsyncLLMApi)
@@ -0,0 +1,109 @@
+import pytest
+
+from llm import token_counter
+from utils.ContextSlicer import ContextBuilder, strip_code_bodies
+from utils.DependencyGraph import CodeEntity, DependencyGraph
+
+MODEL = 'word-model'
+
+
+class _WordEncoding:
+    """
+    One token per word, so that sizes are easy to tell
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture
+def words(monkeypatch):
+    monkeypatch.setitem(token_counter._encodings, MODEL, _WordEncoding())
+    token_counter._count_text.cache_clear()
+    yield
+    token_counter._count_text.cache_clear()
+
+
+CODE = '''import os
+from typing import List
+
+LIMIT = 3
+
+
+def helper(x: int) -> int:
+    """Doubles x"""
+    return x * 2
+
+
+class Board:
+    """The board"""
+    size: int = 8
+
+    def __init__(self):
+        self.cells = []
+
+    async def load(self, path: str):
+        with open(path) as f:
+            return f.read()
+
+    class Cell:
+        pass
+
+
+print(helper(LIMIT))
+'''
+
+
+def test_strip_code_bodies_keeps_signatures_and_docstrings():
+    stripped = strip_code_bodies(CODE)
+    assert stripped == '''import os
+from typing import List
+LIMIT = 3
+
+def helper(x: int) -> int:
+    """Doubles x"""
+    ...
+
+class Board:
+    """The board"""
+    size: int = 8
+
+    def __init__(self):
+        ...
+
+    async def load(self, path: str):
+        ...
+
+    class Cell:
+        ...'''
+
+
+def test_strip_code_bodies_of_invalid_code():
+    assert strip_code_bodies('def broken(:\n') is None
+
+
+def test_build_context_cuts_at_budget(words):
+    base = CodeEntity('Base', code_desc=' '.join(['w'] * 20))
+    util = CodeEntity('Util', code_body='def util():\n    return 1\n')
+    app = CodeEntity('App')
+    graph = DependencyGraph([base, util, app])
+    graph.add_edge(base, util)
+    graph.add_edge(util, app)
+    builder = ContextBuilder(graph, model=MODEL)
+
+    assert builder.get_dependencies(app) == [(util, 1), (base, 2)]
+    # the util summary takes 3 words, the base one 23
+    assert builder.build_context(app, max_tokens=30) == 'def util():\n    ...\n\n# Base\n# ' + ' '.join(['w'] * 20)
+    assert builder.build_context(app, max_tokens=10) == 'def util():\n    ...'
+    assert builder.build_context(app, max_tokens=2) == ''
+
+
+def test_dependencies_follow_edge_changes():
+    a, b, c = CodeEntity('A'), CodeEntity('B'), CodeEntity('C')
+    graph = DependencyGraph([a, b, c])
+    graph.add_edge(a, b)
+    builder = ContextBuilder(graph, model=MODEL)
+    assert builder.get_dependencies(b) == [(a, 1)]
+
+    graph.add_edge(c, b)
+    assert builder.get_dependencies(b) == [(a, 1), (c, 1)]
@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+from utils.DependencyGraph import CodeEntity, CodeEntityType, DependencyGraph, Edge
+from utils.StreamingParser import StreamingDependencyParser
+
+
+def _write_sub_plan(tmp_path, steps, dependencies):
+    steps_file = tmp_path / 'steps.yaml'
+    steps_file.write_text('\n'.join(f'- "{step}"' for step in steps))
+    dependency_file = tmp_path / 'dependencies.json'
+    dependency_file.write_text(json.dumps(dependencies))
+    return str(steps_file), str(dependency_file)
+
+
+SUB_PLAN_STEPS = [
+    'Step 1: Create a class called Player. This class will be responsible for holding a player.',
+    'Step 2: Create a class called Board. This class will be responsible for the board state.',
+]
+
+
+def _assert_topological(graph, order):
+    position = {entity: i for i, entity in enumerate(order)}
+    assert len(position) == len(graph.get_code_entities())
+    for entity in graph.get_code_entities():
+        for edge in entity.out_edges or []:
+            assert position[edge.get_from_entity()] < position[edge.get_to_entity()]
+
+
+def test_extend_graph_with_sub_plan_under_parent(tmp_path):
+    steps_file, dependency_file = _write_sub_plan(tmp_path, SUB_PLAN_STEPS, {'Board': [{'used_class': 'Player'}]})
+    game = CodeEntity('Game', CodeEntityType.Package)
+    # a top level entity with the same short name must not be picked up
+    other_player = CodeEntity('Player', CodeEntityType.Class)
+    graph = DependencyGraph([game, other_player])
+    graph.top_sort_entities()
+
+    assert graph.extend_graph_from_files(steps_file, dependency_file, game) is graph
+
+    entities = graph.get_code_entities_dict()
+    board, player = entities['Game.Board'], entities['Game.Player']
+    assert [edge.get_from_entity() for edge in board.in_edges] == [player]
+    assert other_player.out_edges is None
+    assert game.sub_entities == [player, board]
+    _assert_topological(graph, graph.top_sort_entities())
+
+
+def test_build_graph_with_sub_plan_under_parent(tmp_path):
+    steps_file, dependency_file = _write_sub_plan(tmp_path, SUB_PLAN_STEPS, {'Board': [{'used_class': 'Player'}]})
+    game = CodeEntity('Game', CodeEntityType.Package)
+    graph = DependencyGraph.build_graph_from_files(steps_file, dependency_file, game, DependencyGraph([game]))
+    board = graph.get_code_entities_dict()['Game.Board']
+    assert [edge.get_from_entity().get_qualifier_name() for edge in board.in_edges] == ['Game.Player']
+
+
+def test_extend_graph_failure_leaves_graph_untouched(tmp_path):
+    steps_file, dependency_file = _write_sub_plan(tmp_path, SUB_PLAN_STEPS, {'Board': [{'used_class': 'Missing'}]})
+    game = CodeEntity('Game', CodeEntityType.Package)
+    graph = DependencyGraph([game])
+    order = graph.top_sort_entities()
+
+    with pytest.raises(AssertionError):
+        graph.extend_graph_from_files(steps_file, dependency_file, game)
+
+    assert graph.get_code_entities() == [game]
+    assert list(graph.get_code_entities_dict()) == ['Game']
+    assert game.sub_entities is None
+    assert graph.top_sort_entities() == order
+
+
+def test_add_edge_self_loop_invalidates_order():
+    a, b = CodeEntity('A'), CodeEntity('B')
+    graph = DependencyGraph([a, b])
+    graph.add_edge(a, b)
+    graph.top_sort_entities()
+
+    graph.add_edge(b, b)
+
+    assert [[entity.get_entity_name() for entity in cycle] for cycle in graph.get_cycles()] == [['B']]
+    assert graph.top_sort_entities() == [a, b]
+    assert not graph._is_order_current()
+
+
+def test_add_edge_keeps_order_incrementally():
+    entities = [CodeEntity(f'E{i}') for i in range(6)]
+    graph = DependencyGraph(list(entities))
+    graph.top_sort_entities()
+    for from_index, to_index in [(5, 4), (4, 3), (3, 0), (1, 5)]:
+        graph.add_edge(entities[from_index], entities[to_index])
+        assert graph._is_order_current()
+    _assert_topological(graph, graph.top_sort_entities())
+
+
+def test_direct_edge_changes_invalidate_order():
+    a, b = CodeEntity('A'), CodeEntity('B')
+    graph = DependencyGraph([a, b])
+    assert graph.top_sort_entities() == [a, b]
+
+    edge = Edge(b, a)
+    b.add_out_edge(edge)
+    a.add_in_edge(edge)
+
+    assert graph.top_sort_entities() == [b, a]
+
+
+def test_streamed_edges_invalidate_order():
+    game = CodeEntity('Game', CodeEntityType.Package)
+    player = CodeEntity('Player', CodeEntityType.Class, parent_code_entity=game)
+    board = CodeEntity('Board', CodeEntityType.Class, parent_code_entity=game)
+    graph = DependencyGraph([board, player])
+    assert graph.top_sort_entities() == [board, player]
+
+    parser = StreamingDependencyParser(graph.get_code_entities_dict(), game)
+    edges = list(parser.parse(['{"Board": [{"explanation": "places", ', '"used_class": "Player"}]}']))
+
+    assert [(edge.get_from_entity(), edge.get_to_entity()) for edge in edges] == [(player, board)]
+    assert graph.top_sort_entities() == [player, board]
+
+
+def test_other_graphs_do_not_invalidate_order():
+    a, b = CodeEntity('A'), CodeEntity('B')
+    graph = DependencyGraph([a, b])
+    graph.add_edge(a, b)
+    graph.top_sort_entities()
+
+    x, y = CodeEntity('X'), CodeEntity('Y')
+    other = DependencyGraph([x, y])
+    other.add_edge(x, y)
+    other.compact()
+    Edge.create_edge_from_dict('Y', {'used_class': 'X'}, other.get_code_entities_dict())
+
+    assert graph._is_order_current()
+
+
+def test_shared_entity_invalidates_every_graph_holding_it():
+    a, b = CodeEntity('A'), CodeEntity('B')
+    first, second = DependencyGraph([a, b]), DependencyGraph([a, b])
+    first.top_sort_entities()
+    second.top_sort_entities()
+    version = second.get_edge_version()
+
+    first.add_edge(b, a)
+
+    assert first._is_order_current()
+    assert not second._is_order_current()
+    assert second.get_edge_version() != version
+    assert second.top_sort_entities() == [b, a]
+
+
+def test_cyclic_order_is_cached_and_logged_once(caplog):
+    a, b, c = CodeEntity('A'), CodeEntity('B'), CodeEntity('C')
+    graph = DependencyGraph([a, b, c])
+    graph.add_edge(a, b)
+    graph.add_edge(b, a)
+    graph.add_edge(b, c)
+
+    with caplog.at_level('WARNING', logger='utils.DependencyGraph'):
+        order = graph.top_sort_entities()
+        assert graph.top_sort_entities() == order
+        assert graph.top_sort_entities() is not graph.top_sort_entities()
+    assert order[2] is c
+    assert len([r for r in caplog.records if 'dependency cycles' in r.getMessage()]) == 1
+
+    d = CodeEntity('D')
+    graph.append_entity(d)
+    graph.add_edge(d, a)
+    with caplog.at_level('WARNING', logger='utils.DependencyGraph'):
+        assert graph.top_sort_entities()[0] is d
+        graph.top_sort_entities()
+    assert len([r for r in caplog.records if 'dependency cycles' in r.getMessage()]) == 2
+
+    # appending an entity without edges does not change the edge version but still changes the order
+    e = CodeEntity('E')
+    graph.append_entity(e)
+    assert e in graph.top_sort_entities()
@@ -0,0 +1,69 @@
+import io
+import subprocess
+
+from utils import GraphDot
+from utils.DependencyGraph import CodeEntity, CodeEntityType, DependencyGraph
+from utils.GraphDot import render_dot, write_dot
+
+
+def _dot(graph, entities=None, **kwargs):
+    out = io.StringIO()
+    write_dot(graph, out, entities, **kwargs)
+    return out.getvalue()
+
+
+def test_write_dot_draws_nodes_edges_and_clusters():
+    board = CodeEntity('Board', CodeEntityType.Class, code_definition='class Board:\n    pass')
+    cell = CodeEntity('cell "x"', CodeEntityType.Function, parent_code_entity=board)
+    board.add_sub_entity(cell)
+    player = CodeEntity('Player')
+    graph = DependencyGraph([board, cell, player])
+    graph.add_edge(player, board, 'uses')
+
+    dot = _dot(graph, name='game')
+    assert dot.startswith('digraph "game" {\n')
+    assert dot.endswith('}\n')
+    assert 'n0 [label="Class Board\\nclass Board:"];' in dot
+    assert 'n1 [label="Function cell \\"x\\""];' in dot
+    assert 'subgraph cluster_0 {' in dot and 'label="Board";' in dot
+    assert 'n2 -> n0 [tooltip="uses"];' in dot
+
+    assert 'subgraph' not in _dot(graph, cluster=False)
+
+
+def test_write_dot_leaves_out_entities_outside_the_graph():
+    outside, a, b = CodeEntity('Outside'), CodeEntity('A'), CodeEntity('B')
+    DependencyGraph([outside, a]).add_edge(outside, a)
+    graph = DependencyGraph([a, b])
+    graph.add_edge(a, b)
+
+    neighborhood = graph.get_neighborhood('A')
+    assert outside in neighborhood
+
+    dot = _dot(graph, neighborhood)
+    assert 'Outside' not in dot
+    assert 'n0 -> n1;' in dot
+
+
+def test_render_dot_waits_for_dot(tmp_path, monkeypatch):
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        return subprocess.CompletedProcess(args, 0, stderr=b'')
+
+    monkeypatch.setattr(GraphDot.subprocess, 'run', run)
+    assert render_dot('g.dot', 'g.svg', 'svg') == 'g.svg'
+    assert calls == [['dot', '-Tsvg', '-o', 'g.svg', 'g.dot']]
+
+    monkeypatch.setattr(GraphDot.subprocess, 'run',
+                        lambda args, **kwargs: subprocess.CompletedProcess(args, 1, stderr=b'syntax error'))
+    assert render_dot('g.dot', 'g.svg', 'svg') is None
+
+
+def test_render_dot_without_graphviz(monkeypatch):
+    def run(args, **kwargs):
+        raise FileNotFoundError(args[0])
+
+    monkeypatch.setattr(GraphDot.subprocess, 'run', run)
+    assert render_dot('g.dot', 'g.png') is None
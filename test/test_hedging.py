@@ -0,0 +1,118 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from llm.api import LLMApi
+from llm.config import ConfigSource, LLMModuleConfig
+
+
+def _api(tmp_path, **kwargs):
+    config = {'llm.api_key': 'k', 'llm.response_cache_enabled': False, 'llm.hedge_min_samples': 1}
+    config.update({'llm.' + key: value for key, value in kwargs.items()})
+    return LLMApi(LLMModuleConfig(ConfigSource(config=config, base_path=str(tmp_path))))
+
+
+def _client(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def _rate_limited(retry_after='5'):
+    request = httpx.Request('POST', 'http://endpoint')
+    response = httpx.Response(429, headers={'retry-after': retry_after}, request=request)
+    return openai.RateLimitError('rate limited', response=response, body=None)
+
+
+REQUEST = {'model': 'gpt', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def test_fast_hedge_answers_before_slow_primary(tmp_path):
+    api = _api(tmp_path)
+    api.hedging_policy.record('gpt', 0.01)
+    threads = []
+
+    def create(**request):
+        threads.append(threading.current_thread())
+        if len(threads) == 1:
+            time.sleep(2)
+            return 'slow answer'
+        return 'fast answer'
+
+    api._get_client = lambda state, endpoint: _client(create)
+    attempted = []
+    start = time.monotonic()
+    assert api._create_timed_completion(api.state, REQUEST, None, True, attempted) == ('fast answer', REQUEST)
+
+    assert time.monotonic() - start < 0.5
+    assert len(attempted) == 2
+    assert threads[0] is not threading.current_thread()
+    assert threads[1].name.startswith('llm-hedge')
+
+
+def test_slow_primary_latency_is_recorded_once_it_answers(tmp_path):
+    api = _api(tmp_path)
+    window = api.hedging_policy._get_window('gpt')
+    window.record(0.01)
+    answered = threading.Event()
+
+    def create(**request):
+        if not answered.is_set():
+            answered.set()
+            time.sleep(0.3)
+        return 'answer'
+
+    api._get_client = lambda state, endpoint: _client(create)
+    api._create_timed_completion(api.state, REQUEST, None, True)
+    deadline = time.monotonic() + 2
+    while len(window) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(window) == 2
+    assert window.percentile(100) >= 0.3
+
+
+def test_hedge_answer_stops_primary_backoff(tmp_path):
+    api = _api(tmp_path)
+    api.hedging_policy.record('gpt', 0.01)
+
+    def create(**request):
+        if threading.current_thread().name == 'llm-primary':
+            raise _rate_limited()
+        time.sleep(0.05)
+        return 'hedged answer'
+
+    api._get_client = lambda state, endpoint: _client(create)
+    attempted = []
+    start = time.monotonic()
+    assert api._create_timed_completion(api.state, REQUEST, None, True, attempted) == ('hedged answer', REQUEST)
+
+    assert time.monotonic() - start < 2
+    assert len(attempted) == 2
+    # the primary never answered, its latency is unknown
+    assert len(api.hedging_policy._get_window('gpt')) == 1
+
+
+def test_only_first_attempt_latencies_are_recorded(tmp_path):
+    api = _api(tmp_path)
+    window = api.hedging_policy._get_window('gpt')
+    calls = []
+
+    def create(**request):
+        calls.append(request['model'])
+        if len(calls) == 1:
+            raise _rate_limited('0')
+        return 'answer'
+
+    api._get_client = lambda state, endpoint: _client(create)
+    api._create_timed_completion(api.state, REQUEST, None, False)
+    assert len(window) == 0
+
+    api._create_timed_completion(api.state, REQUEST, None, False)
+    assert len(window) == 1
+
+    backup_request = dict(REQUEST, model='backup')
+    calls.clear()
+    api.retry_policy.max_retries = 0
+    assert api._create_timed_completion(api.state, REQUEST, backup_request, False) == ('answer', backup_request)
+    assert len(window) == 1
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['torch', 'openai', 'httpx', 'langchain', 'graphviz']
+# cumulative import time in seconds, generous enough for a slow CI machine
+IMPORT_BUDGET = 1.0
+
+
+def _import(module):
+    """
+    Import module in a fresh interpreter
+    :return cumulative seconds -X importtime reports for module, heavy modules which got imported along
+    """
+    code = f'import sys, {module}; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=PROJECT_DIR, capture_output=True,
+                            text=True, check=True)
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative = int(fields[1]) / 1e6
+    assert cumulative is not None, f"no importtime entry for {module}:\n{result.stderr}"
+    return cumulative, [m for m in result.stdout.strip().split(',') if m]
+
+
+@pytest.mark.parametrize('module', ['llm.api', 'utils'])
+def test_import_is_cheap(module):
+    cumulative, heavy = _import(module)
+    assert heavy == []
+    assert cumulative < IMPORT_BUDGET, f"importing {module} took {cumulative:.3f}s"
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+from llm.api import LLMApi
+from llm.config import ConfigSource, LLMModuleConfig
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+def test_stream_records_time_to_first_token(tmp_path):
+    config = LLMModuleConfig(ConfigSource(config={'llm.api_key': 'k', 'llm.model': 'gpt',
+                                                  'llm.response_cache_enabled': False},
+                                          base_path=str(tmp_path)))
+    api = LLMApi(config)
+
+    def create(**request):
+        return iter([SimpleNamespace(choices=[]), _chunk(None), _chunk('hel'), _chunk('lo')])
+
+    api._get_client = lambda state, endpoint: SimpleNamespace(chat=SimpleNamespace(
+        completions=SimpleNamespace(create=create)))
+
+    assert ''.join(api.chat_completion_stream([{'role': 'user', 'content': 'hi'}])) == 'hello'
+    endpoint = api.config.endpoints[0].name
+    histogram = api.metrics.get_histogram('llm_time_to_first_token_seconds', model='gpt', endpoint=endpoint,
+                                          template=None)
+    assert histogram is not None and histogram.count == 1
+    assert api.metrics.get_counter('llm_requests_total', model='gpt', endpoint=endpoint, template=None) == 1
+    api.close()
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+from llm.api import LLMApi
+from llm.config import ConfigSource, LLMModuleConfig
+from llm.response_cache import is_deterministic
+
+
+def _response(text):
+    message = SimpleNamespace(role='assistant', content=text)
+    usage = SimpleNamespace(prompt_tokens=5, completion_tokens=3, total_tokens=8)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def test_is_deterministic():
+    assert is_deterministic({'temperature': 0, 'top_p': 1})
+    assert is_deterministic({'temperature': 0.7, 'top_p': 0})
+    assert not is_deterministic({'temperature': 0.7, 'top_p': 1})
+
+
+def test_sampled_requests_skip_the_cache(tmp_path):
+    config = LLMModuleConfig(ConfigSource(config={'llm.api_key': 'k', 'llm.coalesce_requests': False,
+                                                  'llm.response_cache_enabled': True},
+                                          base_path=str(tmp_path)))
+    api = LLMApi(config)
+    calls = []
+
+    def create(**request):
+        calls.append(request)
+        return _response(f'answer {len(calls)}')
+
+    completions = SimpleNamespace(create=create)
+    api._get_client = lambda state, endpoint: SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    messages = [{'role': 'user', 'content': 'hi'}]
+
+    assert api.chat_completion(messages)['content'] == 'answer 1'
+    assert api.chat_completion(messages)['content'] == 'answer 1'
+    assert api.chat_completion(messages, temperature=0.7, top_p=1)['content'] == 'answer 2'
+    assert api.chat_completion(messages, temperature=0.7, top_p=1)['content'] == 'answer 3'
+    assert len(calls) == 3
+
+
+def test_response_cache_is_opt_in(tmp_path):
+    api = LLMApi(LLMModuleConfig(ConfigSource(config={'llm.api_key': 'k'}, base_path=str(tmp_path))))
+    api._get_client = lambda state, endpoint: SimpleNamespace(chat=SimpleNamespace(
+        completions=SimpleNamespace(create=lambda **request: _response('answer'))))
+
+    assert api.chat_completion([{'role': 'user', 'content': 'hi'}])['content'] == 'answer'
+    assert api.response_cache is None
+    assert not (tmp_path / 'cache').exists()
+    api.close()
@@ -0,0 +1,93 @@
+import email.utils
+import time
+
+import httpx
+import openai
+import pytest
+
+from llm.retry import RetryBudget, RetryPolicy
+
+
+def _status_error(status_code, headers=None):
+    request = httpx.Request('POST', 'http://endpoint')
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    error_class = openai.RateLimitError if status_code == 429 else openai.APIStatusError
+    return error_class('failed', response=response, body=None)
+
+
+def test_retry_after_seconds():
+    assert RetryPolicy.get_retry_after(_status_error(429, {'retry-after': '7'})) == 7
+
+
+def test_retry_after_milliseconds_win():
+    assert RetryPolicy.get_retry_after(_status_error(429, {'retry-after-ms': '1500', 'retry-after': '7'})) == 1.5
+
+
+def test_retry_after_http_date():
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < RetryPolicy.get_retry_after(_status_error(503, {'retry-after': date})) <= 30
+
+
+def test_retry_after_missing_or_invalid():
+    assert RetryPolicy.get_retry_after(_status_error(429)) is None
+    assert RetryPolicy.get_retry_after(_status_error(429, {'retry-after': 'soon'})) is None
+
+
+def test_retry_after_caps_delay():
+    policy = RetryPolicy(base_delay=0, max_delay=10)
+    assert policy.get_delay(0, _status_error(429, {'retry-after': '3600'})) == 10
+
+
+@pytest.mark.parametrize('status_code', [400, 401, 403, 404, 422])
+def test_client_errors_are_not_retried(status_code):
+    error = _status_error(status_code)
+    assert not RetryPolicy.is_retryable(error)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise error
+
+    with pytest.raises(openai.APIStatusError):
+        RetryPolicy(max_retries=3, base_delay=0).call(fail)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('status_code', [408, 409, 429, 500, 503])
+def test_transient_errors_are_retried(status_code):
+    assert RetryPolicy.is_retryable(_status_error(status_code))
+    calls = []
+
+    def fail_once():
+        calls.append(1)
+        if len(calls) == 1:
+            raise _status_error(status_code)
+        return 'answer'
+
+    assert RetryPolicy(max_retries=3, base_delay=0).call(fail_once) == 'answer'
+    assert len(calls) == 2
+
+
+def test_retry_budget_runs_out():
+    budget = RetryBudget(ratio=0, min_tokens=2)
+    policy = RetryPolicy(max_retries=10, base_delay=0, budget=budget)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise _status_error(503)
+
+    with pytest.raises(openai.APIStatusError):
+        policy.call(fail)
+    # the first attempt plus the two retries the budget holds
+    assert len(calls) == 3
+    assert not budget.try_acquire_retry()
+
+
+def test_retry_budget_refills_with_requests():
+    budget = RetryBudget(ratio=0.5, min_tokens=1)
+    assert budget.try_acquire_retry()
+    assert not budget.try_acquire_retry()
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_acquire_retry()
@@ -0,0 +1,105 @@
+import time
+
+from llm.config import EndpointConfig
+from llm.router import EndpointRouter
+
+
+def _router():
+    endpoints = [EndpointConfig(name=name, api_type='openai', api_base=f'http://{name}', api_key='k',
+                                api_version='') for name in ['a', 'b']]
+    return EndpointRouter(endpoints, eject_failures=2, eject_seconds=10.0, max_eject_seconds=30.0)
+
+
+def _end_ejection(router, name):
+    router.stats[name].ejected_until = time.time() - 1
+
+
+def test_endpoint_is_ejected_after_consecutive_failures():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    assert not router.stats['a'].is_ejected(time.time())
+
+    router.report(a, 0.1, False)
+    assert router.stats['a'].is_ejected(time.time())
+    assert router.stats['a'].eject_seconds == 10.0
+    assert all(router.select().name == 'b' for _ in range(20))
+
+
+def test_in_flight_failures_do_not_extend_ejection():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+    ejected_until = router.stats['a'].ejected_until
+
+    for _ in range(5):
+        router.report(a, 0.1, False)
+    assert router.stats['a'].eject_seconds == 10.0
+    assert router.stats['a'].ejected_until == ejected_until
+
+    # sent before the probe, so it does not count as the probe failing
+    _end_ejection(router, 'a')
+    assert router.select().name == 'a'
+    router.report(a, 5.0, False)
+    assert router.stats['a'].probing
+    assert router.stats['a'].eject_seconds == 10.0
+
+
+def test_only_one_probe_after_ejection():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+    _end_ejection(router, 'a')
+
+    assert router.select().name == 'a'
+    assert all(router.select().name == 'b' for _ in range(20))
+
+
+def test_failed_probe_doubles_ejection_up_to_max():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+
+    for expected in [20.0, 30.0, 30.0]:
+        _end_ejection(router, 'a')
+        assert router.select().name == 'a'
+        router.report(a, 0.0, False)
+        assert router.stats['a'].eject_seconds == expected
+        assert router.stats['a'].is_ejected(time.time())
+        assert not router.stats['a'].probing
+
+
+def test_successful_probe_recovers_endpoint():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+    _end_ejection(router, 'a')
+    assert router.select().name == 'a'
+
+    router.report(a, 0.0, True)
+    stats = router.stats['a']
+    assert not stats.probing
+    assert stats.ejected_until == 0.0
+    assert stats.eject_seconds == 0.0
+    assert stats.consecutive_failures == 0
+
+    # a later failure streak starts again from the base ejection
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+    assert stats.eject_seconds == 10.0
+
+
+def test_released_probe_lets_another_probe_through():
+    router = _router()
+    a = router.endpoints[0]
+    router.report(a, 0.1, False)
+    router.report(a, 0.1, False)
+    _end_ejection(router, 'a')
+    assert router.select().name == 'a'
+
+    router.release(a)
+    assert router.select().name == 'a'
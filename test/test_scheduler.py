@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from utils.DependencyGraph import CodeEntity, DependencyGraph
+from utils.Scheduler import DependencyScheduler
+
+
+def _graph(names, edges):
+    entities = {name: CodeEntity(name) for name in names}
+    graph = DependencyGraph(list(entities.values()))
+    for dependency, dependent in edges:
+        graph.add_edge(entities[dependency], entities[dependent])
+    return graph
+
+
+def _recording_worker():
+    order = []
+    lock = threading.Lock()
+
+    def worker(entity):
+        with lock:
+            order.append(entity.get_entity_name())
+        return entity.get_entity_name().lower()
+
+    return worker, order
+
+
+def test_critical_path_goes_first():
+    # D is ready first in the entity list but A heads the longer chain
+    graph = _graph(['D', 'A', 'B', 'C'], [('A', 'B'), ('B', 'C')])
+    worker, order = _recording_worker()
+    scheduler = DependencyScheduler(graph, worker, max_workers=1)
+
+    assert [entity.get_entity_name() for entity in scheduler.get_critical_path()] == ['A', 'B', 'C']
+    assert scheduler.run() == {'D': 'd', 'A': 'a', 'B': 'b', 'C': 'c'}
+    assert order == ['A', 'B', 'C', 'D']
+
+
+def test_cost_weights_critical_path():
+    graph = _graph(['A', 'B', 'D'], [('A', 'B')])
+    worker, order = _recording_worker()
+    costs = {'A': 1.0, 'B': 1.0, 'D': 5.0}
+    scheduler = DependencyScheduler(graph, worker, max_workers=1, cost=lambda e: costs[e.get_entity_name()])
+
+    scheduler.run()
+    assert order == ['D', 'A', 'B']
+
+
+def test_cycle_is_scheduled_as_one_unit():
+    graph = _graph(['A', 'B', 'C'], [('A', 'B'), ('B', 'A'), ('B', 'C')])
+    cycles = []
+    worker, order = _recording_worker()
+
+    def cycle_worker(entities):
+        cycles.append(sorted(entity.get_entity_name() for entity in entities))
+        return 'cycle'
+
+    scheduler = DependencyScheduler(graph, worker, cycle_worker=cycle_worker)
+    assert [sorted(e.get_entity_name() for e in cycle) for cycle in scheduler.cycles] == [['A', 'B']]
+    levels = scheduler.get_ready_sets()
+    assert [sorted(entity.get_entity_name() for entity in level) for level in levels] == [['A', 'B'], ['C']]
+
+    assert scheduler.run() == {'A': 'cycle', 'B': 'cycle', 'C': 'c'}
+    assert cycles == [['A', 'B']]
+    assert order == ['C']
+
+
+def test_failure_without_fail_fast_skips_dependents():
+    graph = _graph(['A', 'B', 'C', 'D'], [('A', 'B'), ('B', 'C')])
+
+    def worker(entity):
+        if entity.get_entity_name() == 'A':
+            raise ValueError('broken')
+        return entity.get_entity_name()
+
+    scheduler = DependencyScheduler(graph, worker)
+    assert scheduler.run(fail_fast=False) == {'D': 'D'}
+    assert list(scheduler.errors) == ['A']
+    assert sorted(scheduler.skipped) == ['B', 'C']
+
+    with pytest.raises(ValueError, match='broken'):
+        DependencyScheduler(graph, worker).run()
+
+
+def test_runs_on_compact_graph():
+    compact = _graph(['D', 'A', 'B', 'C'], [('A', 'B'), ('B', 'C'), ('A', 'C')]).compact()
+    worker, order = _recording_worker()
+
+    assert DependencyScheduler(compact, worker, max_workers=1).run() == {'D': 'd', 'A': 'a', 'B': 'b', 'C': 'c'}
+    assert order == ['A', 'B', 'C', 'D']
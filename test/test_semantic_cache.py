@@ -0,0 +1,53 @@
+import zlib
+
+import numpy as np
+
+from llm.semantic_cache import SemanticCache, split_request
+
+TEMPLATE = ('You are a senior software architect. Break the project described below into classes and functions, '
+            'list every step of the plan on its own line, name the classes each step uses and keep the plan short. '
+            'Project: {description}')
+
+
+def _embed(texts):
+    """
+    Bag of words, texts sharing most of their words are close
+    """
+    vectors = np.zeros((len(texts), 256), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            vectors[row, zlib.crc32(word.encode()) % 256] += 1
+    return vectors
+
+
+def _request(description):
+    content = TEMPLATE.format(description=description)
+    return {'model': 'gpt', 'temperature': 0, 'messages': [{'role': 'user', 'content': content}]}
+
+
+def _similarity(a, b):
+    a, b = _embed([a, b])
+    return float(a @ b / np.linalg.norm(a) / np.linalg.norm(b))
+
+
+def test_template_text_does_not_make_descriptions_match(tmp_path):
+    first, second = {'description': 'a snake game'}, {'description': 'a tetris clone'}
+    _, first_prompt = split_request(_request(first['description']))
+    # the rendered prompts look alike because of the template they share
+    assert _similarity(first_prompt, split_request(_request(second['description']))[1]) > 0.8
+
+    cache = SemanticCache(str(tmp_path / 'semantic.sqlite'), _embed, threshold=0.8)
+    namespace, text = split_request(_request(first['description']), 'plan', first)
+    assert text == 'description: a snake game'
+    cache.put(namespace, text, cache.embed_one(text), {'role': 'assistant', 'content': 'snake plan'})
+
+    namespace, text = split_request(_request(second['description']), 'plan', second)
+    assert cache.get(namespace, cache.embed_one(text)) is None
+    namespace, text = split_request(_request(first['description']), 'plan', first)
+    assert cache.get(namespace, cache.embed_one(text)) == {'role': 'assistant', 'content': 'snake plan'}
+    cache.close()
+
+
+def test_template_vars_need_a_template_key():
+    request = _request('a snake game')
+    assert split_request(request, None, {'description': 'a snake game'})[1] == request['messages'][0]['content']
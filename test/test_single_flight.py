@@ -0,0 +1,59 @@
+import threading
+
+from llm.single_flight import SingleFlight
+
+
+def _source(opened, chunks=('a', 'b', 'c')):
+    def open_stream():
+        opened.append(1)
+        return iter(chunks)
+    return open_stream
+
+
+def test_abandoned_stream_is_not_joined():
+    flight = SingleFlight()
+    opened = []
+    first = flight.stream('key', _source(opened))
+    assert next(first) == 'a'
+    first.close()
+
+    assert list(flight.stream('key', _source(opened))) == ['a', 'b', 'c']
+    assert len(opened) == 2
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_stream_finished_with_error_is_not_joined():
+    flight = SingleFlight()
+    opened = []
+    first = flight.stream('key', _source(opened))
+    shared = flight._streams['key']
+    shared.fail(Exception('boom'))
+
+    assert list(flight.stream('key', _source(opened))) == ['a', 'b', 'c']
+    assert len(opened) == 2
+    first.close()
+
+
+def test_readers_never_see_abandoned_error_under_contention():
+    flight = SingleFlight()
+    errors = []
+
+    def reader(abandon: bool):
+        for _ in range(200):
+            stream = flight.stream('key', lambda: iter(range(5)))
+            try:
+                if abandon:
+                    next(stream, None)
+                    stream.close()
+                else:
+                    assert list(stream) == list(range(5))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader, args=(i % 2 == 0,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert flight.stats()['in_flight'] == 0
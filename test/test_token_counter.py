@@ -0,0 +1,91 @@
+import pytest
+
+from llm import token_counter
+from llm.api import _fit_to_context
+from llm.config import ConfigSource, LLMModuleConfig
+from llm.token_counter import TokenCounter, get_context_window
+
+MODEL = 'word-model'
+
+
+class _WordEncoding:
+    """
+    One token per word, so that sizes are easy to tell
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture
+def words(monkeypatch):
+    monkeypatch.setitem(token_counter._encodings, MODEL, _WordEncoding())
+    token_counter._count_text.cache_clear()
+    token_counter._count_message.cache_clear()
+    yield
+    token_counter._count_text.cache_clear()
+    token_counter._count_message.cache_clear()
+
+
+def _message(role, words):
+    return {'role': role, 'content': ' '.join(['w'] * words)}
+
+
+def test_fit_clamps_max_tokens(words):
+    counter = TokenCounter(MODEL, 100)
+    messages = [_message('user', 40)]
+    # 3 per message, 1 for the role, 3 for the reply
+    assert counter.fit(messages, 80, 10) == (messages, 100 - 47)
+
+
+def test_fit_rejects_oversize_prompt(words):
+    with pytest.raises(Exception, match='context window of 100 tokens'):
+        TokenCounter(MODEL, 100).fit([_message('user', 95)], 80, 10)
+
+
+def test_fit_trims_oldest_messages(words):
+    system, old, recent, last = _message('system', 5), _message('user', 50), _message('assistant', 20), \
+        _message('user', 10)
+    messages, max_tokens = TokenCounter(MODEL, 100).fit([system, old, recent, last], 80, 10, 'trim')
+    assert messages == [system, recent, last]
+    assert max_tokens == 100 - 50
+
+
+def test_fit_leaves_unknown_models_alone(words):
+    counter = TokenCounter(MODEL)
+    assert counter.context_window is None
+    messages = [_message('user', 100000)]
+    assert counter.fit(messages, 2048, 256) == (messages, 2048)
+
+
+def test_fit_never_rejects_on_estimates(monkeypatch):
+    monkeypatch.setitem(token_counter._encodings, 'estimated-model', None)
+    counter = TokenCounter('estimated-model', 100)
+    assert not counter.is_exact()
+    messages = [_message('user', 1000)]
+    assert counter.fit(messages, 80, 10) == (messages, 80)
+
+
+def test_context_windows_match_exact_names_only():
+    assert get_context_window('gpt-4') == 8192
+    assert get_context_window('gpt-4.1') is None
+    assert get_context_window('my-azure-deployment') is None
+
+
+def _config(tmp_path, **kwargs):
+    config = {'llm.api_key': 'k', 'llm.model': MODEL}
+    config.update({'llm.' + key: value for key, value in kwargs.items()})
+    return LLMModuleConfig(ConfigSource(config=config, base_path=str(tmp_path)))
+
+
+def test_fit_to_context_is_off_by_default(tmp_path, words):
+    request = {'model': MODEL, 'messages': [_message('user', 1000)], 'max_tokens': 2048}
+    assert _fit_to_context(_config(tmp_path, context_window=100), dict(request)) == request
+
+
+def test_fit_to_context_enforces_configured_window(tmp_path, words):
+    config = _config(tmp_path, token_budget_enabled=True, context_window=100, min_completion_tokens=10)
+    request = _fit_to_context(config, {'model': MODEL, 'messages': [_message('user', 40)], 'max_tokens': 2048})
+    assert request['max_tokens'] == 100 - 47
+    with pytest.raises(Exception, match='prompt has'):
+        _fit_to_context(config, {'model': MODEL, 'messages': [_message('user', 1000)], 'max_tokens': 2048})
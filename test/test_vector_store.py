@@ -0,0 +1,42 @@
+import multiprocessing
+
+import numpy as np
+
+from llm.embedding import VectorStore
+
+
+def _vectors(writer, start, count, dim=4):
+    return np.array([[writer, start + i, 0, 0] for i in range(count)], dtype=np.float32)[:, :dim]
+
+
+def _write(store_dir, writer, batches, batch_size):
+    store = VectorStore(store_dir)
+    for batch in range(batches):
+        start = batch * batch_size
+        hashes = [f'{writer}-{start + i}' for i in range(batch_size)]
+        store.put_many('model', hashes, _vectors(writer, start, batch_size))
+    store.close()
+
+
+def test_processes_never_share_rows(tmp_path):
+    store_dir = str(tmp_path)
+    # map the matrix before the other processes grow it
+    reader = VectorStore(store_dir)
+    reader.put_many('model', ['first'], _vectors(9, 0, 1))
+    assert reader.get_many('model', ['first'])['first'].tolist() == [9, 0, 0, 0]
+
+    context = multiprocessing.get_context('spawn')
+    writers = [context.Process(target=_write, args=(store_dir, writer, 30, 50)) for writer in range(3)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+        assert process.exitcode == 0
+
+    hashes = [f'{writer}-{i}' for writer in range(3) for i in range(30 * 50)]
+    found = reader.get_many('model', hashes)
+    assert len(found) == len(hashes)
+    for writer in range(3):
+        for i in range(30 * 50):
+            assert found[f'{writer}-{i}'].tolist() == [writer, i, 0, 0]
+    reader.close()
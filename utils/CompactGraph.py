@@ -0,0 +1,584 @@
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.DependencyGraph import CodeEntity, CodeEntityType, DependencyGraph, Edge
+
+_NONE = -1
+_ENTITY_TYPES: Dict[int, CodeEntityType] = {entity_type.value: entity_type for entity_type in CodeEntityType}
+
+
+class StringTable:
+    """
+    Interned strings addressed by integer id, every distinct string is stored once
+    """
+    __slots__ = ('strings', '_ids')
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def intern(self, s: Optional[str]) -> int:
+        """
+        :return id of s, -1 for None
+        """
+        if s is None:
+            return _NONE
+        string_id = self._ids.get(s)
+        if string_id is None:
+            string_id = self._ids[s] = len(self.strings)
+            self.strings.append(s)
+        return string_id
+
+    def get(self, string_id: int) -> Optional[str]:
+        return None if string_id == _NONE else self.strings[string_id]
+
+    def find(self, s: str) -> int:
+        """
+        :return id of s without adding it, -1 if it is not in the table
+        """
+        return self._ids.get(s, _NONE)
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class _MappedStringTable(StringTable):
+    """
+    StringTable whose first strings are utf-8 slices of a memory mapped snapshot, decoded on access.
+    Strings interned after loading are kept in memory and not deduplicated against the mapped ones
+    """
+    __slots__ = ('_offsets', '_data', '_mapped')
+
+    def __init__(self, offsets, data):
+        super().__init__()
+        self._offsets = offsets
+        self._data = data
+        self._mapped = len(offsets) - 1
+
+    def intern(self, s: Optional[str]) -> int:
+        string_id = super().intern(s)
+        return string_id if string_id == _NONE else self._mapped + string_id
+
+    def get(self, string_id: int) -> Optional[str]:
+        if string_id == _NONE:
+            return None
+        if string_id < self._mapped:
+            return str(self._data[self._offsets[string_id]:self._offsets[string_id + 1]], 'utf-8')
+        return self.strings[string_id - self._mapped]
+
+    def find(self, s: str) -> int:
+        string_id = super().find(s)
+        return string_id if string_id == _NONE else self._mapped + string_id
+
+    def __len__(self):
+        return self._mapped + len(self.strings)
+
+
+class CompactEdge:
+    """
+    Read only view of an edge of a CompactGraph, with the Edge getters
+    """
+    __slots__ = ('graph', 'edge_id')
+
+    def __init__(self, graph, edge_id: int):
+        self.graph: CompactGraph = graph
+        self.edge_id = edge_id
+
+    @property
+    def from_entity(self):
+        return self.graph.get_entity(self.graph.edge_sources[self.edge_id])
+
+    @property
+    def to_entity(self):
+        return self.graph.get_entity(self.graph.edge_targets[self.edge_id])
+
+    @property
+    def desc(self) -> Optional[str]:
+        return self.graph.strings.get(self.graph.edge_descs[self.edge_id])
+
+    def get_from_entity(self):
+        return self.from_entity
+
+    def get_to_entity(self):
+        return self.to_entity
+
+    def get_desc(self):
+        return self.desc
+
+    def __eq__(self, other):
+        return isinstance(other, CompactEdge) and other.graph is self.graph and other.edge_id == self.edge_id
+
+    def __hash__(self):
+        return hash((id(self.graph), self.edge_id))
+
+
+class CompactCodeEntity:
+    """
+    View of an entity of a CompactGraph with the CodeEntity getters. Views are created on access and hold nothing
+    but the graph and the entity id, two views of the same entity compare equal.
+    The code can still be filled in through set_code_body and set_code_definition, the structure is fixed: convert
+    the graph with CompactGraph.to_dependency_graph to add entities or edges.
+    """
+    __slots__ = ('graph', 'entity_id')
+
+    def __init__(self, graph, entity_id: int):
+        self.graph: CompactGraph = graph
+        self.entity_id = entity_id
+
+    @property
+    def entity_name(self) -> str:
+        return self.graph.strings.get(self.graph.names[self.entity_id])
+
+    @property
+    def qualifier_name(self) -> str:
+        return self.graph.strings.get(self.graph.qualifier_names[self.entity_id])
+
+    @property
+    def entity_type(self) -> Optional[CodeEntityType]:
+        return _ENTITY_TYPES.get(self.graph.entity_types[self.entity_id])
+
+    @property
+    def code_definition(self) -> Optional[str]:
+        return self.graph.strings.get(self.graph.code_definitions[self.entity_id])
+
+    @property
+    def code_desc(self) -> Optional[str]:
+        return self.graph.strings.get(self.graph.code_descs[self.entity_id])
+
+    @property
+    def code_body(self) -> Optional[str]:
+        return self.graph.strings.get(self.graph.code_bodies[self.entity_id])
+
+    @property
+    def in_edges(self) -> Optional[List[CompactEdge]]:
+        start, end = self.graph.in_offsets[self.entity_id], self.graph.in_offsets[self.entity_id + 1]
+        return [CompactEdge(self.graph, edge_id) for edge_id in self.graph.in_edge_ids[start:end]] or None
+
+    @property
+    def out_edges(self) -> Optional[List[CompactEdge]]:
+        start, end = self.graph.out_offsets[self.entity_id], self.graph.out_offsets[self.entity_id + 1]
+        return [CompactEdge(self.graph, edge_id) for edge_id in range(start, end)] or None
+
+    @property
+    def sub_entities(self) -> Optional[List]:
+        start, end = self.graph.child_offsets[self.entity_id], self.graph.child_offsets[self.entity_id + 1]
+        return [self.graph.get_entity(child) for child in self.graph.child_ids[start:end]] or None
+
+    @property
+    def parent_code_entity(self):
+        parent = self.graph.parents[self.entity_id]
+        if parent == _NONE:
+            return self.graph.external_parents.get(self.entity_id)
+        return self.graph.get_entity(parent)
+
+    @property
+    def dependency_graph(self):
+        return self.graph
+
+    def get_in_degree(self) -> int:
+        return self.graph.in_offsets[self.entity_id + 1] - self.graph.in_offsets[self.entity_id]
+
+    def get_entity_name(self):
+        return self.entity_name
+
+    def get_qualifier_name(self):
+        return self.qualifier_name
+
+    def get_entity_type(self):
+        return self.entity_type
+
+    def get_code_body(self):
+        return self.code_body
+
+    def get_code_definition(self):
+        return self.code_definition
+
+    def get_code_desc(self):
+        return self.code_desc
+
+    def get_parent_code_entity(self):
+        return self.parent_code_entity
+
+    def get_dependency_graph(self):
+        return self.dependency_graph
+
+    def get_to_entity_by_index(self, index: int):
+        assert 0 <= index < self.graph.out_offsets[self.entity_id + 1] - self.graph.out_offsets[self.entity_id], \
+            f'{self.qualifier_name} has no out edge {index}'
+        return self.graph.get_entity(self.graph.edge_targets[self.graph.out_offsets[self.entity_id] + index])
+
+    def get_from_entity_by_index(self, index: int):
+        assert 0 <= index < self.get_in_degree(), f'{self.qualifier_name} has no in edge {index}'
+        edge_id = self.graph.in_edge_ids[self.graph.in_offsets[self.entity_id] + index]
+        return self.graph.get_entity(self.graph.edge_sources[edge_id])
+
+    def set_code_body(self, code_body: str):
+        self.graph.code_bodies[self.entity_id] = self.graph.strings.intern(code_body)
+
+    def set_code_definition(self, code_definition: str):
+        self.graph.code_definitions[self.entity_id] = self.graph.strings.intern(code_definition)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactCodeEntity) and other.graph is self.graph and other.entity_id == self.entity_id
+
+    def __hash__(self):
+        return hash((id(self.graph), self.entity_id))
+
+    def __repr__(self):
+        return f'CompactCodeEntity({self.qualifier_name!r})'
+
+
+class _EntityViews(Sequence):
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph: CompactGraph = graph
+
+    def __len__(self):
+        return len(self.graph.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.graph.get_entity(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.graph.get_entity(index)
+
+
+class _EntitiesByName(Mapping):
+    __slots__ = ('graph',)
+
+    def __init__(self, graph):
+        self.graph: CompactGraph = graph
+
+    def __getitem__(self, qualifier_name: str):
+        entity_id = self.graph.get_entity_id(qualifier_name)
+        if entity_id == _NONE:
+            raise KeyError(qualifier_name)
+        return self.graph.get_entity(entity_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.graph.strings.get(name) for name in self.graph.qualifier_names)
+
+    def __len__(self):
+        return len(self.graph.qualifier_names)
+
+
+_SNAPSHOT_MAGIC = b'DGSNAP01'
+_SNAPSHOT_VERSION = 1
+# magic, version, byte order (0 little, 1 big), number of sections
+_SNAPSHOT_HEADER = struct.Struct('<8sIII')
+# offset and number of items of a section
+_SNAPSHOT_SECTION = struct.Struct('<QQ')
+# sections in file order, name and array type code; columns of CompactGraph unless noted
+_SNAPSHOT_SECTIONS: Tuple[Tuple[str, str], ...] = (
+    ('string_offsets', 'q'),  # string i is string_data[string_offsets[i]:string_offsets[i + 1]]
+    ('string_data', 'B'),
+    ('names', 'i'),
+    ('qualifier_names', 'i'),
+    ('code_definitions', 'i'),
+    ('code_descs', 'i'),
+    ('code_bodies', 'i'),
+    ('entity_types', 'b'),
+    ('parents', 'i'),
+    ('edge_sources', 'i'),
+    ('edge_targets', 'i'),
+    ('edge_descs', 'i'),
+    ('out_offsets', 'i'),
+    ('in_offsets', 'i'),
+    ('in_edge_ids', 'i'),
+    ('child_offsets', 'i'),
+    ('child_ids', 'i'),
+    ('external_parent_ids', 'i'),  # entity ids with a parent outside the graph, its name and qualifier name follow
+    ('external_parent_names', 'i'),
+    ('external_parent_qualifier_names', 'i'),
+)
+_SNAPSHOT_COLUMNS: Tuple[str, ...] = tuple(name for name, _ in _SNAPSHOT_SECTIONS[2:-3])
+# columns which set_code_body and set_code_definition write to, copied out of the read only mapping
+_SNAPSHOT_WRITABLE = ('code_definitions', 'code_bodies')
+
+
+def _build_csr(n: int, keys: Sequence[int]) -> Tuple[array, array]:
+    """
+    Counting sort of the positions 0..len(keys)-1 by key
+    :return offsets, position list: the positions with key i are positions[offsets[i]:offsets[i + 1]], in order
+    """
+    offsets = array('i', [0]) * (n + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in range(n):
+        offsets[i + 1] += offsets[i]
+    fill = array('i', offsets[:n])
+    positions = array('i', [0]) * len(keys)
+    for position, key in enumerate(keys):
+        positions[fill[key]] = position
+        fill[key] += 1
+    return offsets, positions
+
+
+class CompactGraph(DependencyGraph):
+    """
+    Array backed, read mostly DependencyGraph for very large plans.
+    Entities are integer ids 0..n-1 and their attributes are columns of string ids into one StringTable, so equal
+    names, definitions and descriptions are stored once. Edges are sorted by source, the out edges of entity i are
+    the edge ids out_offsets[i]..out_offsets[i + 1] - 1 and its in edges in_edge_ids[in_offsets[i]:in_offsets[i + 1]]
+    (CSR layout), sub entities are stored the same way.
+    get_code_entities and get_code_entities_dict hand out CompactCodeEntity views, so code written against
+    CodeEntity and DependencyGraph keeps working, including sorting, condensing and the scheduler.
+    """
+
+    def __init__(self):
+        # intentionally not calling DependencyGraph.__init__, entities are views over the arrays below
+        self.strings = StringTable()
+        self.names = array('i')
+        self.qualifier_names = array('i')
+        self.code_definitions = array('i')
+        self.code_descs = array('i')
+        self.code_bodies = array('i')
+        self.entity_types = array('b')
+        self.parents = array('i')
+        # parents which are not part of this graph, e.g. the parent entity of a sub plan
+        self.external_parents: Dict[int, CodeEntity] = {}
+        self.edge_sources = array('i')
+        self.edge_targets = array('i')
+        self.edge_descs = array('i')
+        self.out_offsets = array('i', [0])
+        self.in_offsets = array('i', [0])
+        self.in_edge_ids = array('i')
+        self.child_offsets = array('i', [0])
+        self.child_ids = array('i')
+        # qualifier name -> entity id, only built once somebody looks entities up by name
+        self._ids_by_name: Optional[Dict[str, int]] = None
+        self.entities = _EntityViews(self)
+        self.code_entities_dict = _EntitiesByName(self)
+        self._edge_version = 0
+        self._edge_version_lock = threading.Lock()
+        self._order: Optional[List[CodeEntity]] = None
+        self._order_index: Dict[CodeEntity, int] = {}
+        self._order_version = 0
+        self._cyclic_order: Optional[List[CodeEntity]] = None
+        self._cyclic_order_version = 0
+        # snapshot the columns are mapped from, see load_snapshot
+        self._mapping: Optional[mmap.mmap] = None
+
+    @staticmethod
+    def from_dependency_graph(graph: DependencyGraph):
+        """
+        Edges which are only recorded on one of their ends are kept once, edges to entities outside the graph are
+        left out
+        """
+        compact = CompactGraph()
+        entities = graph.get_code_entities()
+        index: Dict[int, int] = {id(entity): i for i, entity in enumerate(entities)}
+        strings = compact.strings
+        for entity in entities:
+            compact.names.append(strings.intern(entity.get_entity_name()))
+            compact.qualifier_names.append(strings.intern(entity.get_qualifier_name()))
+            compact.code_definitions.append(strings.intern(entity.get_code_definition()))
+            compact.code_descs.append(strings.intern(entity.get_code_desc()))
+            compact.code_bodies.append(strings.intern(entity.get_code_body()))
+            entity_type = entity.get_entity_type()
+            compact.entity_types.append(_NONE if entity_type is None else entity_type.value)
+        children: List[int] = []
+        parents: List[int] = []
+        for i, entity in enumerate(entities):
+            parent = entity.get_parent_code_entity()
+            parent_id = _NONE if parent is None else index.get(id(parent), _NONE)
+            compact.parents.append(parent_id)
+            if parent_id != _NONE:
+                children.append(i)
+                parents.append(parent_id)
+            elif parent is not None:
+                compact.external_parents[i] = parent
+        compact.child_offsets, child_positions = _build_csr(len(entities), parents)
+        compact.child_ids = array('i', (children[p] for p in child_positions))
+
+        seen = set()
+        sources: List[int] = []
+        targets: List[int] = []
+        descs: List[int] = []
+        for entity in entities:
+            for edge in (entity.out_edges or []) + (entity.in_edges or []):
+                if id(edge) in seen:
+                    continue
+                seen.add(id(edge))
+                source = index.get(id(edge.get_from_entity()))
+                target = index.get(id(edge.get_to_entity()))
+                if source is None or target is None:
+                    continue
+                sources.append(source)
+                targets.append(target)
+                descs.append(strings.intern(edge.get_desc()))
+        compact.out_offsets, order = _build_csr(len(entities), sources)
+        compact.edge_sources = array('i', (sources[e] for e in order))
+        compact.edge_targets = array('i', (targets[e] for e in order))
+        compact.edge_descs = array('i', (descs[e] for e in order))
+        compact.in_offsets, compact.in_edge_ids = _build_csr(len(entities), compact.edge_targets)
+        return compact
+
+    def to_dependency_graph(self) -> DependencyGraph:
+        """
+        :return a mutable copy made of plain CodeEntity and Edge objects
+        """
+        entities: List[CodeEntity] = []
+        for i in range(len(self.names)):
+            entities.append(CodeEntity(entity_name=self.strings.get(self.names[i]),
+                                       entity_type=_ENTITY_TYPES.get(self.entity_types[i]),
+                                       code_definition=self.strings.get(self.code_definitions[i]),
+                                       code_desc=self.strings.get(self.code_descs[i]),
+                                       code_body=self.strings.get(self.code_bodies[i]),
+                                       parent_code_entity=self.external_parents.get(i)))
+        for i, entity in enumerate(entities):
+            parent = self.parents[i]
+            if parent != _NONE:
+                # parents may come after their children, so they are linked once all entities exist
+                entity.set_parent_entity(entities[parent])
+                entity.set_qualifier_name(self.strings.get(self.qualifier_names[i]))
+                entities[parent].add_sub_entity(entity)
+        for edge_id in range(len(self.edge_sources)):
+            from_entity = entities[self.edge_sources[edge_id]]
+            to_entity = entities[self.edge_targets[edge_id]]
+            edge = Edge(from_entity, to_entity, self.strings.get(self.edge_descs[edge_id]))
+            from_entity.add_out_edge(edge)
+            to_entity.add_in_edge(edge)
+        return DependencyGraph(entities)
+
+    def save_snapshot(self, path: str):
+        """
+        Write the graph in the binary snapshot layout read by load_snapshot: a header, a table of section offsets
+        and the sections of _SNAPSHOT_SECTIONS, each 8 byte aligned, in native byte order
+        """
+        external_ids = sorted(self.external_parents)
+        external_parents = [self.external_parents[i] for i in external_ids]
+        sections = {
+            'external_parent_ids': array('i', external_ids),
+            'external_parent_names': array('i', (self.strings.intern(p.get_entity_name()) for p in external_parents)),
+            'external_parent_qualifier_names': array('i', (self.strings.intern(p.get_qualifier_name())
+                                                           for p in external_parents)),
+        }
+        strings = [self.strings.get(i).encode('utf-8') for i in range(len(self.strings))]
+        string_offsets = array('q', [0])
+        for data in strings:
+            string_offsets.append(string_offsets[-1] + len(data))
+        sections['string_offsets'] = string_offsets
+        sections['string_data'] = b''.join(strings)
+        for name in _SNAPSHOT_COLUMNS:
+            sections[name] = getattr(self, name)
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            offset = _SNAPSHOT_HEADER.size + _SNAPSHOT_SECTION.size * len(_SNAPSHOT_SECTIONS)
+            table = []
+            for name, typecode in _SNAPSHOT_SECTIONS:
+                offset = (offset + 7) // 8 * 8
+                table.append((offset, len(sections[name])))
+                offset += len(sections[name]) * array(typecode).itemsize
+            f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, int(sys.byteorder == 'big'),
+                                          len(_SNAPSHOT_SECTIONS)))
+            for entry in table:
+                f.write(_SNAPSHOT_SECTION.pack(*entry))
+            for (name, _), (offset, _) in zip(_SNAPSHOT_SECTIONS, table):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(sections[name])
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load_snapshot(path: str):
+        """
+        Map a snapshot written by save_snapshot into memory. Nothing is parsed up front: the columns are views of
+        the mapping, strings are decoded and entities materialized when accessed, and processes loading the same
+        file share its pages.
+        The mapping stays open until close is called, or use the graph as a context manager.
+        """
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with memoryview(mapping) as header:
+            magic, version, big_endian, section_count = _SNAPSHOT_HEADER.unpack_from(header, 0)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION or section_count != len(_SNAPSHOT_SECTIONS):
+            mapping.close()
+            raise Exception(f'{path} is not a dependency graph snapshot of version {_SNAPSHOT_VERSION}')
+        if big_endian != int(sys.byteorder == 'big'):
+            mapping.close()
+            raise Exception(f'{path} was written on a machine of different byte order')
+        view = memoryview(mapping)
+        sections = {}
+        for i, (name, typecode) in enumerate(_SNAPSHOT_SECTIONS):
+            offset, count = _SNAPSHOT_SECTION.unpack_from(view, _SNAPSHOT_HEADER.size + i * _SNAPSHOT_SECTION.size)
+            sections[name] = view[offset:offset + count * array(typecode).itemsize].cast(typecode)
+        graph = CompactGraph()
+        graph.strings = _MappedStringTable(sections['string_offsets'], sections['string_data'])
+        for name in _SNAPSHOT_COLUMNS:
+            column = sections[name]
+            if name in _SNAPSHOT_WRITABLE:
+                column = array(column.format)
+                column.frombytes(sections[name].cast('B'))
+            setattr(graph, name, column)
+        for entity_id, name, qualifier_name in zip(sections['external_parent_ids'], sections['external_parent_names'],
+                                                   sections['external_parent_qualifier_names']):
+            parent = CodeEntity(entity_name=graph.strings.get(name))
+            parent.set_qualifier_name(graph.strings.get(qualifier_name))
+            graph.external_parents[entity_id] = parent
+        graph._mapping = mapping
+        return graph
+
+    def close(self):
+        """
+        Unmap the snapshot of a graph returned by load_snapshot, its columns and strings can not be read afterwards.
+        Does nothing for a graph which was not loaded from a snapshot
+        """
+        if self._mapping is None:
+            return
+        # the mapping can only be closed once no view of it is left
+        views = [getattr(self, name) for name in _SNAPSHOT_COLUMNS]
+        if isinstance(self.strings, _MappedStringTable):
+            views += [self.strings._offsets, self.strings._data]
+        for view in views:
+            if isinstance(view, memoryview):
+                view.release()
+        self._mapping.close()
+        self._mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_entity(self, entity_id: int) -> CompactCodeEntity:
+        return CompactCodeEntity(self, entity_id)
+
+    def get_entity_id(self, qualifier_name: str) -> int:
+        """
+        :return id of the entity called qualifier_name, -1 if there is none
+        """
+        if self._ids_by_name is None:
+            self._ids_by_name = {self.strings.get(name): i for i, name in enumerate(self.qualifier_names)}
+        return self._ids_by_name.get(qualifier_name, _NONE)
+
+    def append_entity(self, entity: CodeEntity):
+        raise Exception(f'can not append {entity.get_qualifier_name()}, a CompactGraph is fixed in structure, '
+                        f'append to the result of to_dependency_graph instead')
+
+    def add_edge(self, from_entity: CodeEntity, to_entity: CodeEntity, desc: str = None) -> Edge:
+        raise Exception(f'can not add an edge from {from_entity.get_qualifier_name()} to '
+                        f'{to_entity.get_qualifier_name()}, a CompactGraph is fixed in structure, add it to the result '
+                        f'of to_dependency_graph instead')
+
+    def extend_graph_from_files(self, plan_steps_file: str, dependency_json_file_path: str,
+                                parent_entity: CodeEntity = None):
+        raise Exception(f'can not extend with {plan_steps_file}, a CompactGraph is fixed in structure, extend the '
+                        f'result of to_dependency_graph instead')
+
+    def get_successors(self) -> List[List[int]]:
+        return [self.edge_targets[self.out_offsets[i]:self.out_offsets[i + 1]].tolist()
+                for i in range(len(self.names))]
@@ -0,0 +1,139 @@
+import ast
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from utils.DependencyGraph import CodeEntity, DependencyGraph
+
+logger = logging.getLogger(__name__)
+
+
+def _strip_body(node: ast.AST) -> ast.AST:
+    """
+    Reduce a function to its signature and docstring and a class to its docstring, class level assignments and
+    stripped methods
+    """
+    docstring = ast.get_docstring(node, clean=False) if isinstance(
+        node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) else None
+    body: List[ast.stmt] = [ast.Expr(ast.Constant(docstring))] if docstring is not None else []
+    if isinstance(node, ast.ClassDef):
+        for statement in node.body:
+            if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                body.append(_strip_body(statement))
+            elif isinstance(statement, (ast.Assign, ast.AnnAssign)):
+                body.append(statement)
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or not body:
+        body.append(ast.Expr(ast.Constant(...)))
+    node.body = body
+    return node
+
+
+def strip_code_bodies(code: str) -> Optional[str]:
+    """
+    :return the imports, module level assignments and the signatures and docstrings of the functions and classes in
+    code, None if code does not parse
+    """
+    try:
+        module = ast.parse(code)
+    except SyntaxError:
+        return None
+    kept = [_strip_body(node) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) else node
+            for node in module.body
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Import, ast.ImportFrom,
+                                 ast.Assign, ast.AnnAssign))]
+    return ast.unparse(ast.Module(body=kept, type_ignores=[]))
+
+
+class ContextBuilder:
+    """
+    Builds the prompt context for generating a code entity from what it depends on: the entities reachable
+    through its in_edges, nearest first, each reduced to signatures and docstrings and cut to a token budget.
+    Transitive dependencies are cached per entity until the edge version of the graph changes, summaries per
+    entity and code.
+    """
+
+    def __init__(self, graph: DependencyGraph, model: str = "gpt-4", max_tokens: int = 1500):
+        """
+        :param max_tokens: default token budget of a context
+        """
+        self.graph = graph
+        self.model = model
+        self.max_tokens = max_tokens
+        self._dependencies: Dict[CodeEntity, List[Tuple[CodeEntity, int]]] = {}
+        # edge version of the graph the cached dependencies were collected at
+        self._dependencies_version = graph.get_edge_version()
+        # entity -> (code definition, code body, summary)
+        self._summaries: Dict[CodeEntity, Tuple[Optional[str], Optional[str], str]] = {}
+
+    def invalidate(self):
+        self._dependencies.clear()
+        self._summaries.clear()
+
+    def get_dependencies(self, code_entity: CodeEntity) -> List[Tuple[CodeEntity, int]]:
+        """
+        :return every entity code_entity uses directly or transitively with its distance, nearest first
+        """
+        version = self.graph.get_edge_version()
+        if version != self._dependencies_version:
+            self._dependencies = {}
+            self._dependencies_version = version
+        dependencies = self._dependencies.get(code_entity)
+        if dependencies is not None:
+            return dependencies
+        seen = {code_entity}
+        level = [code_entity]
+        dependencies = []
+        distance = 0
+        while level:
+            distance += 1
+            next_level = []
+            for entity in level:
+                for edge in entity.in_edges or []:
+                    dependency = edge.get_from_entity()
+                    if dependency not in seen:
+                        seen.add(dependency)
+                        next_level.append(dependency)
+                        dependencies.append((dependency, distance))
+            level = next_level
+        self._dependencies[code_entity] = dependencies
+        return dependencies
+
+    def get_summary(self, code_entity: CodeEntity) -> str:
+        """
+        :return what a dependent needs to know of code_entity: its stripped code once generated, otherwise its
+        definition and description
+        """
+        definition, body = code_entity.get_code_definition(), code_entity.get_code_body()
+        cached = self._summaries.get(code_entity)
+        if cached is not None and cached[0] == definition and cached[1] == body:
+            return cached[2]
+        summary = strip_code_bodies(body) if body else None
+        if summary is None:
+            if body:
+                logger.warning(f"code of {code_entity.get_qualifier_name()} does not parse, using its definition")
+            lines = [f"# {code_entity.get_qualifier_name()}"]
+            if code_entity.get_code_desc():
+                lines.append(f"# {code_entity.get_code_desc()}")
+            if definition:
+                lines.append(definition)
+            summary = '\n'.join(lines)
+        self._summaries[code_entity] = (definition, body, summary)
+        return summary
+
+    def build_context(self, code_entity: CodeEntity, max_tokens: int = None) -> str:
+        """
+        :param max_tokens: token budget, defaults to the one of the builder. Dependencies which do not fit any more
+        are left out, nearer ones are considered first
+        :return summaries of the dependencies of code_entity, separated by blank lines
+        """
+        from llm.token_counter import get_token_counter
+        counter = get_token_counter(self.model)
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        parts: List[str] = []
+        for dependency, _ in self.get_dependencies(code_entity):
+            summary = self.get_summary(dependency)
+            tokens = counter.count_text(summary + '\n\n')
+            if tokens > budget:
+                continue
+            parts.append(summary)
+            budget -= tokens
+        return '\n\n'.join(parts)
@@ -1,14 +1,84 @@
+import hashlib
+import logging
 import os.path
+import threading
+import weakref
+from collections import ChainMap
 from enum import Enum
-from typing import Literal, List, Dict, Optional
-from graphviz import Digraph
+from typing import Callable, Iterable, Literal, List, Dict, Mapping, Optional, Sequence, Union
 
 from llm import PROJECT_DIR
 import json
 
-from utils.util import YamlReader, ContentExtractor
 import re
 
+logger = logging.getLogger(__name__)
+
+
+def strongly_connected_components(successors: Sequence[Sequence[int]]) -> List[List[int]]:
+    """
+    Tarjan's algorithm with an explicit stack, linear in nodes and edges and without recursion depth limits
+    :param successors: adjacency lists of the nodes 0..n-1
+    :return components in topological order, every edge either stays inside a component or goes to a later one.
+    Members of a component are sorted by node number
+    """
+    n = len(successors)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    components: List[List[int]] = []
+    counter = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, pos = work[-1]
+            if pos < len(successors[v]):
+                work[-1] = (v, pos + 1)
+                w = successors[v][pos]
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, 0))
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                component.sort()
+                components.append(component)
+    # tarjan finishes a component after every component it reaches
+    components.reverse()
+    return components
+
+
+def _edges_changed(*entities):
+    """
+    Tell the graphs holding any of entities that edges of theirs changed
+    """
+    for entity in entities:
+        for ref in getattr(entity, 'graphs', None) or ():
+            graph = ref()
+            if graph is not None:
+                graph.edges_changed()
+
 
 class CodeEntityType(Enum):
     Package = 0
@@ -17,14 +87,23 @@ class CodeEntityType(Enum):
 
 
 class Edge:
+    __slots__ = ('from_entity', 'to_entity', 'desc')
+
     def __init__(self, from_entity=None, to_entity=None, desc: str = None):
         self.from_entity = from_entity
         self.to_entity = to_entity
         self.desc = desc
 
     @staticmethod
-    def create_edge_from_dict(to_entity_name: str, edge_desc: Dict[str, str], entities_dict: Dict):
-        desc = edge_desc['explanation']
+    def resolve_edge_from_dict(to_entity_name: str, edge_desc: Dict[str, str], entities_dict: Mapping,
+                               parent_entity=None):
+        """
+        Look up the ends of an edge described in dependency json without creating it
+        :param parent_entity: parent of the sub plan the json belongs to, the used entity is looked up in the sub
+        plan (qualified with the parent's name) first and then among all entities
+        :return from entity, to entity and description
+        """
+        desc = edge_desc.get('explanation')
         key: str = ''
         for i in edge_desc.keys():
             if i != 'explanation':
@@ -32,21 +111,31 @@ class Edge:
                 break
         assert key.startswith('used_'), f'{edge_desc} has wrong format'
         from_entity_name = edge_desc[key]
-        assert entities_dict[
-                   from_entity_name] is not None, f'entities_dict does not contain code entity called {from_entity_name}'
-        assert entities_dict[
-                   to_entity_name] is not None, f'entities_dict does not contain code entity called {to_entity_name}'
-        from_entity = entities_dict[from_entity_name]
-        to_entity = entities_dict[to_entity_name]
+        if parent_entity is not None:
+            qualified_name = parent_entity.get_qualifier_name() + '.' + from_entity_name
+            if qualified_name in entities_dict:
+                from_entity_name = qualified_name
+        assert from_entity_name in entities_dict, \
+            f'entities_dict does not contain code entity called {from_entity_name}'
+        assert to_entity_name in entities_dict, f'entities_dict does not contain code entity called {to_entity_name}'
+        return entities_dict[from_entity_name], entities_dict[to_entity_name], desc
+
+    @staticmethod
+    def create_edge_from_dict(to_entity_name: str, edge_desc: Dict[str, str], entities_dict: Mapping,
+                              parent_entity=None):
+        from_entity, to_entity, desc = Edge.resolve_edge_from_dict(to_entity_name, edge_desc, entities_dict,
+                                                                   parent_entity)
         edge = Edge(from_entity=from_entity, to_entity=to_entity, desc=desc)
         from_entity.add_out_edge(edge)
         to_entity.add_in_edge(edge)
         return edge
 
     def set_to_entity(self, to_entity):
+        _edges_changed(self.from_entity, self.to_entity, to_entity)
         self.to_entity = to_entity
 
     def set_from_entity(self, from_entity):
+        _edges_changed(self.from_entity, self.to_entity, from_entity)
         self.from_entity = from_entity
 
     def set_desc(self, desc: str):
@@ -63,6 +152,10 @@ class Edge:
 
 
 class CodeEntity:
+    __slots__ = ('entity_name', 'entity_type', 'code_definition', 'code_desc', 'code_body', 'sub_entities', 'in_edges',
+                 'out_edges', 'parent_code_entity', 'dependency_graph', 'qualifier_name', 'sub_entities_dict',
+                 'graphs')
+
     def __init__(self, entity_name: str, entity_type: CodeEntityType = None, code_definition: str = None,
                  code_desc: str = None,
                  code_body: str = None,
@@ -81,10 +174,20 @@ class CodeEntity:
         self.dependency_graph = dependency_graph
         self.qualifier_name = self._create_qualifier_name()
         self.sub_entities_dict: Dict[str, CodeEntity] = self.code_entities_to_dict(self.sub_entities)
+        # weak references to the DependencyGraphs holding this entity, told about changes of its edges
+        self.graphs: Optional[List[weakref.ref]] = None
+
+    def add_graph(self, graph):
+        if self.graphs is None:
+            self.graphs = [weakref.ref(graph)]
+        elif all(ref() is not graph for ref in self.graphs):
+            self.graphs = [ref for ref in self.graphs if ref() is not None] + [weakref.ref(graph)]
 
     @staticmethod
-    def code_entities_to_dict(code_entities: List) -> Dict[str]:
+    def code_entities_to_dict(code_entities: Optional[List]) -> Dict:
         code_entities_dict: Dict[str, CodeEntity] = {}
+        if not code_entities:
+            return code_entities_dict
         for code_entity in code_entities:
             code_entities_dict[code_entity.get_qualifier_name()] = code_entity
         return code_entities_dict
@@ -99,12 +202,14 @@ class CodeEntity:
             self.in_edges.append(in_edge)
         else:
             self.in_edges = [in_edge]
+        _edges_changed(self)
 
     def add_out_edge(self, out_edge: Edge):
         if self.out_edges:
             self.out_edges.append(out_edge)
         else:
             self.out_edges = [out_edge]
+        _edges_changed(self)
 
     def add_to_entity(self, to_entity):
         self.add_out_edge(Edge(self, to_entity))
@@ -113,7 +218,7 @@ class CodeEntity:
         self.add_in_edge(Edge(from_entity, self))
 
     def get_in_degree(self) -> int:
-        return len(self.in_edges)
+        return len(self.in_edges) if self.in_edges else 0
 
     def get_entity_name(self):
         return self.entity_name
@@ -147,9 +252,11 @@ class CodeEntity:
 
     def del_to_entity_by_index(self, index: int):
         del self.out_edges[index]
+        _edges_changed(self)
 
     def del_from_entity_by_index(self, index: int):
         del self.in_edges[index]
+        _edges_changed(self)
 
     def set_entity_name(self, entity_name: str):
         self.entity_name = entity_name
@@ -183,9 +290,11 @@ class CodeEntity:
 
     def set_in_edges(self, in_edges: List[Edge]):
         self.in_edges = in_edges
+        _edges_changed(self)
 
     def set_out_edges(self, out_edges: List[Edge]):
         self.out_edges = out_edges
+        _edges_changed(self)
 
     def set_parent_entity(self, parent_code_entity):
         self.parent_code_entity = parent_code_entity
@@ -194,10 +303,50 @@ class CodeEntity:
         self.dependency_graph = dependency_graph
 
 
+def _hash_fields(fields: List) -> str:
+    canonical = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def get_signature_hash(code_entity: CodeEntity) -> str:
+    """
+    Hash of what dependents see of an entity: its name, type and code definition, but not its body
+    """
+    entity_type = code_entity.get_entity_type()
+    return _hash_fields([code_entity.get_qualifier_name(), entity_type.name if entity_type else None,
+                         code_entity.get_code_definition()])
+
+
+def get_input_hash(code_entity: CodeEntity) -> str:
+    """
+    Hash of everything generating an entity depends on: its own description and definition and the signature
+    hashes of the entities it uses (the from_entity of its in_edges)
+    """
+    entity_type = code_entity.get_entity_type()
+    dependencies = sorted({(edge.get_from_entity().get_qualifier_name(), get_signature_hash(edge.get_from_entity()))
+                           for edge in code_entity.in_edges or []})
+    return _hash_fields([code_entity.get_qualifier_name(), entity_type.name if entity_type else None,
+                         code_entity.get_code_desc(), code_entity.get_code_definition(), dependencies])
+
+
 class DependencyGraph:
     def __init__(self, entities: List[CodeEntity]):
         self.entities: List[CodeEntity] = entities
         self.code_entities_dict: Dict[str, CodeEntity] = CodeEntity.code_entities_to_dict(entities)
+        # bumped whenever edges of an entity of this graph change
+        self._edge_version = 0
+        self._edge_version_lock = threading.Lock()
+        for entity in entities:
+            entity.add_graph(self)
+        # topological order kept up to date by append_entity and add_edge once top_sort_entities computed it,
+        # None while it is unknown or the graph has cycles. Edges changed any other way change _edge_version away
+        # from _order_version, which makes the order stale
+        self._order: Optional[List[CodeEntity]] = None
+        self._order_index: Dict[CodeEntity, int] = {}
+        self._order_version = 0
+        # order of a graph with cycles, not maintained incrementally but kept until the entities or edges change
+        self._cyclic_order: Optional[List[CodeEntity]] = None
+        self._cyclic_order_version = 0
 
     def get_code_entities(self):
         return self.entities
@@ -205,42 +354,298 @@ class DependencyGraph:
     def get_code_entities_dict(self):
         return self.code_entities_dict
 
+    def edges_changed(self):
+        with self._edge_version_lock:
+            self._edge_version += 1
+
+    def get_edge_version(self) -> int:
+        """
+        :return a number which changes whenever edges of entities of this graph change, e.g. to tell whether
+        something derived from the edges is stale
+        """
+        return self._edge_version
+
     def append_entity(self, entity: CodeEntity):
         self.entities.append(entity)
         self.code_entities_dict[entity.get_qualifier_name()] = entity
+        entity.add_graph(self)
+        if not self._is_order_current():
+            self.invalidate_order()
+            return
+        # nothing can depend on the entity yet at the end of the order, only its out edges may need reordering
+        self._order_index[entity] = len(self._order)
+        self._order.append(entity)
+        for edge in entity.in_edges or []:
+            self._insert_order_edge(edge.get_from_entity(), entity)
+        for edge in entity.out_edges or []:
+            self._insert_order_edge(entity, edge.get_to_entity())
+
+    def add_edge(self, from_entity: CodeEntity, to_entity: CodeEntity, desc: str = None) -> Edge:
+        """
+        Record that to_entity uses from_entity, on both entities, keeping the topological order up to date
+        """
+        current = self._is_order_current()
+        edge = Edge(from_entity=from_entity, to_entity=to_entity, desc=desc)
+        from_entity.add_out_edge(edge)
+        to_entity.add_in_edge(edge)
+        if current:
+            self._order_version = self._edge_version
+            self._insert_order_edge(from_entity, to_entity)
+        else:
+            self.invalidate_order()
+        return edge
+
+    def invalidate_order(self):
+        """
+        Forget the topological order, it is recomputed by the next top_sort_entities
+        """
+        self._order = None
+        self._order_index = {}
+        self._cyclic_order = None
+
+    def _is_order_current(self) -> bool:
+        return self._order is not None and self._order_version == self._edge_version
+
+    def _insert_order_edge(self, from_entity: CodeEntity, to_entity: CodeEntity):
+        """
+        Pearce-Kelly: when the new edge points backwards in the order, only the entities ordered between its ends
+        which are reachable from to_entity or reach from_entity are moved, the rest of the order stays as it is
+        """
+        if self._order is None:
+            return
+        if from_entity is to_entity:
+            logger.warning(f"{from_entity.get_qualifier_name()} uses itself, the topological order will be recomputed")
+            self.invalidate_order()
+            return
+        index = self._order_index
+        lower, upper = index.get(to_entity), index.get(from_entity)
+        if lower is None or upper is None or upper < lower:
+            return
+        forward: List[CodeEntity] = []
+        seen = {to_entity}
+        stack = [to_entity]
+        while stack:
+            entity = stack.pop()
+            forward.append(entity)
+            for edge in entity.out_edges or []:
+                successor = edge.get_to_entity()
+                position = index.get(successor)
+                if position is None or position > upper or successor in seen:
+                    continue
+                if position == upper:
+                    logger.warning(f"{from_entity.get_qualifier_name()} -> {to_entity.get_qualifier_name()} "
+                                   f"closes a dependency cycle, the topological order will be recomputed")
+                    self.invalidate_order()
+                    return
+                seen.add(successor)
+                stack.append(successor)
+        backward: List[CodeEntity] = []
+        seen = {from_entity}
+        stack = [from_entity]
+        while stack:
+            entity = stack.pop()
+            backward.append(entity)
+            for edge in entity.in_edges or []:
+                predecessor = edge.get_from_entity()
+                position = index.get(predecessor)
+                if position is None or position < lower or predecessor in seen:
+                    continue
+                seen.add(predecessor)
+                stack.append(predecessor)
+        forward.sort(key=lambda e: index[e])
+        backward.sort(key=lambda e: index[e])
+        positions = sorted(index[e] for e in backward + forward)
+        for position, entity in zip(positions, backward + forward):
+            self._order[position] = entity
+            index[entity] = position
+
+    def get_input_hashes(self) -> Dict[str, str]:
+        """
+        :return get_input_hash of every entity by qualifier name, e.g. to be stored next to the generated code
+        """
+        return {entity.get_qualifier_name(): get_input_hash(entity) for entity in self.entities}
+
+    def get_dirty_entities(self, changed: Iterable[Union[CodeEntity, str]]) -> List[CodeEntity]:
+        """
+        :param changed: entities or qualifier names of entities whose definition or body was edited
+        :return the changed entities and everything which uses them directly or transitively (following out_edges),
+        in graph order
+        """
+        dirty = set()
+        stack = [self.code_entities_dict[entity] if isinstance(entity, str) else entity for entity in changed]
+        while stack:
+            entity = stack.pop()
+            if entity in dirty:
+                continue
+            dirty.add(entity)
+            for edge in entity.out_edges or []:
+                stack.append(edge.get_to_entity())
+        return [entity for entity in self.entities if entity in dirty]
+
+    def compact(self):
+        """
+        :return an array backed copy of this graph for very large plans, see utils.CompactGraph
+        """
+        from utils.CompactGraph import CompactGraph
+        return CompactGraph.from_dependency_graph(self)
+
+    def save_snapshot(self, path: str):
+        """
+        Write the graph to a binary snapshot which load_snapshot maps back into memory, see utils.CompactGraph
+        """
+        self.compact().save_snapshot(path)
+
+    @staticmethod
+    def load_snapshot(path: str):
+        """
+        :return the CompactGraph stored at path, memory mapped and materialized lazily, close it (or use it as a
+        context manager) to unmap the file
+        """
+        from utils.CompactGraph import CompactGraph
+        return CompactGraph.load_snapshot(path)
+
+    def get_successors(self) -> List[List[int]]:
+        """
+        :return for every entity (by position in entities) the positions of the entities using it, edges to
+        entities outside this graph are left out
+        """
+        index: Dict[int, int] = {id(entity): i for i, entity in enumerate(self.entities)}
+        successors: List[List[int]] = [[] for _ in self.entities]
+        for i, entity in enumerate(self.entities):
+            for edge in entity.out_edges or []:
+                j = index.get(id(edge.get_to_entity()))
+                if j is not None:
+                    successors[i].append(j)
+        return successors
+
+    def get_strongly_connected_components(self) -> List[List[CodeEntity]]:
+        """
+        :return entities grouped into strongly connected components, in dependency order
+        """
+        components = strongly_connected_components(self.get_successors())
+        return [[self.entities[i] for i in component] for component in components]
+
+    def get_cycles(self) -> List[List[CodeEntity]]:
+        """
+        :return groups of entities which depend on each other, directly or through other members of the group
+        """
+        successors = self.get_successors()
+        return [[self.entities[i] for i in component]
+                for component in strongly_connected_components(successors)
+                if len(component) > 1 or component[0] in successors[component[0]]]
+
+    def condense(self):
+        """
+        Collapse every cycle into one composite node
+        :return the components (lists of entity positions, in dependency order) and for every component the
+        components which use it
+        """
+        successors = self.get_successors()
+        components = strongly_connected_components(successors)
+        component_of = [0] * len(self.entities)
+        for c, component in enumerate(components):
+            for i in component:
+                component_of[i] = c
+        component_successors: List[List[int]] = [[] for _ in components]
+        for c, component in enumerate(components):
+            seen = set()
+            for i in component:
+                for j in successors[i]:
+                    d = component_of[j]
+                    if d != c and d not in seen:
+                        seen.add(d)
+                        component_successors[c].append(d)
+        return components, component_successors
 
     def top_sort_entities(self) -> List[CodeEntity]:
-        in_degrees: Dict[CodeEntity, int] = dict[CodeEntity, int]()
-        entities_queue: List[CodeEntity] = []
+        """
+        Kahn's algorithm over the condensed graph, members of a cycle are placed next to each other where the
+        cycle as a whole becomes ready instead of being dropped.
+        An acyclic order is remembered and afterwards maintained incrementally by append_entity and add_edge, a cyclic
+        one is remembered until the graph changes
+        """
+        if self._is_order_current():
+            return list(self._order)
+        if self._cyclic_order is not None and self._cyclic_order_version == self._edge_version:
+            return list(self._cyclic_order)
+        self.invalidate_order()
+        version = self._edge_version
+        components, component_successors = self.condense()
+        cycles = [component for component in components if len(component) > 1]
+        if cycles:
+            logger.warning(f"dependency cycles among "
+                           f"{[[self.entities[i].get_qualifier_name() for i in cycle] for cycle in cycles]}")
+        in_degrees = [0] * len(components)
+        for successors in component_successors:
+            for d in successors:
+                in_degrees[d] += 1
+        # seed in entity order so that acyclic graphs keep their plain kahn order
+        queue = sorted((c for c in range(len(components)) if in_degrees[c] == 0), key=lambda c: components[c][0])
         head = 0
-        for entity in self.entities:
-            in_degrees[entity] = entity.get_in_degree()
-        for entity in self.entities:
-            if in_degrees[entity] == 0:
-                entities_queue.append(entity)
-        while head < len(entities_queue):
-            from_entity = entities_queue[head]
-            head = head + 1
-            for out_edge in from_entity.out_edges:
-                to_entity = out_edge.to_entity
-                in_degrees[to_entity] = in_degrees[to_entity] - 1
-                if in_degrees[to_entity] == 0:
-                    entities_queue.append(to_entity)
-        return entities_queue
-
-    def graph_visualize(self, project_name: str, format: str = 'png'):
+        while head < len(queue):
+            c = queue[head]
+            head += 1
+            for d in component_successors[c]:
+                in_degrees[d] -= 1
+                if in_degrees[d] == 0:
+                    queue.append(d)
+        order = [self.entities[i] for c in queue for i in components[c]]
+        if cycles or any(edge.get_to_entity() == entity for entity in self.entities for edge in entity.out_edges or []):
+            self._cyclic_order = list(order)
+            self._cyclic_order_version = version
+        else:
+            self._order = list(order)
+            self._order_index = {entity: i for i, entity in enumerate(order)}
+            self._order_version = version
+        return order
+
+    def get_neighborhood(self, qualifier_name: str, hops: int = 1,
+                         direction: Literal['in', 'out', 'both'] = 'both') -> List[CodeEntity]:
+        """
+        :param qualifier_name: entity to center the view on
+        :param hops: how many edges away from the center entities may be
+        :param direction: follow in_edges (what it uses), out_edges (what uses it) or both
+        :return the entities within hops of the center, nearest first
+        """
+        assert qualifier_name in self.code_entities_dict, f'{qualifier_name} does not exits in the graph'
+        center = self.code_entities_dict[qualifier_name]
+        seen = {center}
+        level = [center]
+        neighborhood = [center]
+        for _ in range(hops):
+            next_level = []
+            for entity in level:
+                neighbors = []
+                if direction in ('in', 'both'):
+                    neighbors.extend(edge.get_from_entity() for edge in entity.in_edges or [])
+                if direction in ('out', 'both'):
+                    neighbors.extend(edge.get_to_entity() for edge in entity.out_edges or [])
+                for neighbor in neighbors:
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        next_level.append(neighbor)
+            neighborhood.extend(next_level)
+            level = next_level
+        return neighborhood
+
+    def graph_visualize(self, project_name: str, format: str = 'png', center: str = None, hops: int = 2,
+                        entity_filter: Callable[[CodeEntity], bool] = None):
+        """
+        Write the graph as workingspace/<project_name>.dot and render it with graphviz dot
+        :param center: qualifier name of an entity, only draw its neighborhood of hops edges
+        :param entity_filter: only draw the entities it returns True for
+        :return path of the rendered image, None if dot is not installed or failed
+        """
+        from utils.GraphDot import write_dot, render_dot
         assert format in ['png', 'jpg', 'svg'], f'do not support graph format {format}'
-        path = os.path.join(PROJECT_DIR, 'workingspace', project_name + '.' + format)
-        graph = Digraph(name=project_name)
-        entities_with_index: Dict[CodeEntity, int] = Dict[CodeEntity, int]()
-        for i, entity in enumerate(self.entities):
-            graph.node(str(i), entity.get_entity_definition())
-            entities_with_index[entity] = i
-        for entity, index in entities_with_index.items():
-            for edge in entity.out_edges:
-                to_entity = edge.to_entity
-                graph.edge(str(index), str(entities_with_index[to_entity]))
-        graph.render(filename=path, format=format, view=True)
+        path = os.path.join(PROJECT_DIR, 'workingspace', project_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entities = self.entities if center is None else self.get_neighborhood(center, hops)
+        if entity_filter is not None:
+            entities = [entity for entity in entities if entity_filter(entity)]
+        with open(path + '.dot', 'w', encoding='utf-8') as f:
+            write_dot(self, f, entities, name=project_name)
+        return render_dot(path + '.dot', path + '.' + format, format)
 
     @staticmethod
     def build_graph_from_dependency_json_file(dependency_json_file_path: str, code_entities: List[CodeEntity],
@@ -248,7 +653,7 @@ class DependencyGraph:
         assert os.path.exists(dependency_json_file_path), f'{dependency_json_file_path} does not exits'
         code_entities_dict: Dict[str, CodeEntity] = CodeEntity.code_entities_to_dict(code_entities)
         if created_graph:
-            code_entities_dict = code_entities_dict + created_graph.get_code_entities_dict()
+            code_entities_dict = {**created_graph.get_code_entities_dict(), **code_entities_dict}
         with open(dependency_json_file_path, 'r') as f:
             graph: Dict[str, List[Dict[str, str]]] = json.load(f)
         for to_entity_name, in_edges_desc in graph.items():
@@ -257,12 +662,13 @@ class DependencyGraph:
             assert code_entities_dict[to_entity_name] is not None, \
                 f'{to_entity_name} does not exits in created code entities list'
             to_code_entity = code_entities_dict[to_entity_name]
-            DependencyGraph._get_in_edges(to_code_entity, in_edges_desc, code_entities_dict)
+            DependencyGraph._get_in_edges(to_code_entity, in_edges_desc, code_entities_dict, parent_entity)
         code_entities = list(code_entities_dict.values())
         return DependencyGraph(code_entities)
 
     @staticmethod
     def create_entities_from_steps(plan_steps_file: str, parent_code_entity: CodeEntity = None) -> List[CodeEntity]:
+        from utils.util import YamlReader, ContentExtractor
         assert os.path.exists(plan_steps_file), f'{plan_steps_file} does not exits'
         assert plan_steps_file.endswith('.yaml'), f'does not support file format {plan_steps_file}'
         code_entities: List[CodeEntity] = []
@@ -274,15 +680,16 @@ class DependencyGraph:
 
     @staticmethod
     def _get_in_edges(to_code_entity: CodeEntity, in_edges_desc: List[Dict[str, str]],
-                      entities_dict: Dict[str, CodeEntity]) -> CodeEntity:
+                      entities_dict: Dict[str, CodeEntity], parent_entity: CodeEntity = None) -> CodeEntity:
         for in_edge_desc in in_edges_desc:
-            Edge.create_edge_from_dict(to_code_entity.get_qualifier_name(), in_edge_desc, entities_dict)
+            Edge.create_edge_from_dict(to_code_entity.get_qualifier_name(), in_edge_desc, entities_dict,
+                                       parent_entity)
         return to_code_entity
 
     @staticmethod
     def build_graph_from_files(plan_steps_file: str, dependency_json_file_path: str, parent_entity: CodeEntity = None,
                                created_graph=None):
-        sub_entities = DependencyGraph.create_entities_from_steps(plan_steps_file)
+        sub_entities = DependencyGraph.create_entities_from_steps(plan_steps_file, parent_entity)
         if parent_entity:
             parent_entity.extend_sub_entities(sub_entities)
         return DependencyGraph.build_graph_from_dependency_json_file(dependency_json_file_path, sub_entities,
@@ -290,6 +697,27 @@ class DependencyGraph:
 
     def extend_graph_from_files(self, plan_steps_file: str, dependency_json_file_path: str,
                                 parent_entity: CodeEntity = None):
-        return DependencyGraph.build_graph_from_files(plan_steps_file, dependency_json_file_path,
-                                                      parent_entity, self)
-
+        """
+        Merge a sub plan into this graph in place, the work done is proportional to the sub plan and the part of
+        the topological order it reorders, not to the whole graph
+        :return this graph
+        """
+        assert os.path.exists(dependency_json_file_path), f'{dependency_json_file_path} does not exits'
+        sub_entities = DependencyGraph.create_entities_from_steps(plan_steps_file, parent_entity)
+        with open(dependency_json_file_path, 'r') as f:
+            graph: Dict[str, List[Dict[str, str]]] = json.load(f)
+        # resolve every edge before touching the graph, so a bad plan leaves it as it was
+        entities_dict = ChainMap(CodeEntity.code_entities_to_dict(sub_entities), self.code_entities_dict)
+        edges = []
+        for to_entity_name, in_edges_desc in graph.items():
+            if parent_entity:
+                to_entity_name = parent_entity.get_qualifier_name() + '.' + to_entity_name
+            for in_edge_desc in in_edges_desc:
+                edges.append(Edge.resolve_edge_from_dict(to_entity_name, in_edge_desc, entities_dict, parent_entity))
+        if parent_entity:
+            parent_entity.extend_sub_entities(sub_entities)
+        for sub_entity in sub_entities:
+            self.append_entity(sub_entity)
+        for from_entity, to_entity, desc in edges:
+            self.add_edge(from_entity, to_entity, desc)
+        return self
@@ -0,0 +1,114 @@
+import logging
+import subprocess
+from typing import Dict, Iterable, List, Optional, TextIO
+
+from utils.DependencyGraph import CodeEntity, DependencyGraph
+
+logger = logging.getLogger(__name__)
+
+# longest code definition shown in a node label, longer ones are cut
+MAX_LABEL_DEFINITION = 80
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def _node_label(entity: CodeEntity) -> str:
+    entity_type = entity.get_entity_type()
+    label = entity.get_entity_name() if entity_type is None else f'{entity_type.name} {entity.get_entity_name()}'
+    definition = (entity.get_code_definition() or '').strip().split('\n', 1)[0]
+    if definition:
+        if len(definition) > MAX_LABEL_DEFINITION:
+            definition = definition[:MAX_LABEL_DEFINITION - 3] + '...'
+        label += '\n' + definition
+    return label
+
+
+def write_dot(graph: DependencyGraph, out: TextIO, entities: Optional[Iterable[CodeEntity]] = None,
+              name: str = 'dependencies', cluster: bool = True):
+    """
+    Stream the graph to out in graphviz DOT format, line by line, without building it in memory first
+    :param entities: only write these entities and the edges among them, defaults to the whole graph. Entities
+    which are not part of graph (e.g. reached over an edge leaving it) are left out
+    :param cluster: draw the sub entities of an entity (by parent_code_entity) inside a box labeled with its name
+    """
+    all_entities = graph.get_code_entities()
+    index: Dict[CodeEntity, int] = {entity: i for i, entity in enumerate(all_entities)}
+    selected = list(all_entities) if entities is None else [entity for entity in entities if entity in index]
+    selected_set = set(selected)
+    children: Dict[CodeEntity, List[CodeEntity]] = {}
+    # entities drawn at the top level, or in a box of a parent which is not drawn itself
+    roots: Dict[Optional[CodeEntity], List[CodeEntity]] = {}
+    for entity in selected:
+        parent = entity.get_parent_code_entity() if cluster else None
+        if parent is not None and parent in selected_set:
+            children.setdefault(parent, []).append(entity)
+        else:
+            roots.setdefault(parent, []).append(entity)
+
+    out.write(f'digraph {_quote(name)} {{\n')
+    out.write('  node [shape=box, fontsize=10];\n')
+    cluster_count = 0
+
+    def write_members(members: List[CodeEntity], indent: str):
+        nonlocal cluster_count
+        # explicit stack instead of recursion, entries are entities to write or None to close a box
+        stack: List[Optional[CodeEntity]] = list(reversed(members))
+        depth = 0
+        while stack:
+            entity = stack.pop()
+            if entity is None:
+                depth -= 1
+                out.write(f'{indent}{"  " * depth}}}\n')
+                continue
+            prefix = indent + '  ' * depth
+            node = f'{prefix}n{index[entity]} [label={_quote(_node_label(entity))}];\n'
+            if entity not in children:
+                out.write(node)
+                continue
+            out.write(f'{prefix}subgraph cluster_{cluster_count} {{\n')
+            out.write(f'{prefix}  label={_quote(entity.get_qualifier_name())};\n')
+            cluster_count += 1
+            depth += 1
+            out.write('  ' + node)
+            stack.append(None)
+            stack.extend(reversed(children[entity]))
+
+    for parent, members in roots.items():
+        if parent is None:
+            write_members(members, '  ')
+            continue
+        out.write(f'  subgraph cluster_{cluster_count} {{\n')
+        out.write(f'    label={_quote(parent.get_qualifier_name())};\n')
+        out.write('    style=dashed;\n')
+        cluster_count += 1
+        write_members(members, '    ')
+        out.write('  }\n')
+
+    for entity in selected:
+        for edge in entity.out_edges or []:
+            to_entity = edge.get_to_entity()
+            if to_entity not in selected_set:
+                continue
+            desc = edge.get_desc()
+            attributes = f' [tooltip={_quote(desc)}]' if desc else ''
+            out.write(f'  n{index[entity]} -> n{index[to_entity]}{attributes};\n')
+    out.write('}\n')
+
+
+def render_dot(dot_path: str, output_path: str, format: str = 'png') -> Optional[str]:
+    """
+    Lay out and render a DOT file with the graphviz dot program, waiting for it to finish
+    :return output_path, None if dot is not installed or failed
+    """
+    try:
+        result = subprocess.run(['dot', f'-T{format}', '-o', output_path, dot_path],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        logger.warning(f'graphviz dot is not installed, {dot_path} was written but not rendered')
+        return None
+    if result.returncode != 0:
+        logger.warning(f'graphviz dot failed to render {dot_path}: {result.stderr.decode(errors="replace").strip()}')
+        return None
+    return output_path
@@ -0,0 +1,206 @@
+import heapq
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from utils.DependencyGraph import CodeEntity, DependencyGraph, get_input_hash
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_token_cost(code_entity: CodeEntity, model: str = "gpt-4") -> float:
+    """
+    Rough generation cost of a code entity: the tokens of what is known about it so far
+    """
+    from llm.token_counter import get_token_counter
+    counter = get_token_counter(model)
+    parts = (code_entity.get_code_desc(), code_entity.get_code_definition(), code_entity.get_code_body())
+    text = '\n'.join(part for part in parts if part)
+    return float(max(counter.count_text(text), 1))
+
+
+class DependencyScheduler:
+    """
+    Runs a worker on every code entity of a dependency graph, each entity as soon as all entities it depends on
+    (the from_entity of its in_edges) are done, with up to max_workers entities in parallel.
+    Among ready entities the one heading the longest remaining dependency chain (its critical path, optionally
+    weighted by cost) goes first, so the total wall time approaches the critical path instead of the sum of all
+    calls.
+    Entities on a dependency cycle are scheduled together as one unit once everything the cycle depends on is done;
+    they are handed to cycle_worker at once if one is given, otherwise to worker one after the other in one task.
+    Edges to entities outside the graph are ignored.
+    Given the input hashes of an earlier run, the scheduler regenerates: an entity whose get_input_hash still matches
+    is not handed to the worker again. Hashes are checked right before an entity would be processed, after its
+    dependencies were regenerated, so an entity is only redone if its own spec or the signature of something it uses
+    actually changed.
+    """
+
+    def __init__(self, graph: DependencyGraph, worker: Callable[[CodeEntity], Any], max_workers: int = 8,
+                 cost: Optional[Callable[[CodeEntity], float]] = None,
+                 cycle_worker: Optional[Callable[[List[CodeEntity]], Any]] = None,
+                 input_hashes: Optional[Dict[str, str]] = None):
+        """
+        :param graph: dependency graph to process
+        :param worker: called once per code entity, e.g. to generate its code with the LLM
+        :param max_workers: number of entities processed at the same time
+        :param cost: estimated cost of processing an entity (e.g. estimate_token_cost), defaults to 1 per entity
+        :param cycle_worker: called once with all members of a dependency cycle, its result is recorded for every
+        member
+        :param input_hashes: input hashes by qualifier name recorded by an earlier run, turns on regeneration
+        """
+        self.graph = graph
+        self.worker = worker
+        self.max_workers = max_workers
+        self.cost = cost
+        self.cycle_worker = cycle_worker
+        self.regenerate_only_changed = input_hashes is not None
+        # input hash of every entity as of its last generation, updated as entities are processed
+        self.input_hashes: Dict[str, str] = dict(input_hashes or {})
+        self.unchanged: List[str] = []
+        self.entities: List[CodeEntity] = list(graph.get_code_entities())
+        # scheduling units, a single entity or all members of a cycle, in dependency order
+        self.units, self.successors = graph.condense()
+        self.in_degrees: List[int] = [0] * len(self.units)
+        for successors in self.successors:
+            for d in successors:
+                self.in_degrees[d] += 1
+        self.cycles: List[List[CodeEntity]] = [[self.entities[i] for i in unit] for unit in self.units
+                                               if len(unit) > 1]
+        if self.cycles:
+            logger.warning(f"dependency cycles, their members are generated together: "
+                           f"{[[e.get_qualifier_name() for e in cycle] for cycle in self.cycles]}")
+        self.priorities: List[float] = self._compute_priorities()
+        self.results: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+        self.skipped: List[str] = []
+
+    def _compute_priorities(self) -> List[float]:
+        """
+        Length of the longest chain of dependents starting at every unit, itself included
+        """
+        costs = [sum(self.cost(self.entities[i]) if self.cost else 1.0 for i in unit) for unit in self.units]
+        priorities = list(costs)
+        # units are in dependency order, so dependents are done before the units they depend on
+        for c in reversed(range(len(self.units))):
+            if self.successors[c]:
+                priorities[c] = costs[c] + max(priorities[d] for d in self.successors[c])
+        return priorities
+
+    def _get_unit_entities(self, c: int) -> List[CodeEntity]:
+        return [self.entities[i] for i in self.units[c]]
+
+    def get_critical_path(self) -> List[CodeEntity]:
+        """
+        :return the chain of entities which bounds the wall time of run, from the first to be processed
+        """
+        roots = [c for c in range(len(self.units)) if self.in_degrees[c] == 0]
+        if not roots:
+            return []
+        c = max(roots, key=lambda k: self.priorities[k])
+        path = self._get_unit_entities(c)
+        while self.successors[c]:
+            c = max(self.successors[c], key=lambda k: self.priorities[k])
+            path.extend(self._get_unit_entities(c))
+        return path
+
+    def get_ready_sets(self) -> List[List[CodeEntity]]:
+        """
+        :return entities grouped into levels, every entity only depends on entities of earlier levels or of its own
+        cycle
+        """
+        in_degrees = list(self.in_degrees)
+        level = [c for c, degree in enumerate(in_degrees) if degree == 0]
+        ready_sets: List[List[CodeEntity]] = []
+        while level:
+            ready_sets.append([entity for c in level for entity in self._get_unit_entities(c)])
+            next_level = []
+            for c in level:
+                for d in self.successors[c]:
+                    in_degrees[d] -= 1
+                    if in_degrees[d] == 0:
+                        next_level.append(d)
+            level = next_level
+        return ready_sets
+
+    def _process_unit(self, c: int) -> Dict[str, Any]:
+        entities = self._get_unit_entities(c)
+        names = [entity.get_qualifier_name() for entity in entities]
+        if self.regenerate_only_changed and all(self.input_hashes.get(name) == get_input_hash(entity)
+                                                for name, entity in zip(names, entities)):
+            self.unchanged.extend(names)
+            return {}
+        if len(entities) > 1 and self.cycle_worker is not None:
+            result = self.cycle_worker(entities)
+            results = {name: result for name in names}
+        else:
+            results = {name: self.worker(entity) for name, entity in zip(names, entities)}
+        # hashed after the worker ran, as it may have filled in the definition
+        for name, entity in zip(names, entities):
+            self.input_hashes[name] = get_input_hash(entity)
+        return results
+
+    def run(self, fail_fast: bool = True, entities: Optional[Iterable[CodeEntity]] = None) -> Dict[str, Any]:
+        """
+        Process every entity of the graph
+        :param fail_fast: stop dispatching once an entity failed and raise its error, otherwise keep going with
+        everything that does not depend on a failed entity and report failures in errors and skipped
+        :param entities: only process these entities (and the cycles they are on), the others count as done
+        :return worker results by qualifier name, entities found unchanged when regenerating are left out
+        """
+        self.results, self.errors, self.skipped, self.unchanged = {}, {}, [], []
+        selected = self._select_units(entities)
+        wanted = set(selected)
+        in_degrees = [0] * len(self.units)
+        for c in selected:
+            for d in self.successors[c]:
+                in_degrees[d] += 1
+        ready: List[Tuple[float, int]] = [(-self.priorities[c], c) for c in selected if in_degrees[c] == 0]
+        heapq.heapify(ready)
+        running: Dict[Future, int] = {}
+        finished: Set[int] = set()
+        failed: Optional[Exception] = None
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dependency-scheduler") as executor:
+            while ready or running:
+                while ready and len(running) < self.max_workers and failed is None:
+                    _, c = heapq.heappop(ready)
+                    running[executor.submit(self._process_unit, c)] = c
+                if not running:
+                    break
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    c = running.pop(future)
+                    finished.add(c)
+                    error = future.exception()
+                    if error is not None:
+                        names = [entity.get_qualifier_name() for entity in self._get_unit_entities(c)]
+                        logger.warning(f"processing {', '.join(names)} failed: {error}")
+                        for name in names:
+                            self.errors[name] = error
+                        if fail_fast and failed is None:
+                            failed = error
+                        continue
+                    self.results.update(future.result())
+                    for d in self.successors[c]:
+                        in_degrees[d] -= 1
+                        if in_degrees[d] == 0 and d in wanted:
+                            heapq.heappush(ready, (-self.priorities[d], d))
+        if failed is not None:
+            raise failed
+        self.skipped = [entity.get_qualifier_name() for c in selected if c not in finished
+                        for entity in self._get_unit_entities(c)]
+        return self.results
+
+    def _select_units(self, entities: Optional[Iterable[CodeEntity]]) -> List[int]:
+        if entities is None:
+            return list(range(len(self.units)))
+        wanted = set(entities)
+        return [c for c, unit in enumerate(self.units) if any(self.entities[i] in wanted for i in unit)]
+
+    def regenerate(self, changed: Iterable[Union[CodeEntity, str]], fail_fast: bool = True) -> Dict[str, Any]:
+        """
+        Process what an edit of the changed entities may affect: the changed entities and their transitive
+        dependents, skipping those whose input hash turns out unchanged
+        :param changed: edited entities or their qualifier names
+        """
+        self.regenerate_only_changed = True
+        return self.run(fail_fast, self.graph.get_dirty_entities(changed))
@@ -0,0 +1,139 @@
+import json
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from utils.DependencyGraph import CodeEntity, Edge
+from utils.util import ContentExtractor
+
+
+class StreamingPlanParser:
+    """
+    Turns a streamed code plan into CodeEntity objects, emitting one entity per completed 'Step N:' line
+    so that downstream generation can start before the whole plan has arrived.
+    """
+    STEP_LINE_PATTERN = re.compile(r'\s*Step\s*\d+\s*:', re.I)
+
+    def __init__(self, parent_code_entity: CodeEntity = None):
+        self.parent_code_entity = parent_code_entity
+        self.code_entities: List[CodeEntity] = []
+        self._pending: List[str] = []
+
+    def _parse_line(self, line: str) -> Optional[CodeEntity]:
+        if re.match(StreamingPlanParser.STEP_LINE_PATTERN, line) is None:
+            return None
+        code_entity = ContentExtractor.extract_code_entity_from_step(line, self.parent_code_entity)
+        self.code_entities.append(code_entity)
+        return code_entity
+
+    def feed(self, chunk: str) -> List[CodeEntity]:
+        """
+        :param chunk: next piece of streamed text
+        :return code entities whose step line was completed by this chunk
+        """
+        if not chunk:
+            return []
+        if '\n' not in chunk:
+            self._pending.append(chunk)
+            return []
+        lines = chunk.split('\n')
+        self._pending.append(lines[0])
+        completed = [''.join(self._pending)] + lines[1:-1]
+        self._pending = [lines[-1]]
+        code_entities = []
+        for line in completed:
+            code_entity = self._parse_line(line)
+            if code_entity is not None:
+                code_entities.append(code_entity)
+        return code_entities
+
+    def close(self) -> List[CodeEntity]:
+        """
+        Flush the last line, which is not terminated by a newline at the end of the stream
+        """
+        line = ''.join(self._pending)
+        self._pending = []
+        code_entity = self._parse_line(line)
+        return [code_entity] if code_entity is not None else []
+
+    def parse(self, stream: Iterable[str]) -> Iterator[CodeEntity]:
+        for chunk in stream:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+
+class StreamingDependencyParser:
+    """
+    Turns a streamed dependency json ({"to entity": [{"explanation": ..., "used_class": ...}, ...], ...}) into Edge
+    objects, emitting one edge per completed inner json object.
+    Text outside the top level json object (e.g. markdown fences) is ignored.
+    """
+
+    def __init__(self, code_entities_dict: Dict[str, CodeEntity], parent_entity: CodeEntity = None):
+        self.code_entities_dict = code_entities_dict
+        self.parent_entity = parent_entity
+        self.edges: List[Edge] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._finished = False
+        self._string_chars: List[str] = []
+        self._last_string: Optional[str] = None
+        self._to_entity_name: Optional[str] = None
+        self._object_chars: List[str] = []
+
+    def _create_edge(self, edge_text: str) -> Edge:
+        assert self._to_entity_name is not None, f'{edge_text} does not belong to any code entity'
+        to_entity_name = self._to_entity_name
+        if self.parent_entity:
+            to_entity_name = self.parent_entity.get_qualifier_name() + '.' + to_entity_name
+        edge = Edge.create_edge_from_dict(to_entity_name, json.loads(edge_text), self.code_entities_dict,
+                                          self.parent_entity)
+        self.edges.append(edge)
+        return edge
+
+    def feed(self, chunk: str) -> List[Edge]:
+        """
+        :param chunk: next piece of streamed text
+        :return edges whose json object was completed by this chunk
+        """
+        edges: List[Edge] = []
+        if not chunk or self._finished:
+            return edges
+        for ch in chunk:
+            if self._depth >= 3:
+                self._object_chars.append(ch)
+            if self._in_string:
+                if self._depth == 1:
+                    self._string_chars.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = json.loads('"' + ''.join(self._string_chars))
+                continue
+            if ch == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_chars = []
+            elif ch == ':' and self._depth == 1:
+                self._to_entity_name = self._last_string
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 3:
+                    self._object_chars = [ch]
+            elif ch in '}]' and self._depth > 0:
+                if self._depth == 3:
+                    edges.append(self._create_edge(''.join(self._object_chars)))
+                    self._object_chars = []
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finished = True
+                    break
+        return edges
+
+    def parse(self, stream: Iterable[str]) -> Iterator[Edge]:
+        for chunk in stream:
+            yield from self.feed(chunk)
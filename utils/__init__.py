@@ -1,3 +1,17 @@
-from utils.util import Logger
+from typing import Any
 
-logger = Logger()
+_logger = None
+
+
+def __getattr__(name: str) -> Any:
+    # Logger creates its log directory and configures logging, so it is only built once somebody uses it
+    global _logger
+    if name == "logger":
+        if _logger is None:
+            from utils.util import Logger
+            _logger = Logger()
+        return _logger
+    if name == "Logger":
+        from utils.util import Logger
+        return Logger
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,21 +2,22 @@ import abc
 import logging
 import os.path
 from abc import abstractmethod
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, TYPE_CHECKING
 
 import yaml
 from injector import singleton
 
-from Agents.Agent import Agent
 from collections import deque
 
 from llm import PROJECT_DIR
-from llm.api import LLMApi
 
 import re
 
 from utils.DependencyGraph import CodeEntity, CodeEntityType
 
+if TYPE_CHECKING:
+    from Agents.Agent import Agent
+
 
 class QAExample:
     @staticmethod
@@ -84,7 +85,7 @@ class QAExamples:
 
 
 class Message:
-    def __init__(self, sender: Agent = None, receiver: Agent = None, content: Any = None):
+    def __init__(self, sender: 'Agent' = None, receiver: 'Agent' = None, content: Any = None):
         self.sender = sender
         self.receiver = receiver
         self.content = content
@@ -95,10 +96,10 @@ class Message:
     def setContent(self, new_content):
         self.content = new_content
 
-    def setSender(self, send_from: Agent):
+    def setSender(self, send_from: 'Agent'):
         self.sender = send_from
 
-    def setReceiver(self, send_to: Agent):
+    def setReceiver(self, send_to: 'Agent'):
         self.receiver = send_to
 
     def getSender(self):
@@ -162,8 +163,8 @@ class YamlReader:
 
 
 class ContentExtractor:
-    STEP_PATTERN = re.compile(r'Step\s+\d\s*:\s*Create a (\w+) called (\w+).This class will be responsible for (\w+)',
-                              re.I)
+    STEP_PATTERN = re.compile(r'Step\s*\d+\s*:\s*Create a (\w+) called (\w+)\s*\.\s*'
+                              r'This \w+ will be responsible for (.+?)\.?$', re.I)
 
     @staticmethod
     def _get_code_entity_type(entity_type: str) -> Optional[CodeEntityType]: